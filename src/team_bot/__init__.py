@@ -0,0 +1,4 @@
+import time
+
+# When the team_bot package was first imported, the start of the startup timing breakdown
+IMPORTED_AT = time.monotonic()
@@ -0,0 +1,301 @@
+import asyncio
+import functools
+import tempfile
+import time
+from collections import Counter
+from typing import Callable
+
+from deltachat_rpc_client import Account, DeltaChat, EventType
+from deltachat_rpc_client._utils import AttrDict
+
+from .catchup import CatchUpBot
+from .engine import AsyncRelayEngine
+from .fakerpc import FakeCore, FakeRpc
+from .relay import relayhooks
+from .store import get_store
+from .util import set_relay_groups
+
+MAPPINGS = [10, 1000, 50000]
+EVENTS = 1000
+HISTORY = 5000
+ACTIVE_CHATS = 50  # how many of the mapped outside chats actually exist and get messages
+CREW_SIZE = 5
+RPC_LATENCY = 0.001  # how many seconds an RPC call takes in the concurrency scenario, like a local server
+
+
+class HandlerStats:
+    """Latency and RPC calls of the invocations of one hook."""
+
+    def __init__(self):
+        self.latencies = []
+        self.rpc_calls = 0
+
+    def record(self, latency: float, rpc_calls: int):
+        self.latencies.append(latency)
+        self.rpc_calls += rpc_calls
+
+    def report(self, name: str) -> str:
+        latencies = sorted(self.latencies)
+        count = len(latencies)
+        average = sum(latencies) / count
+        p95 = latencies[min(count - 1, int(count * 0.95))]
+        return (
+            f"  {name}: {count} calls, avg {average * 1000:.2f}ms, p95 {p95 * 1000:.2f}ms, "
+            f"max {latencies[-1] * 1000:.2f}ms, {self.rpc_calls / count:.1f} RPC calls per call"
+        )
+
+
+class BenchResult:
+    """The outcome of one benchmark scenario."""
+
+    def __init__(self, name: str, events: int, seconds: float, rpc_calls: Counter, handlers: {str: HandlerStats}):
+        self.name = name
+        self.events = events
+        self.seconds = seconds
+        self.rpc_calls = rpc_calls
+        self.handlers = handlers
+
+    @property
+    def rpc_calls_per_event(self) -> float:
+        return sum(self.rpc_calls.values()) / self.events
+
+    def report(self) -> str:
+        lines = [
+            f"{self.name}: {self.events} events in {self.seconds:.2f}s "
+            f"({self.events / self.seconds:.0f}/s), {self.rpc_calls_per_event:.1f} RPC calls per event"
+        ]
+        lines += [stats.report(name) for name, stats in sorted(self.handlers.items())]
+        top = ", ".join(f"{method} {count}" for method, count in self.rpc_calls.most_common(5))
+        lines.append(f"  top RPC methods: {top}")
+        return "\n".join(lines)
+
+
+class TimedBot:
+    """A bot client with timed relay hooks, for an account on a FakeRpc.
+
+    :param account: the bot's account object
+    """
+
+    def __init__(self, account: Account):
+        self.account = account
+        self.rpc = account._rpc
+        self.core = self.rpc.core
+        self.handlers = {}
+        hooks = [(self.timed(hook), event_filter) for hook, event_filter in relayhooks]
+        self.client = CatchUpBot(self.account, hooks)
+
+    def contact(self, addr: str, name: str) -> int:
+        return self.core.create_contact(self.account.id, addr, name)
+
+    def timed(self, hook: Callable) -> Callable:
+        """Wrap a hook to record its latency and RPC calls."""
+        stats = self.handlers.setdefault(hook.__name__, HandlerStats())
+
+        def timed_hook(event: AttrDict):
+            rpc_calls = self.rpc.call_count()
+            start = time.perf_counter()
+            hook(event)
+            stats.record(time.perf_counter() - start, self.rpc.call_count() - rpc_calls)
+
+        return timed_hook
+
+    def emit(self, kind: EventType, process_messages: bool = True, **fields):
+        """Feed an event into the bot client, like its event loop does."""
+        event = AttrDict(kind=kind, account=self.account, **fields)
+        self.client._on_event(event)
+        if kind == EventType.INCOMING_MSG and process_messages:
+            self.client._process_messages()
+
+    def receive(self, chat_id: int, from_id: int, text: str, **fields) -> int:
+        """Let a message arrive, and feed the INCOMING_MSG event into the bot client."""
+        msg_id = self.core.receive(self.account.id, chat_id, from_id, text, **fields)
+        self.emit(EventType.INCOMING_MSG, chat_id=chat_id, msg_id=msg_id)
+        return msg_id
+
+    def outsider_of(self, outside_id: int) -> int:
+        return self.core.get_chat_contacts(self.account.id, outside_id)[0]
+
+    def last_message(self, chat_id: int) -> int:
+        return self.core.get_message_ids(self.account.id, chat_id, False, False)[-1]
+
+    def measure(self, name: str, events: int, run: Callable[[], None]) -> BenchResult:
+        """Run a scenario, and return its latency and RPC call statistics."""
+        for stats in self.handlers.values():
+            stats.latencies.clear()
+            stats.rpc_calls = 0
+        self.rpc.calls.clear()
+        start = time.perf_counter()
+        run()
+        seconds = time.perf_counter() - start
+        handlers = {name: stats for name, stats in self.handlers.items() if stats.latencies}
+        return BenchResult(name, events, seconds, Counter(self.rpc.calls), handlers)
+
+    def close(self):
+        get_store(self.account).close()
+
+
+class Team(TimedBot):
+    """A bot account on a FakeRpc, with a crew and relay mappings.
+
+    :param accounts_dir: the directory in which the fake accounts directory is created
+    :param mappings: how many relay mappings the bot has
+    """
+
+    def __init__(self, accounts_dir: str, mappings: int):
+        super().__init__(DeltaChat(FakeRpc(FakeCore(tempfile.mkdtemp(dir=accounts_dir)))).add_account())
+        self.account.set_config("configured_addr", "bot@example.org")
+        self.account.set_config("displayname", "Team Bot")
+
+        self.crew = self.account.create_group("Team")
+        self.crew_members = [self.contact(f"crew{i}@example.org", f"Crew {i}") for i in range(CREW_SIZE)]
+        for member in self.crew_members:
+            self.crew.add_contact(member)
+        self.account.set_config("ui.crew_id", str(self.crew.id))
+
+        self.chats = []  # the (outside chat ID, relay group ID) pairs which exist
+        for i in range(min(mappings, ACTIVE_CHATS)):
+            outsider = self.contact(f"outsider{i}@example.org", f"Outsider {i}")
+            outside_id = self.core.create_chat_by_contact_id(self.account.id, outsider)
+            relay_id = self.core.create_group_chat(self.account.id, f"[bot] Outsider {i}", False)
+            for member in self.crew_members:
+                self.core.add_contact_to_chat(self.account.id, relay_id, member)
+            self.core.misc_send_text_message(self.account.id, relay_id, f"This is a chat with Outsider {i}")
+            self.chats.append((outside_id, relay_id))
+        # the other mappings only need to exist in the relay index and the store
+        padding = [(1_000_000 + i, 2_000_000 + i) for i in range(mappings - len(self.chats))]
+        set_relay_groups(self.account, self.chats + padding)
+
+
+def bench_relay(accounts_dir: str, mappings: int, events: int = EVENTS) -> BenchResult:
+    """Outsiders write to the team, and the crew answers in the relay groups."""
+    team = Team(accounts_dir, mappings)
+
+    def run():
+        for i in range(events // 2):
+            outside_id, relay_id = team.chats[i % len(team.chats)]
+            team.receive(outside_id, team.outsider_of(outside_id), f"Question {i}")
+            forwarded = team.last_message(relay_id)
+            team.receive(relay_id, team.crew_members[i % CREW_SIZE], f"Answer {i}", quotedMessageId=forwarded)
+
+    result = team.measure(f"relay, {mappings} mappings", events // 2 * 2, run)
+    team.close()
+    return result
+
+
+def bench_delivery_storm(accounts_dir: str, mappings: int, events: int = EVENTS) -> BenchResult:
+    """Many answers of the crew are delivered to the outsiders at once."""
+    team = Team(accounts_dir, mappings)
+    delivered = []
+    for i in range(min(events, len(team.chats) * 10)):
+        outside_id, relay_id = team.chats[i % len(team.chats)]
+        question = team.core.misc_send_text_message(team.account.id, relay_id, f"Question {i}")
+        team.receive(relay_id, team.crew_members[0], f"Answer {i}", quotedMessageId=question)
+        delivered.append((outside_id, team.last_message(outside_id)))
+
+    def run():
+        for i in range(events):
+            chat_id, msg_id = delivered[i % len(delivered)]
+            team.emit(EventType.MSG_DELIVERED, chat_id=chat_id, msg_id=msg_id)
+
+    result = team.measure(f"delivery storm, {mappings} mappings", events, run)
+    team.close()
+    return result
+
+
+def bench_backlog(accounts_dir: str, mappings: int, events: int = EVENTS) -> BenchResult:
+    """The bot restarts after an outage, and many messages of the outsiders wait for it."""
+    team = Team(accounts_dir, mappings)
+    for i in range(events):
+        outside_id, _relay_id = team.chats[i % len(team.chats)]
+        team.core.receive(team.account.id, outside_id, team.outsider_of(outside_id), f"Question {i}")
+
+    def run():
+        team.emit(EventType.INCOMING_MSG, chat_id=0, msg_id=0)
+
+    result = team.measure(f"backlog, {mappings} mappings", events, run)
+    team.close()
+    return result
+
+
+def bench_history(accounts_dir: str, history: int = HISTORY, events: int = EVENTS // 50) -> BenchResult:
+    """Messages which are not in the forwarding ledger are delivered in a relay group with a long history."""
+    team = Team(accounts_dir, ACTIVE_CHATS)
+    outside_id, relay_id = team.chats[0]
+    account_id = team.account.id
+    # an answer forwarded before the bot kept a forwarding ledger
+    question = team.core.misc_send_text_message(account_id, relay_id, "Question")
+    team.core.add_message(account_id, relay_id, team.crew_members[0], "Old answer", quotedMessageId=question)
+    sent_id = team.core.misc_send_text_message(account_id, outside_id, "Old answer")
+    for i in range(history):
+        team.core.add_message(account_id, relay_id, team.crew_members[i % CREW_SIZE], f"Chatter {i}")
+
+    def run():
+        for _ in range(events):
+            team.emit(EventType.MSG_DELIVERED, chat_id=outside_id, msg_id=sent_id)
+
+    result = team.measure(f"history scan, {history} messages", events, run)
+    team.close()
+    return result
+
+
+def feed_sync_loop(team: Team, arrivals: [int]):
+    """Let messages arrive in outside chats, and handle each of them before the next one, like the sync event loop."""
+    for i, outside_id in enumerate(arrivals):
+        team.receive(outside_id, team.outsider_of(outside_id), f"Question {i}")
+
+
+def feed_async_engine(team: Team, arrivals: [int]):
+    """Let messages arrive in outside chats, and hand each of them to an async engine; wait until all are handled."""
+
+    async def feed(engine: AsyncRelayEngine):
+        for i, outside_id in enumerate(arrivals):
+            msg_id = team.core.receive(team.account.id, outside_id, team.outsider_of(outside_id), f"Question {i}")
+            event = AttrDict(kind=EventType.INCOMING_MSG, account=team.account, chat_id=outside_id, msg_id=msg_id)
+            engine.dispatch_event(event)
+            await engine.dispatch_messages()
+        await engine.drain()
+
+    asyncio.run(feed(AsyncRelayEngine(team.client)))
+
+
+def bench_concurrency(accounts_dir: str, events: int = EVENTS // 10, latency: float = RPC_LATENCY) -> [BenchResult]:
+    """Messages of many chats arrive one after another, and each RPC call takes a while.
+
+    The sync event loop handles them one by one; the async engine handles different chats concurrently.
+    With the async engine, the RPC calls per hook include those of the hooks which ran at the same time.
+
+    :return: the results of the sync event loop and of the async engine
+    """
+    results = []
+    for name, feed in (("sync loop", feed_sync_loop), ("async engine", feed_async_engine)):
+        team = Team(accounts_dir, ACTIVE_CHATS)
+        team.rpc.latency = latency
+        arrivals = [team.chats[i % len(team.chats)][0] for i in range(events)]
+        run = functools.partial(feed, team, arrivals)
+        results.append(team.measure(f"{name}, {latency * 1000:g}ms RPC latency", events, run))
+        team.close()
+    return results
+
+
+def run_benchmarks(mappings: [int] = MAPPINGS, events: int = EVENTS, history: int = HISTORY) -> [BenchResult]:
+    """Run all benchmark scenarios on fake accounts in a temporary directory.
+
+    :param mappings: the numbers of relay mappings to run the relay and delivery scenarios with
+    :param events: how many events each scenario feeds into the relay hooks
+    :param history: how many messages the relay group of the history scenario has
+    """
+    results = []
+    with tempfile.TemporaryDirectory(prefix="team-bot-bench-") as accounts_dir:
+        for count in mappings:
+            results.append(bench_relay(accounts_dir, count, events))
+            results.append(bench_delivery_storm(accounts_dir, count, events))
+            results.append(bench_backlog(accounts_dir, count, events))
+        results.append(bench_history(accounts_dir, history, max(1, events // 50)))
+        results += bench_concurrency(accounts_dir, max(1, events // 10))
+    return results
+
+
+def main(mappings: [int] = MAPPINGS, events: int = EVENTS, history: int = HISTORY):
+    """Run the benchmarks and print their results."""
+    for result in run_benchmarks(mappings, events, history):
+        print(result.report())
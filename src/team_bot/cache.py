@@ -0,0 +1,126 @@
+import logging
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Callable
+
+from deltachat_rpc_client import Account, Chat, Contact, EventType, Message
+from deltachat_rpc_client._utils import AttrDict
+
+log = logging.getLogger("root")
+
+CACHE_SIZE = 1024
+
+# Snapshot caches of all accounts in this process, per RPC connection and account ID
+_caches = weakref.WeakKeyDictionary()
+
+MSG_EVENTS = (
+    EventType.INCOMING_MSG,
+    EventType.MSGS_CHANGED,
+    EventType.MSG_DELIVERED,
+    EventType.MSG_FAILED,
+    EventType.MSG_READ,
+    EventType.MSG_DELETED,
+    EventType.MSGS_NOTICED,
+    EventType.REACTIONS_CHANGED,
+    EventType.INCOMING_REACTION,
+)
+CHAT_EVENTS = (
+    EventType.CHAT_MODIFIED,
+    EventType.CHAT_DELETED,
+    EventType.CHAT_EPHEMERAL_TIMER_MODIFIED,
+)
+
+
+class SnapshotCache:
+    """LRU cache of chat, contact, and message snapshots of one account.
+
+    Entries are keyed by (kind, id) and dropped when the core reports a change to them.
+    A snapshot which was invalidated while it was being fetched is returned, but not cached,
+    as it may have been fetched before the change.
+    """
+
+    def __init__(self, maxsize: int = CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.fetching = {}  # (kind, id): [how many threads fetch it, whether it was invalidated meanwhile]
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kind: str, obj_id: int, fetch: Callable[[], AttrDict]) -> AttrDict:
+        """Return a cached snapshot, or fetch and cache it."""
+        key = (kind, obj_id)
+        with self.lock:
+            snapshot = self.entries.get(key)
+            if snapshot is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return snapshot
+            self.misses += 1
+            fetching = self.fetching.setdefault(key, [0, False])
+            fetching[0] += 1
+        snapshot = None
+        try:
+            snapshot = fetch()
+        finally:
+            with self.lock:
+                fetching[0] -= 1
+                if not fetching[0]:
+                    del self.fetching[key]
+                if snapshot is not None and not fetching[1]:
+                    self.entries[key] = snapshot
+                    self.entries.move_to_end(key)
+                    while len(self.entries) > self.maxsize:
+                        self.entries.popitem(last=False)
+        return snapshot
+
+    def invalidate(self, kind: str, obj_id: int = None):
+        """Drop one snapshot, or all snapshots of a kind if no ID is given."""
+        with self.lock:
+            if obj_id:
+                self.entries.pop((kind, obj_id), None)
+            else:
+                for key in [key for key in self.entries if key[0] == kind]:
+                    del self.entries[key]
+            for key, fetching in self.fetching.items():
+                if key == (kind, obj_id) or (not obj_id and key[0] == kind):
+                    fetching[1] = True
+
+    def on_event(self, event: AttrDict):
+        """Drop the snapshots a core event reports as changed."""
+        if event.kind in MSG_EVENTS:
+            self.invalidate("message", event.get("msg_id"))
+        elif event.kind in CHAT_EVENTS:
+            self.invalidate("chat", event.get("chat_id"))
+        elif event.kind == EventType.CONTACTS_CHANGED:
+            self.invalidate("contact", event.get("contact_id"))
+            self.invalidate("chat")  # names and avatars of 1:1 chats are taken from the contact
+
+    def stats(self) -> dict:
+        """Return the hit and miss counters and the number of cached snapshots."""
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.entries)}
+
+
+def get_cache(account: Account) -> SnapshotCache:
+    """Return the snapshot cache of an account, create it on first access."""
+    caches = _caches.setdefault(account._rpc, {})
+    cache = caches.get(account.id)
+    if cache is None:
+        cache = caches[account.id] = SnapshotCache()
+    return cache
+
+
+def chat_snapshot(chat: Chat) -> AttrDict:
+    """Return the full snapshot of a chat, from the cache if possible."""
+    return get_cache(chat.account).get("chat", chat.id, chat.get_full_snapshot)
+
+
+def contact_snapshot(contact: Contact) -> AttrDict:
+    """Return the snapshot of a contact, from the cache if possible."""
+    return get_cache(contact.account).get("contact", contact.id, contact.get_snapshot)
+
+
+def message_snapshot(message: Message) -> AttrDict:
+    """Return the snapshot of a message, from the cache if possible."""
+    return get_cache(message.account).get("message", message.id, message.get_snapshot)
@@ -0,0 +1,81 @@
+import logging
+import time
+from typing import Hashable, Iterable, Optional
+
+from deltachat_rpc_client import Account, Bot, Message, SpecialContactId
+from deltachat_rpc_client._utils import AttrDict
+from deltachat_rpc_client.const import SystemMessageType
+
+from .util import get_ordering_key
+
+log = logging.getLogger("root")
+
+CATCH_UP_THRESHOLD = 20  # this many waiting messages are a backlog, e.g. after a restart or an outage
+
+
+def handle_message(client: Bot, snapshot: AttrDict):
+    """Run the message hooks of a client for one message, like Client._process_messages does."""
+    if snapshot.from_id not in [SpecialContactId.SELF, SpecialContactId.DEVICE]:
+        client._on_new_msg(snapshot)
+    if snapshot.is_info and snapshot.system_message_type != SystemMessageType.WEBXDC_INFO_MESSAGE:
+        client._handle_info_msg(snapshot)
+
+
+def group_by_chat(account: Account, messages: [Message]) -> {Hashable: [AttrDict]}:
+    """Return the snapshots of messages grouped by the ordering key of their chats, in order of arrival."""
+    chats = {}
+    for message in messages:
+        snapshot = message.get_snapshot()
+        chats.setdefault(get_ordering_key(account, snapshot.chat_id), []).append(snapshot)
+    return chats
+
+
+def handle_messages(client: Bot, snapshots: [AttrDict]):
+    """Handle messages of one chat in order, and mark them as seen once they were handled.
+
+    If handling fails midway, none of them is marked as seen, so they are fetched again after a restart.
+    """
+    for snapshot in snapshots:
+        handle_message(client, snapshot)
+    client.account.mark_seen_messages([snapshot.message for snapshot in snapshots])
+
+
+class CatchUpBot(Bot):
+    """A bot which handles a backlog of messages in catch-up mode, and single messages as they come.
+
+    In catch-up mode, all waiting messages are handled grouped by chat, so the cached snapshots of each chat
+    and its relay group are reused for all of its messages instead of being evicted in between.
+    Messages of one chat and its relay group are still handled in order of arrival,
+    and marked as seen with one RPC call once they were handled; a crash midway leaves the rest unseen.
+
+    :param account: the bot's account object
+    :param hooks: the hooks of the bot
+    :param threshold: handle this many or more waiting messages in catch-up mode
+    """
+
+    def __init__(self, account: Account, hooks: Optional[Iterable] = None, threshold: int = CATCH_UP_THRESHOLD):
+        super().__init__(account, hooks)
+        self.threshold = threshold
+
+    def _process_messages(self) -> None:
+        if not self._should_process_messages:
+            return
+        messages = self.account.get_next_messages()
+        if len(messages) >= self.threshold:
+            self.catch_up(messages)
+            return
+        for message in messages:
+            handle_message(self, message.get_snapshot())
+            message.mark_seen()
+
+    def catch_up(self, messages: [Message]):
+        """Handle a backlog of messages chat by chat, and log how long it took."""
+        start = time.monotonic()
+        log.info(f"Account {self.account.id}: catching up with {len(messages)} messages")
+        chats = group_by_chat(self.account, messages)
+        for snapshots in chats.values():
+            handle_messages(self, snapshots)
+        log.info(
+            f"Account {self.account.id}: caught up with {len(messages)} messages in {len(chats)} chats "
+            f"in {time.monotonic() - start:.1f}s, back to live processing"
+        )
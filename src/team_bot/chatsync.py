@@ -0,0 +1,123 @@
+import hashlib
+import logging
+import threading
+import time
+import weakref
+from typing import Optional
+
+from deltachat_rpc_client import Account, Chat
+from deltachat_rpc_client.rpc import JsonRpcError
+
+from .cache import chat_snapshot, get_cache
+from .store import get_store
+from .util import get_relay_index
+
+log = logging.getLogger("root")
+
+RECONCILE_INTERVAL = 3600.0
+
+
+def image_hash(path: Optional[str]) -> Optional[str]:
+    """Return the SHA-256 hash of an image file, or None if there is no image."""
+    if not path:
+        return None
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def relay_group_name(account: Account, outside_chat: Chat) -> str:
+    """Return the name a relay group should have: the bot's address local part and the name of the outside chat."""
+    return "[%s] %s" % (account.get_config("addr").split("@")[0], chat_snapshot(outside_chat).name)
+
+
+def sync_image(outside_chat: Chat, relay_group: Chat) -> bool:
+    """Give a relay group the image of its outside chat, unless it has the same image already.
+
+    The hash of the image which was set last is kept in the store,
+    so an unchanged image is neither compared with the relay group's copy nor uploaded again.
+
+    :return: whether the image was changed
+    """
+    profile_image = chat_snapshot(outside_chat).profile_image
+    digest = image_hash(profile_image)
+    store = get_store(relay_group.account)
+    if store.get_image_hash(relay_group.id) == digest:
+        return False
+    log.info(f"Updating the image of relay group {relay_group.id}")
+    relay_group.set_image(profile_image)
+    store.set_image_hash(relay_group.id, digest)
+    get_cache(relay_group.account).invalidate("chat", relay_group.id)
+    return True
+
+
+def sync_name(outside_chat: Chat, relay_group: Chat) -> bool:
+    """Rename a relay group after its outside chat, unless it has the right name already.
+
+    :return: whether the name was changed
+    """
+    group_name = relay_group_name(relay_group.account, outside_chat)
+    if chat_snapshot(relay_group).name == group_name:
+        return False
+    log.info(f"Renaming relay group {relay_group.id} to {group_name}")
+    relay_group.set_name(group_name)
+    get_cache(relay_group.account).invalidate("chat", relay_group.id)
+    return True
+
+
+def sync_chat(outside_chat: Chat, relay_group: Chat) -> bool:
+    """Give a relay group the name and the image of its outside chat; return whether anything changed."""
+    renamed = sync_name(outside_chat, relay_group)
+    return sync_image(outside_chat, relay_group) or renamed
+
+
+class Reconciliation:
+    """Compare the names and images of all relay groups with their outside chats now and then.
+
+    Changes are synced when the outside chat is modified;
+    this catches those which come without such an event, e.g. a new avatar of an outsider.
+    Until it is started, nothing is compared.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.accounts = weakref.WeakKeyDictionary()  # per RPC connection and account ID
+
+    def start(self, interval: float = RECONCILE_INTERVAL):
+        self.enabled = True
+        threading.Thread(target=self._reconcile_periodically, args=(interval,), daemon=True).start()
+        log.info(f"Comparing relay groups with their outside chats every {interval}s")
+
+    def watch(self, account: Account):
+        self.accounts.setdefault(account._rpc, {})[account.id] = account
+
+    def reconcile(self, account: Account) -> int:
+        """Sync all relay groups of an account with their outside chats.
+
+        :return: how many relay groups were changed
+        """
+        changed = 0
+        for outside_id, relay_group_id in get_relay_index(account).mappings():
+            try:
+                changed += sync_chat(account.get_chat_by_id(outside_id), account.get_chat_by_id(relay_group_id))
+            except JsonRpcError as e:
+                log.debug(f"Could not compare relay group {relay_group_id} with chat {outside_id}: {e}")
+        if changed:
+            log.info(f"Account {account.id}: synced {changed} relay groups with their outside chats")
+        return changed
+
+    def _reconcile_periodically(self, interval: float):
+        while True:
+            time.sleep(interval)
+            for accounts in list(self.accounts.values()):
+                for account in list(accounts.values()):
+                    try:
+                        self.reconcile(account)
+                    except Exception:
+                        log.exception(f"Comparing the relay groups of account {account.id} failed")
+
+
+RECONCILIATION = Reconciliation()
+
+
+def start_reconciling(interval: float = RECONCILE_INTERVAL):
+    RECONCILIATION.start(interval)
@@ -2,18 +2,29 @@ import json
 import logging
 import os
 
-import pickledb
-from deltachat_rpc_client import Account, Chat, DeltaChat, Message, Rpc
+from deltachat_rpc_client import Account, Chat, Contact, DeltaChat, Message, Rpc
 from deltachat_rpc_client._utils import AttrDict
 from deltachat_rpc_client.rpc import JsonRpcError
 
-from .util import get_relay_groups, parse_new_command_args, set_relay_groups
+from .cache import contact_snapshot
+from .flood import get_flood_guard
+from .jobs import ONBOARDING_BATCH_SIZE, ONBOARDING_PAUSE, MembershipJob
+from .store import get_store
+from .util import (
+    get_member_relay_groups,
+    get_relay_index,
+    index_relay_members,
+    parse_new_command_args,
+    set_relay_groups,
+)
 
 log = logging.getLogger("root")
 
 
 def migrate_from_cffi(accounts_dir: str, **kwargs):
     """Migrate the data from an old pickle DB to the new account's config sqlite table."""
+    import pickledb  # noqa: PLC0415 - only needed once, for this migration
+
     migration_dir = os.path.normpath(accounts_dir) + ".migrating"
     log.warning(f"Storing debug in {migration_dir} intermittently...")
 
@@ -68,6 +79,8 @@ Change the bot's avatar:\t/set_avatar <attach image>
 Generate invite link:\t\t/generate_invite
 Show this help text:\t\t/help
 Change the help message for outsiders:\t/set_outside_help Hello outsider
+Merge messages of outsiders over a limit per minute:\t/set_flood_limit 20
+Merge the texts outsiders send within 30 seconds (in a relay group):\t/digest 30
     """
     return help_text
 
@@ -83,6 +96,40 @@ def set_outside_help(account: Account, help_message: str):
     account.set_config("ui.outside_help_message", help_message)
 
 
+def set_flood_limit(account: Account, argument: str) -> str:
+    """Set how many messages per minute an outsider may send before they are merged.
+
+    :return: a success/failure message
+    """
+    try:
+        limit = int(argument)
+    except ValueError:
+        return "Usage: /set_flood_limit 20 (messages per minute, 0 turns the limit off)"
+    account.set_config("ui.flood_limit", str(limit))
+    get_flood_guard(account).set_limit(limit)
+    if not limit:
+        return "Turned the flood limit off, all messages of outsiders are relayed right away."
+    return f"Messages of outsiders over {limit} per minute are now merged into one."
+
+
+def set_digest(account: Account, relay_group_id: int, argument: str) -> str:
+    """Set the digest window of a relay group.
+
+    :return: a success/failure message
+    """
+    try:
+        seconds = float(argument)
+    except ValueError:
+        return "Usage: /digest 30 (seconds, 0 turns digests off)"
+    get_store(account).set_digest_window(relay_group_id, seconds)
+    guard = get_flood_guard(account)
+    if not seconds:
+        guard.digests.pop(relay_group_id, None)
+        return "Turned digests off, every message of the outsider is relayed on its own."
+    guard.digests[relay_group_id] = seconds
+    return f"Text messages the outsider sends within {seconds:g} seconds are now merged into one."
+
+
 def set_display_name(account: Account, display_name: str) -> str:
     """Set the display name of the bot.
 
@@ -159,6 +206,7 @@ def start_chat(
     view_type = command.view_type
     log.debug(f"Message has view_type {view_type} with the attachment {attachment}")
     message = chat.send_message(text=text, viewtype=view_type, file=attachment)
+    get_store(ac).add_forwarded_message(message.id, command.chat_id, command.id)
     return message, "Message successfully sent."
 
 
@@ -174,6 +222,60 @@ def add_contact(account: Account, command: AttrDict) -> str:
     return "Contact imported. You can now write them with: /new_message " + possible_recipients
 
 
+def outside_chats_of(account: Account, contact: Contact) -> {int}:
+    """Return the IDs of the outside chats a contact is a member of, e.g. as an outsider who later joined the crew.
+
+    The members of all outside chats are requested at once and awaited together.
+    """
+    rpc = account._rpc
+    index = get_relay_index(account)
+    futures = [
+        (outside_id, rpc.get_chat_contacts.future(account.id, outside_id)) for outside_id in index.relay_by_outside
+    ]
+    outside_chats = set()
+    for outside_id, future in futures:
+        try:
+            if contact.id in future():
+                outside_chats.add(outside_id)
+        except JsonRpcError as e:
+            log.debug(f"Could not get the members of outside chat {outside_id}: {e}")
+    return outside_chats
+
+
+def onboard(msg: AttrDict, displayname: str) -> None:
+    """Add a new crew member to all existing relay groups, except those of the chats they are an outsider in.
+
+    Big crews are onboarded in a throttled background job, so the group change messages don't flood the SMTP server.
+
+    :param msg: the AttrDict of the message causing the member addition.
+    :param displayname: the display name of a contact which just got added to the crew.
+    """
+    account = msg.chat.account
+    if msg.info_contact_id:
+        new_member = account.get_contact_by_id(msg.info_contact_id)
+    else:
+        new_member = None
+        for contact in msg.chat.get_contacts():
+            if contact_snapshot(contact).display_name.lower() == displayname:
+                new_member = contact
+    if not new_member or new_member == account.self_contact:
+        log.error(f"Could not find contact for {displayname} in crew members")
+        return
+
+    index_relay_members(account)
+    already_member = set(get_store(account).relay_groups_of(new_member.id))
+    own_chats = outside_chats_of(account, new_member)
+    relay_groups = [
+        account.get_chat_by_id(relay_group_id)
+        for outside_id, relay_group_id in get_relay_index(account).mappings()
+        if relay_group_id not in already_member and outside_id not in own_chats
+    ]
+    log.info(f"Onboarding {displayname} into {len(relay_groups)} relay groups")
+    MembershipJob(
+        account, new_member, relay_groups, batch_size=ONBOARDING_BATCH_SIZE, pause=ONBOARDING_PAUSE
+    ).run_or_start()
+
+
 def offboard(msg: AttrDict, displayname: str) -> None:
     """Remove a former crew member from all relay groups they are part of.
 
@@ -183,15 +285,12 @@ def offboard(msg: AttrDict, displayname: str) -> None:
     account = msg.chat.account
     ex_member = None
     for contact in [account.get_contact_by_id(past_id) for past_id in msg.chat.get_full_snapshot().past_contact_ids]:
-        if contact.get_snapshot().display_name.lower() == displayname:
+        if contact_snapshot(contact).display_name.lower() == displayname:
             ex_member = contact
     if not ex_member:
         log.error(f"Could not find contact for {displayname} in past crew members")
 
     else:
-        for mapping in get_relay_groups(account):
-            relay_group = account.get_chat_by_id(mapping[1])
-            if ex_member in relay_group.get_contacts():
-                log.info(f"{relay_group.get_full_snapshot().name}: removing {ex_member.get_snapshot().display_name}")
-                relay_group.remove_contact(ex_member)
-        return
+        relay_groups = get_member_relay_groups(account, ex_member)
+        log.info(f"Offboarding {displayname} from {len(relay_groups)} relay groups")
+        MembershipJob(account, ex_member, relay_groups, remove=True).run_or_start()
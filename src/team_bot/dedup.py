@@ -0,0 +1,98 @@
+import logging
+import threading
+import time
+import weakref
+from typing import Callable
+
+from deltachat_rpc_client import Account
+from deltachat_rpc_client._utils import AttrDict
+
+from .cache import get_cache
+from .metrics import DUPLICATES
+from .store import get_store
+
+log = logging.getLogger("root")
+
+SEEN_TTL = 7 * 24 * 3600.0  # how many seconds to remember a relayed message; copies arrive within hours
+EVICT_INTERVAL = 3600.0  # how often to forget the messages older than SEEN_TTL
+
+# Seen sets of all accounts in this process, per RPC connection and account ID
+_seen_sets = weakref.WeakKeyDictionary()
+
+
+class SeenSet:
+    """The Message-IDs of the messages an account relayed recently, kept in its store.
+
+    The core may hand the bot a message again, e.g. after an IMAP resync, or as a copy from another device.
+    Relaying it again would fan it out to the whole crew, or to the outsider, a second time.
+
+    A Message-ID is stored only once the message was relayed, by the send job in the outbox, like its ledger entry.
+    Until then it is only claimed in memory, so a copy which arrives meanwhile isn't relayed as well,
+    but a relay which failed, or was lost in a crash, doesn't keep the message from being relayed when it comes again.
+
+    :param account: the bot's account object
+    :param ttl: how many seconds to remember a Message-ID
+    :param clock: returns the current time in seconds
+    """
+
+    def __init__(self, account: Account, ttl: float = SEEN_TTL, clock: Callable[[], float] = time.time):
+        self.account = account
+        self.ttl = ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.evicted = 0.0
+        self.claimed = set()  # the Message-IDs of the messages which are being relayed
+
+    def rfc724_mid(self, msg: AttrDict) -> str:
+        """Return the Message-ID of a message; it never changes, so it is cached with the snapshots."""
+        info = get_cache(self.account).get(
+            "message_info", msg.id, lambda: AttrDict(self.account._rpc.get_message_info_object(self.account.id, msg.id))
+        )
+        return info.rfc724_mid
+
+    def first_time(self, msg: AttrDict, chat: str) -> bool:
+        """Return whether a message is handled for the first time, and claim it until it is remembered or released.
+
+        :param msg: the snapshot of the message; its Message-ID is added to it as rfc724_mids, for remember()
+        :param chat: "outside" or "relay", to label the counter of suppressed duplicates
+        """
+        rfc724_mid = self.rfc724_mid(msg)
+        if not rfc724_mid:
+            return True
+        now = self.clock()
+        store = get_store(self.account)
+        with self.lock:
+            if now - self.evicted > EVICT_INTERVAL:
+                self.evicted = now
+                forgotten = store.forget_seen_messages(now - self.ttl)
+                log.debug(f"Account {self.account.id}: forgot {forgotten} seen messages")
+            if rfc724_mid not in self.claimed and not store.has_seen_message(rfc724_mid):
+                self.claimed.add(rfc724_mid)
+                msg["rfc724_mids"] = [rfc724_mid]
+                return True
+        log.info(f"Message {msg.id} in chat {msg.chat_id} arrived again as {rfc724_mid}, not relaying it twice")
+        DUPLICATES.inc(chat=chat)
+        return False
+
+    def remember(self, msg: AttrDict):
+        """Store the Message-IDs of a relayed message, or of the messages merged into it."""
+        now = self.clock()
+        store = get_store(self.account)
+        for rfc724_mid in msg.get("rfc724_mids", ()):
+            store.add_seen_message(rfc724_mid, now)
+            with self.lock:
+                self.claimed.discard(rfc724_mid)
+
+    def release(self, msg: AttrDict):
+        """Give up the claim on a message which couldn't be relayed, so it is relayed if it arrives again."""
+        with self.lock:
+            self.claimed.difference_update(msg.get("rfc724_mids", ()))
+
+
+def get_seen_set(account: Account) -> SeenSet:
+    """Return the seen set of an account, create it on first access."""
+    seen_sets = _seen_sets.setdefault(account._rpc, {})
+    seen_set = seen_sets.get(account.id)
+    if seen_set is None:
+        seen_set = seen_sets[account.id] = SeenSet(account)
+    return seen_set
@@ -0,0 +1,160 @@
+import logging
+import threading
+import time
+from queue import Queue
+from typing import Callable, Hashable, Iterable, Optional
+
+from deltachat_rpc_client import Account, Bot, Message
+from deltachat_rpc_client._utils import AttrDict
+from deltachat_rpc_client.events import RawEvent
+
+from .cache import get_cache
+from .catchup import group_by_chat, handle_messages
+from .metrics import EVENT_LAG
+from .util import get_ordering_key
+
+log = logging.getLogger("root")
+
+
+class InFlight:
+    """The IDs of the messages which were fetched, but are not handled and marked as seen yet.
+
+    Until they are marked as seen, the core returns them again for each new message; they must not be queued twice.
+    """
+
+    def __init__(self):
+        self.ids = set()
+        self.lock = threading.Lock()
+
+    def add_new(self, messages: [Message]) -> [Message]:
+        """Remember the messages which are not in flight yet, and return them."""
+        with self.lock:
+            new = [message for message in messages if message.id not in self.ids]
+            self.ids.update(message.id for message in new)
+        return new
+
+    def handle(self, client: Bot, snapshots: [AttrDict]):
+        """Handle messages of one chat with handle_messages, and forget them afterwards, even if it failed."""
+        try:
+            handle_messages(client, snapshots)
+        finally:
+            with self.lock:
+                self.ids.difference_update(snapshot.id for snapshot in snapshots)
+
+
+class Shard:
+    """The job queue and latency statistics of one worker thread."""
+
+    def __init__(self, number: int, queue_size: int):
+        self.number = number
+        self.queue = Queue(maxsize=queue_size)
+        self.handled = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def record(self, latency: float):
+        self.handled += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+
+    def report(self) -> str:
+        average = self.total_latency / self.handled if self.handled else 0.0
+        return (
+            f"shard {self.number}: {self.queue.qsize()} queued, {self.handled} handled, "
+            f"latency avg {average * 1000:.0f}ms max {self.max_latency * 1000:.0f}ms"
+        )
+
+
+class ShardedDispatcher:
+    """Run jobs on a fixed number of worker threads, sharded by chat.
+
+    All jobs of one chat (and its relay group) land on the same shard and are handled in order;
+    jobs of unrelated chats don't wait behind each other.
+    If a shard's queue is full, submitting blocks until there is room again.
+
+    :param workers: the number of worker threads
+    :param queue_size: how many jobs each shard may queue
+    :param slow_job: log a warning for jobs which took longer than this many seconds, including queueing time
+    :param report_interval: log the statistics of all shards every this many seconds
+    """
+
+    def __init__(self, workers: int = 4, queue_size: int = 1000, slow_job: float = 5.0, report_interval: int = 300):
+        self.shards = [Shard(number, queue_size) for number in range(workers)]
+        self.slow_job = slow_job
+        self.report_interval = report_interval
+        for shard in self.shards:
+            threading.Thread(target=self._work, args=(shard,), daemon=True).start()
+        if report_interval:
+            threading.Thread(target=self._report_periodically, daemon=True).start()
+
+    def submit(self, key: Hashable, job: Callable[[], None]):
+        """Queue a job on the shard of an ordering key."""
+        shard = self.shards[hash(key) % len(self.shards)]
+        shard.queue.put((time.monotonic(), job))
+
+    def _work(self, shard: Shard):
+        while True:
+            queued_at, job = shard.queue.get()
+            EVENT_LAG.observe(time.monotonic() - queued_at)
+            try:
+                job()
+            except Exception:
+                log.exception(f"Job on shard {shard.number} failed")
+            latency = time.monotonic() - queued_at
+            shard.record(latency)
+            if latency > self.slow_job:
+                log.warning(f"Slow job on shard {shard.number}: {latency:.1f}s, {shard.queue.qsize()} jobs queued")
+            shard.queue.task_done()
+
+    def join(self):
+        """Wait until all queued jobs are done."""
+        for shard in self.shards:
+            shard.queue.join()
+
+    def report(self) -> str:
+        """Return queue depth, job count, and latency of every shard."""
+        return "\n".join(shard.report() for shard in self.shards)
+
+    def _report_periodically(self):
+        while True:
+            time.sleep(self.report_interval)
+            log.info("Dispatcher statistics:\n" + self.report())
+
+
+class DispatchingBot(Bot):
+    """A bot which hands its hooks to a ShardedDispatcher instead of running them on the event loop.
+
+    The snapshots an event reports as changed are dropped from the cache on the event loop, before any later job
+    is queued; otherwise a job of another chat on another shard could still read them.
+    """
+
+    def __init__(
+        self,
+        account: Account,
+        hooks: Optional[Iterable] = None,
+        dispatcher: Optional[ShardedDispatcher] = None,
+        **kwargs,
+    ):
+        super().__init__(account, hooks, **kwargs)
+        self.dispatcher = dispatcher or ShardedDispatcher()
+        self.in_flight = InFlight()
+
+    def _on_event(self, event: AttrDict, filter_type=RawEvent) -> None:
+        if filter_type is not RawEvent:
+            return super()._on_event(event, filter_type)  # already running on a shard
+        get_cache(self.account).on_event(event)
+        key = (self.account.id, get_ordering_key(self.account, event.get("chat_id")))
+        self.dispatcher.submit(key, lambda: super(DispatchingBot, self)._on_event(event))
+
+    def _process_messages(self) -> None:
+        """Fetch the next messages and queue them in their chats, one job per chat.
+
+        Each job marks the messages of its chat as seen once they were handled.
+        """
+        if not self._should_process_messages:
+            return
+        messages = self.in_flight.add_new(self.account.get_next_messages())
+        for key, snapshots in group_by_chat(self.account, messages).items():
+            self.dispatcher.submit(
+                (self.account.id, key), lambda snapshots=snapshots: self.in_flight.handle(self, snapshots)
+            )
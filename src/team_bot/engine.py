@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import time
+from typing import Callable, Optional
+
+from deltachat_rpc_client import Bot, EventType
+from deltachat_rpc_client._utils import AttrDict
+
+from .cache import get_cache
+from .catchup import group_by_chat
+from .dispatcher import InFlight
+from .metrics import EVENT_LAG
+from .util import get_ordering_key
+
+log = logging.getLogger("root")
+
+
+class AsyncRelayEngine:
+    """Run the hooks of a bot on an asyncio event loop.
+
+    Events of different chats are handled concurrently,
+    events of the same chat (and its relay group) strictly in the order they arrived:
+    each job holds the asyncio.Lock of its chat while it runs, and the lock wakes its waiters first come, first served.
+    The hooks themselves are synchronous, so each of them runs in a worker thread.
+    """
+
+    def __init__(self, client: Bot):
+        self.client = client
+        self.account = client.account
+        self.locks: dict[Optional[int], asyncio.Lock] = {}
+        self.waiting: dict[Optional[int], int] = {}  # how many jobs hold or wait for each lock
+        self.tasks: set[asyncio.Task] = set()
+        self.in_flight = InFlight()
+
+    def dispatch(self, chat_id: Optional[int], job: Callable[[], None]):
+        """Start a job which runs after the other jobs of its chat."""
+        key = get_ordering_key(self.account, chat_id)
+        lock = self.locks.get(key)
+        if lock is None:
+            lock = self.locks[key] = asyncio.Lock()
+        self.waiting[key] = self.waiting.get(key, 0) + 1
+        task = asyncio.create_task(self._run(key, lock, time.monotonic(), job))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _run(self, key: Optional[int], lock: asyncio.Lock, queued_at: float, job: Callable[[], None]):
+        try:
+            async with lock:
+                EVENT_LAG.observe(time.monotonic() - queued_at)
+                await asyncio.to_thread(job)
+        except Exception:
+            log.exception(f"Job of chat {key} failed")
+        finally:
+            self.waiting[key] -= 1
+            if not self.waiting[key]:
+                del self.waiting[key]
+                del self.locks[key]
+
+    async def drain(self):
+        """Wait until all started jobs are done."""
+        while self.tasks:
+            await asyncio.gather(*self.tasks)
+
+    def dispatch_event(self, event: AttrDict):
+        """Drop the snapshots the event reports as changed right away, and queue its hooks in its chat."""
+        get_cache(self.account).on_event(event)
+        self.dispatch(event.get("chat_id"), lambda: self.client._on_event(event))
+
+    async def dispatch_messages(self):
+        """Fetch the next messages and queue them in their chats, one job per chat.
+
+        Each job marks the messages of its chat as seen once they were handled.
+        """
+        if not self.client._should_process_messages:
+            return
+        messages = self.in_flight.add_new(await asyncio.to_thread(self.account.get_next_messages))
+        chats = await asyncio.to_thread(group_by_chat, self.account, messages)
+        for snapshots in chats.values():
+            self.dispatch(
+                snapshots[0].chat_id, lambda snapshots=snapshots: self.in_flight.handle(self.client, snapshots)
+            )
+
+    async def run_until(self, until: Optional[Callable[[AttrDict], bool]] = None) -> AttrDict:
+        """Process events until a condition returns true, or forever.
+
+        :param until: to stop the engine, make this function return True
+        :return: the last processed event
+        """
+        if self.client.is_configured():
+            await asyncio.to_thread(self.account.start_io)
+        await self.dispatch_messages()
+        while True:
+            event = await asyncio.to_thread(self.account.wait_for_event)
+            event["kind"] = EventType(event.kind)
+            event["account"] = self.account
+            self.dispatch_event(event)
+            if event.kind == EventType.INCOMING_MSG:
+                await self.dispatch_messages()
+            if until:
+                await self.drain()
+                if until(event):
+                    return event
@@ -0,0 +1,471 @@
+import itertools
+import os
+import queue
+import tempfile
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+from deltachat_rpc_client import SpecialContactId
+from deltachat_rpc_client.rpc import JsonRpcError
+
+# The message states of the core
+STATE_IN_FRESH = 10
+STATE_IN_SEEN = 16
+STATE_OUT_PENDING = 20
+STATE_OUT_FAILED = 24
+STATE_OUT_DELIVERED = 26
+
+FIRST_ID = 10  # the core reserves the IDs below for special chats, contacts, and messages
+
+
+class FakeAccount:
+    """The in-memory data of one account of the FakeCore."""
+
+    def __init__(self, account_id: int, accounts_dir: str):
+        self.id = account_id
+        self.dir = os.path.join(accounts_dir, f"fake-{account_id}")
+        os.makedirs(self.dir, exist_ok=True)
+        self.config = {}
+        self.ids = itertools.count(FIRST_ID)
+        self.contacts = {
+            SpecialContactId.SELF: {"address": "", "name": "Me"},
+            SpecialContactId.INFO: {"address": "", "name": "info"},
+            SpecialContactId.DEVICE: {"address": "device@localhost", "name": "Device Messages"},
+        }
+        self.chats = {}
+        self.messages = {}
+        self.next_msgs = []
+        self.events = queue.Queue()
+        self.io_started = False
+
+    def contact(self, contact_id: int) -> dict:
+        try:
+            return self.contacts[contact_id]
+        except KeyError:
+            raise JsonRpcError({"code": -1, "message": f"Contact {contact_id} not found"}) from None
+
+    def chat(self, chat_id: int) -> dict:
+        try:
+            return self.chats[chat_id]
+        except KeyError:
+            raise JsonRpcError({"code": -1, "message": f"Chat {chat_id} not found"}) from None
+
+    def message(self, msg_id: int) -> dict:
+        try:
+            return self.messages[msg_id]
+        except KeyError:
+            raise JsonRpcError({"code": -1, "message": f"Message {msg_id} not found"}) from None
+
+
+class FakeCore:
+    """A minimal in-memory model of the Delta Chat core, implementing the JSON-RPC methods the bot uses.
+
+    The methods have the names and signatures of the deltachat-rpc-server methods,
+    and return what the server would return, in camelCase.
+    Methods which are not implemented raise a JsonRpcError, like unknown methods of the server.
+
+    :param accounts_dir: where to put the account directories, a new temporary directory by default
+    """
+
+    def __init__(self, accounts_dir: Optional[str] = None):
+        self.accounts_dir = accounts_dir or tempfile.mkdtemp(prefix="team-bot-fake-")
+        self.accounts = {}
+        self.account_ids = itertools.count(1)
+
+    def account(self, account_id: int) -> FakeAccount:
+        try:
+            return self.accounts[account_id]
+        except KeyError:
+            raise JsonRpcError({"code": -1, "message": f"Account {account_id} not found"}) from None
+
+    # Accounts
+
+    def add_account(self) -> int:
+        account_id = next(self.account_ids)
+        self.accounts[account_id] = FakeAccount(account_id, self.accounts_dir)
+        return account_id
+
+    def get_all_account_ids(self) -> [int]:
+        return list(self.accounts)
+
+    def get_system_info(self) -> dict:
+        return {"deltachat_core_version": "fake"}
+
+    def get_info(self, account_id: int) -> dict:
+        return {"database_dir": os.path.join(self.account(account_id).dir, "dc.db")}
+
+    def is_configured(self, account_id: int) -> bool:
+        return bool(self.account(account_id).config.get("configured_addr"))
+
+    def get_config(self, account_id: int, key: str) -> Optional[str]:
+        config = self.account(account_id).config
+        if key == "addr":
+            return config.get("configured_addr", config.get("addr"))
+        return config.get(key)
+
+    def set_config(self, account_id: int, key: str, value: Optional[str]):
+        config = self.account(account_id).config
+        if value is None:
+            config.pop(key, None)
+        else:
+            config[key] = value
+        if key in ("addr", "configured_addr"):
+            self.account(account_id).contacts[SpecialContactId.SELF]["address"] = value or ""
+
+    def start_io(self, account_id: int):
+        self.account(account_id).io_started = True
+
+    def stop_io(self, account_id: int):
+        self.account(account_id).io_started = False
+
+    def push_event(self, account_id: int, kind: str, **fields):
+        """Queue an event for wait_for_event, with camelCase fields. Not an RPC method."""
+        self.account(account_id).events.put({"kind": kind, **fields})
+
+    def fail_events(self, account_id: int, error: BaseException):
+        """Make the next wait_for_event raise an error, e.g. to end an event loop. Not an RPC method."""
+        self.account(account_id).events.put(error)
+
+    def wait_for_event(self, account_id: int) -> dict:
+        event = self.account(account_id).events.get()
+        if isinstance(event, BaseException):
+            raise event
+        return event
+
+    def get_chat_securejoin_qr_code(self, account_id: int, chat_id: Optional[int]) -> str:
+        addr = self.get_config(account_id, "addr")
+        return f"https://i.delta.chat/#FAKE&a={addr}&g={chat_id}"
+
+    # Contacts
+
+    def create_contact(self, account_id: int, addr: str, name: Optional[str] = None) -> int:
+        account = self.account(account_id)
+        contact_id = self.lookup_contact_id_by_addr(account_id, addr)
+        if contact_id is None:
+            contact_id = next(account.ids)
+            account.contacts[contact_id] = {"address": addr, "name": name or ""}
+        elif name:
+            account.contacts[contact_id]["name"] = name
+        return contact_id
+
+    def ensure_contact(self, account_id: int, contact_id: int, addr: Optional[str] = None) -> int:
+        """Create a contact with a given ID if it doesn't exist yet. Not an RPC method."""
+        contacts = self.account(account_id).contacts
+        if contact_id not in contacts:
+            contacts[contact_id] = {"address": addr or f"contact{contact_id}@example.invalid", "name": ""}
+        return contact_id
+
+    def lookup_contact_id_by_addr(self, account_id: int, addr: str) -> Optional[int]:
+        for contact_id, contact in self.account(account_id).contacts.items():
+            if contact["address"] == addr:
+                return contact_id
+        return None
+
+    def get_contact(self, account_id: int, contact_id: int) -> dict:
+        contact = self.account(account_id).contact(contact_id)
+        display_name = contact["name"] or contact["address"]
+        return {
+            "id": contact_id,
+            "address": contact["address"],
+            "name": contact["name"],
+            "authName": "",
+            "displayName": display_name,
+            "nameAndAddr": f"{display_name} ({contact['address']})" if contact["name"] else contact["address"],
+            "isKeyContact": True,
+            "isVerified": False,
+            "isBlocked": False,
+            "isBot": False,
+            "profileImage": None,
+        }
+
+    def get_contact_encryption_info(self, account_id: int, contact_id: int) -> str:
+        return "End-to-end encryption available."
+
+    # Chats
+
+    def _create_chat(
+        self, account_id: int, name: str, chat_type: str, contact_ids: [int], chat_id: Optional[int] = None
+    ) -> int:
+        account = self.account(account_id)
+        chat_id = chat_id or next(account.ids)
+        account.chats[chat_id] = {
+            "name": name,
+            "chatType": chat_type,
+            "contactIds": list(contact_ids),
+            "pastContactIds": [],
+            "profileImage": None,
+            "msgIds": [],
+            "ephemeralTimer": 0,
+        }
+        return chat_id
+
+    def ensure_chat(self, account_id: int, chat_id: int, chat_type: str = "Group", contact_ids: [int] = ()) -> int:
+        """Create a chat with a given ID if it doesn't exist yet. Not an RPC method."""
+        if chat_id not in self.account(account_id).chats:
+            contact_ids = list(contact_ids) + ([SpecialContactId.SELF] if chat_type == "Group" else [])
+            self._create_chat(account_id, f"Chat {chat_id}", chat_type, contact_ids, chat_id=chat_id)
+        return chat_id
+
+    def create_group_chat(self, account_id: int, name: str, protect: bool) -> int:
+        return self._create_chat(account_id, name, "Group", [SpecialContactId.SELF])
+
+    def create_group_chat_unencrypted(self, account_id: int, name: str) -> int:
+        return self._create_chat(account_id, name, "Group", [SpecialContactId.SELF])
+
+    def create_chat_by_contact_id(self, account_id: int, contact_id: int) -> int:
+        account = self.account(account_id)
+        for chat_id, chat in account.chats.items():
+            if chat["chatType"] == "Single" and chat["contactIds"] == [contact_id]:
+                return chat_id
+        name = self.get_contact(account_id, contact_id)["displayName"]
+        return self._create_chat(account_id, name, "Single", [contact_id])
+
+    def get_basic_chat_info(self, account_id: int, chat_id: int) -> dict:
+        chat = self.account(account_id).chat(chat_id)
+        return {
+            "id": chat_id,
+            "name": chat["name"],
+            "chatType": chat["chatType"],
+            "profileImage": chat["profileImage"],
+            "isUnpromoted": not chat["msgIds"],
+        }
+
+    def get_full_chat_by_id(self, account_id: int, chat_id: int) -> dict:
+        chat = self.account(account_id).chat(chat_id)
+        return {
+            **self.get_basic_chat_info(account_id, chat_id),
+            "contactIds": list(chat["contactIds"]),
+            "pastContactIds": list(chat["pastContactIds"]),
+            "selfInGroup": SpecialContactId.SELF in chat["contactIds"],
+        }
+
+    def get_chat_ephemeral_timer(self, account_id: int, chat_id: int) -> int:
+        return self.account(account_id).chat(chat_id)["ephemeralTimer"]
+
+    def set_chat_ephemeral_timer(self, account_id: int, chat_id: int, timer: int):
+        self.account(account_id).chat(chat_id)["ephemeralTimer"] = timer
+
+    def get_chat_contacts(self, account_id: int, chat_id: int) -> [int]:
+        return list(self.account(account_id).chat(chat_id)["contactIds"])
+
+    def get_past_chat_contacts(self, account_id: int, chat_id: int) -> [int]:
+        return list(self.account(account_id).chat(chat_id)["pastContactIds"])
+
+    def add_contact_to_chat(self, account_id: int, chat_id: int, contact_id: int):
+        chat = self.account(account_id).chat(chat_id)
+        self.account(account_id).contact(contact_id)
+        if contact_id not in chat["contactIds"]:
+            chat["contactIds"].append(contact_id)
+        if contact_id in chat["pastContactIds"]:
+            chat["pastContactIds"].remove(contact_id)
+
+    def remove_contact_from_chat(self, account_id: int, chat_id: int, contact_id: int):
+        chat = self.account(account_id).chat(chat_id)
+        if contact_id in chat["contactIds"]:
+            chat["contactIds"].remove(contact_id)
+            chat["pastContactIds"].append(contact_id)
+
+    def set_chat_name(self, account_id: int, chat_id: int, name: str):
+        self.account(account_id).chat(chat_id)["name"] = name
+
+    def set_chat_profile_image(self, account_id: int, chat_id: int, path: Optional[str]):
+        self.account(account_id).chat(chat_id)["profileImage"] = path
+
+    def delete_chat(self, account_id: int, chat_id: int):
+        account = self.account(account_id)
+        for msg_id in account.chat(chat_id)["msgIds"]:
+            account.messages.pop(msg_id, None)
+        del account.chats[chat_id]
+
+    def get_message_ids(self, account_id: int, chat_id: int, info_only: bool, add_daymarker: bool) -> [int]:
+        account = self.account(account_id)
+        msg_ids = account.chat(chat_id)["msgIds"]
+        if info_only:
+            return [msg_id for msg_id in msg_ids if account.messages[msg_id]["isInfo"]]
+        return list(msg_ids)
+
+    # Messages
+
+    def add_message(
+        self, account_id: int, chat_id: int, from_id: int, text: str = "", msg_id: Optional[int] = None, **fields
+    ) -> int:
+        """Add a message to a chat. Not an RPC method, the data model for send_msg and receive."""
+        account = self.account(account_id)
+        chat = account.chat(chat_id)
+        msg_id = msg_id or next(account.ids)
+        quoted_id = fields.pop("quotedMessageId", None)
+        quote = None
+        if quoted_id:
+            quoted = account.message(quoted_id)
+            quote = {"kind": "WithMessage", "messageId": quoted_id, "text": quoted["text"], "chatId": quoted["chatId"]}
+        account.messages[msg_id] = {
+            "id": msg_id,
+            "chatId": chat_id,
+            "fromId": from_id,
+            "text": text or "",
+            "quote": quote,
+            "parentId": quoted_id,
+            "isInfo": False,
+            "infoContactId": None,
+            "systemMessageType": "Unknown",
+            "viewType": "Text",
+            "file": None,
+            "fileName": None,
+            "hasHtml": False,
+            "overrideSenderName": None,
+            "isEdited": False,
+            "isBot": False,
+            "state": STATE_OUT_PENDING if from_id == SpecialContactId.SELF else STATE_IN_FRESH,
+            "timestamp": int(time.time()),
+            "error": None,
+            "reactions": None,
+            "rfc724Mid": f"{msg_id}@fake.example.org",
+            **fields,
+        }
+        chat["msgIds"].append(msg_id)
+        if from_id == SpecialContactId.SELF and account.io_started:
+            self.push_event(account_id, "MsgDelivered", chatId=chat_id, msgId=msg_id)
+        return msg_id
+
+    def receive(self, account_id: int, chat_id: int, from_id: int, text: str = "", **fields) -> int:
+        """Let a message arrive in a chat, so get_next_msgs returns it. Not an RPC method."""
+        msg_id = self.add_message(account_id, chat_id, from_id, text, **fields)
+        self.account(account_id).next_msgs.append(msg_id)
+        return msg_id
+
+    def send_msg(self, account_id: int, chat_id: int, draft: dict) -> int:
+        fields = {key: value for key, value in draft.items() if value is not None and key != "location"}
+        if "viewtype" in fields:
+            fields["viewType"] = fields.pop("viewtype")
+        if "filename" in fields:
+            fields["fileName"] = fields.pop("filename")
+        return self.add_message(account_id, chat_id, SpecialContactId.SELF, **fields)
+
+    def misc_send_text_message(self, account_id: int, chat_id: int, text: str) -> int:
+        return self.add_message(account_id, chat_id, SpecialContactId.SELF, text)
+
+    def react(self, account_id: int, msg_id: int, contact_id: int, reaction: [str]):
+        """Set the reactions of a contact to a message. Not an RPC method, the data model for send_reaction."""
+        message = self.account(account_id).message(msg_id)
+        by_contact = message.setdefault("reactionsByContact", {})
+        if reaction:
+            by_contact[str(contact_id)] = list(reaction)
+        else:
+            by_contact.pop(str(contact_id), None)
+        counts = Counter(emoji for emojis in by_contact.values() for emoji in emojis)
+        own = by_contact.get(str(SpecialContactId.SELF), [])
+        message["reactions"] = {
+            "reactionsByContact": dict(by_contact),
+            "reactions": [
+                {"emoji": emoji, "count": count, "isFromSelf": emoji in own} for emoji, count in counts.most_common()
+            ],
+        }
+
+    def send_reaction(self, account_id: int, msg_id: int, reaction: [str]) -> int:
+        self.react(account_id, msg_id, SpecialContactId.SELF, reaction)
+        return msg_id
+
+    def get_message_reactions(self, account_id: int, msg_id: int) -> Optional[dict]:
+        return self.account(account_id).message(msg_id)["reactions"]
+
+    def send_edit_request(self, account_id: int, msg_id: int, new_text: str):
+        message = self.account(account_id).message(msg_id)
+        message["text"] = new_text
+        message["isEdited"] = True
+
+    def delete_messages_for_all(self, account_id: int, msg_ids: [int]):
+        account = self.account(account_id)
+        for msg_id in msg_ids:
+            message = account.messages.pop(msg_id)
+            account.chat(message["chatId"])["msgIds"].remove(msg_id)
+
+    def resend_messages(self, account_id: int, msg_ids: [int]):
+        for msg_id in msg_ids:
+            self.account(account_id).message(msg_id)["state"] = STATE_OUT_PENDING
+
+    def get_message(self, account_id: int, msg_id: int) -> dict:
+        message = self.account(account_id).message(msg_id)
+        return {**message, "sender": self.get_contact(account_id, message["fromId"])}
+
+    def get_message_info(self, account_id: int, msg_id: int) -> str:
+        message = self.account(account_id).message(msg_id)
+        return f"State: {message['state']}\n\n{message['error'] or ''}"
+
+    def get_message_info_object(self, account_id: int, msg_id: int) -> dict:
+        message = self.account(account_id).message(msg_id)
+        return {"rfc724Mid": message["rfc724Mid"], "error": message["error"]}
+
+    def get_next_msgs(self, account_id: int) -> [int]:
+        account = self.account(account_id)
+        next_msgs, account.next_msgs = account.next_msgs, []
+        return next_msgs
+
+    def markseen_msgs(self, account_id: int, msg_ids: [int]):
+        account = self.account(account_id)
+        for msg_id in msg_ids:
+            if account.messages[msg_id]["state"] == STATE_IN_FRESH:
+                account.messages[msg_id]["state"] = STATE_IN_SEEN
+
+
+class FakeRpcMethod:
+    """A method of the FakeRpc; counts its calls, and can be called synchronously or as a future."""
+
+    def __init__(self, rpc: "FakeRpc", name: str):
+        self.rpc = rpc
+        self.name = name
+
+    def __call__(self, *args):
+        return self.future(*args)()
+
+    def future(self, *args):
+        with self.rpc.lock:
+            self.rpc.calls[self.name] += 1
+        if self.rpc.latency:
+            time.sleep(self.rpc.latency)
+        implementation = getattr(self.rpc.core, self.name, None)
+        if implementation is None or self.name.startswith("_"):
+            raise JsonRpcError({"code": -32601, "message": f"Method not found: {self.name}"})
+        try:
+            result = implementation(*args)
+        except JsonRpcError as e:
+            error = e
+
+            def raise_error():
+                raise error
+
+            return raise_error
+        return lambda: result
+
+
+class FakeRpc:
+    """An in-memory stand-in for deltachat_rpc_client.Rpc, for benchmarks and tests without a chatmail server.
+
+    The real Account, Chat, Message, and Contact classes work on top of it with DeltaChat(FakeRpc()).
+    Every RPC call is counted per method in self.calls.
+
+    :param core: the data model which implements the RPC methods, a new FakeCore by default
+    :param latency: how many seconds each RPC call takes, like the round trip to a real server
+    """
+
+    def __init__(self, core: Optional[FakeCore] = None, latency: float = 0.0):
+        self.core = core or FakeCore()
+        self.latency = latency
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name: str) -> FakeRpcMethod:
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return FakeRpcMethod(self, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _exc_type, _exc, _tb):
+        pass
+
+    def call_count(self) -> int:
+        """Return how many RPC calls were made so far."""
+        return sum(self.calls.values())
@@ -0,0 +1,241 @@
+import logging
+import threading
+import time
+import weakref
+from typing import Callable
+
+from deltachat_rpc_client import Account
+from deltachat_rpc_client._utils import AttrDict
+
+from .cache import contact_snapshot
+from .dedup import get_seen_set
+from .forwarding import forward_to_relay_group
+from .outbox import TokenBucket
+from .store import get_store
+
+log = logging.getLogger("root")
+
+FLOOD_LIMIT = 0  # how many messages per minute an outsider may send before they are merged; off unless set
+FLOOD_WINDOW = 60.0  # how many seconds to collect messages over the limit before relaying them merged
+
+# Flood guards of all accounts in this process, per RPC connection and account ID
+_guards = weakref.WeakKeyDictionary()
+
+
+class Collected:
+    """The messages of an outside chat which are collected to be relayed as one.
+
+    :param flooded: whether they are collected because the chat went over the flood limit, or for a digest
+    """
+
+    def __init__(self, flooded: bool):
+        self.flooded = flooded
+        self.messages = []
+        self.timer = None
+
+
+class FloodGuard:
+    """Limit how many messages per minute each outsider and each outside chat may have relayed.
+
+    Messages over the limit are collected per outside chat,
+    and relayed to the crew after the window, their texts merged into one message,
+    so one outsider can't make the bot send a copy to every crew member for each of many messages.
+    Attachments among them are still relayed on their own, in between.
+
+    Relay groups with a digest window also get bursts of text messages merged into one,
+    while attachments are relayed on their own.
+
+    The collected messages are relayed from a timer thread. It holds the ordering lock of the outside chat meanwhile,
+    like the relay hook does while it admits and relays a message,
+    so the merged message and the messages after it reach the crew in order, whichever thread relays them.
+
+    :param limit: how many messages per minute to relay, with bursts of as many; 0 turns the limit off
+    :param window: how many seconds to collect messages over the limit, and to keep the quota of an idle outsider
+    :param digests: the digest windows in seconds, per relay group ID
+    :param clock: returns the current time in seconds
+    """
+
+    def __init__(
+        self,
+        limit: int = FLOOD_LIMIT,
+        window: float = FLOOD_WINDOW,
+        digests: {int: float} = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.limit = limit
+        self.window = window
+        self.digests = digests or {}
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.buckets = {}  # per ("contact", contact ID) and ("chat", chat ID)
+        self.swept = clock()  # when idle buckets were dropped last
+        self.collected = {}  # per outside chat ID
+        self.chat_locks = {}  # per outside chat ID
+
+    def set_limit(self, limit: int):
+        with self.lock:
+            self.limit = limit
+            self.buckets.clear()
+
+    def bucket(self, key: (str, int)) -> TokenBucket:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(self.limit / 60, self.limit, self.clock)
+        return bucket
+
+    def drop_idle_buckets(self):
+        """Drop the buckets which weren't used for longer than the window, at most once per window.
+
+        A bucket refills within a minute, so one which was idle for as long is the same as a new one.
+        """
+        now = self.clock()
+        if now - self.swept < self.window:
+            return
+        self.swept = now
+        idle = max(self.window, 60.0)
+        for key, bucket in list(self.buckets.items()):
+            if now - bucket.last > idle:
+                del self.buckets[key]
+
+    def ordered(self, chat_id: int) -> threading.RLock:
+        """Return the lock which orders relaying the messages of an outside chat; hold it while admitting one."""
+        with self.lock:
+            return self.chat_locks.setdefault(chat_id, threading.RLock())
+
+    def over_limit(self, msg: AttrDict) -> bool:
+        """Return whether the sender or the chat is over the limit; if neither is, take a token from both."""
+        if not self.limit:
+            return False
+        self.drop_idle_buckets()
+        contact_bucket = self.bucket(("contact", msg.from_id))
+        chat_bucket = self.bucket(("chat", msg.chat_id))
+        if not (contact_bucket.available() and chat_bucket.available()):
+            return True  # a message which is collected doesn't use up the quota of the other bucket
+        contact_bucket.take()
+        chat_bucket.take()
+        return False
+
+    def admit(self, msg: AttrDict, relay_group_id: int = None) -> bool:
+        """Return whether to relay a message of an outsider right away.
+
+        If not, it was collected, and flush() relays it merged with the others later.
+
+        :param msg: the snapshot of the message
+        :param relay_group_id: the ID of the relay group of the outside chat, to look up its digest window
+        """
+        digest = self.digests.get(relay_group_id, 0.0)
+        if not self.limit and not digest:
+            return True
+        with self.lock:
+            collected = self.collected.get(msg.chat_id)
+            if collected and (collected.flooded or not msg.file):
+                collected.messages.append(msg)
+                return False
+        if collected:
+            self.flush(msg.chat_id)  # an attachment ends the digest
+        with self.lock:
+            if self.over_limit(msg):
+                log.info(
+                    f"Chat {msg.chat_id} went over {self.limit} messages per minute, collecting for {self.window}s"
+                )
+                self.collect(msg, True, self.window)
+                return False
+            if digest and not msg.file:
+                self.collect(msg, False, digest)
+                return False
+        return True
+
+    def collect(self, msg: AttrDict, flooded: bool, window: float):
+        collected = self.collected[msg.chat_id] = Collected(flooded)
+        collected.messages.append(msg)
+        collected.timer = threading.Timer(window, self.flush, args=(msg.chat_id,))
+        collected.timer.daemon = True
+        collected.timer.start()
+
+    def flush(self, chat_id: int):
+        """Relay the collected messages of an outside chat, the texts merged into one message."""
+        with self.ordered(chat_id):
+            with self.lock:
+                collected = self.collected.pop(chat_id, None)
+            if not collected:
+                return
+            collected.timer.cancel()
+            note = None
+            if collected.flooded:
+                note = (
+                    f"⚠️ {len(collected.messages)} messages over the limit of {self.limit} per minute, merged into one:"
+                )
+            try:
+                for msg in merge(collected.messages, note):
+                    forward_to_relay_group(msg)
+            except Exception:
+                log.exception(f"Relaying {len(collected.messages)} merged messages of chat {chat_id} failed")
+                for msg in collected.messages:
+                    get_seen_set(msg.chat.account).release(msg)
+
+    def flush_all(self):
+        for chat_id in list(self.collected):
+            self.flush(chat_id)
+
+
+def merge(messages: [AttrDict], note: str = None) -> [AttrDict]:
+    """Merge each run of text messages into one; messages with attachments stay as they are, in between.
+
+    :param messages: the snapshots of the messages, in the order they arrived
+    :param note: a note for the crew, put before the first message
+    :return: the messages to relay, in order
+    """
+    with_names = len({msg.from_id for msg in messages}) > 1
+    relayed = []
+    texts = []
+    for msg in messages:
+        if not msg.file:
+            texts.append(msg)
+            continue
+        if texts:
+            relayed.extend((merge_texts(texts, note, with_names), msg))
+        elif note:
+            relayed.append(AttrDict(msg, text=f"{note}\n\n{msg.text}".strip(), merged=True))
+        else:
+            relayed.append(msg)
+        texts = []
+        note = None
+    if texts:
+        relayed.append(merge_texts(texts, note, with_names))
+    return relayed
+
+
+def merge_texts(messages: [AttrDict], note: str = None, with_names: bool = False) -> AttrDict:
+    """Merge the texts of messages into a copy of the last one, optionally with a note for the crew.
+
+    :param with_names: whether to put the name of the sender before each text
+    """
+    if len(messages) == 1 and not note:
+        return messages[0]
+    lines = [note] if note else []
+    for msg in messages:
+        line = msg.text
+        if with_names:
+            line = f"{contact_snapshot(msg.sender).display_name}: {line}"
+        lines.append(line)
+    merged = AttrDict(messages[-1])
+    merged.update(
+        text="\n\n".join(lines),
+        html=None,
+        has_html=False,
+        quote=None,
+        merged=True,
+        rfc724_mids=[rfc724_mid for msg in messages for rfc724_mid in msg.get("rfc724_mids", ())],
+    )
+    return merged
+
+
+def get_flood_guard(account: Account) -> FloodGuard:
+    """Return the flood guard of an account, create it with the limit and the digest windows on first access."""
+    guards = _guards.setdefault(account._rpc, {})
+    guard = guards.get(account.id)
+    if guard is None:
+        limit = account.get_config("ui.flood_limit")
+        digests = dict(get_store(account).digest_windows())
+        guard = guards[account.id] = FloodGuard(int(limit) if limit else FLOOD_LIMIT, digests=digests)
+    return guard
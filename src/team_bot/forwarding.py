@@ -3,17 +3,28 @@ import logging
 from deltachat_rpc_client import Chat, Message
 from deltachat_rpc_client._utils import AttrDict
 
-from .util import get_crew_id_from_account, get_outside_chat, get_relay_group, get_relay_groups, set_relay_groups
+from .cache import contact_snapshot
+from .chatsync import relay_group_name, sync_image
+from .dedup import get_seen_set
+from .metrics import RELAY_GROUPS_CREATED, RELAYED
+from .outbox import PRIORITY_CREW, PRIORITY_OUTSIDE, send
+from .pool import POOLS
+from .store import get_store
+from .util import add_relay_group, get_crew_id_from_account, get_outside_chat, get_relay_group
 
 log = logging.getLogger("root")
 
 
-def reply(chat: Chat, text: str, attachment: str = None, quote: Message = None):
+def reply(chat: Chat, text: str, attachment: str = None, quote: Message = None, priority: int = PRIORITY_CREW):
     """Reply to a chat, with a text, optionally including an attachment or quoting a message."""
-    chat.send_message(
-        text=text,
-        file=attachment,
-        quoted_msg=quote,
+    send(
+        chat.account,
+        priority,
+        lambda: chat.send_message(
+            text=text,
+            file=attachment,
+            quoted_msg=quote,
+        ),
     )
 
 
@@ -25,47 +36,61 @@ def forward_to_outside(msg: AttrDict):
             "Couldn't find the corresponding outside chat for relay group %s",
             msg.chat.id,
         )
+        get_seen_set(msg.chat.account).release(msg)
         return
-    try:
-        if msg.quote:
-            quoted_msg = msg.quote.message_id
-        else:
-            quoted_msg = None
-        if not msg.has_html:
-            msg.html = None
-        outside_chat.send_message(
-            html=msg.html,
-            text=msg.text,
-            viewtype=msg.view_type,
-            file=msg.file,
-            filename=msg.file_name,
-            quoted_msg=quoted_msg,
-        )
+    if msg.quote:
+        quoted_msg = msg.quote.message_id
+    else:
+        quoted_msg = None
+    if not msg.has_html:
+        msg.html = None
+
+    def forward():
+        try:
+            sent_msg = outside_chat.send_message(
+                html=msg.html,
+                text=msg.text,
+                viewtype=msg.view_type,
+                file=msg.file,
+                filename=msg.file_name,
+                quoted_msg=quoted_msg,
+            )
+            get_store(msg.chat.account).add_forwarded_message(sent_msg.id, msg.chat_id, msg.id)
+            get_seen_set(msg.chat.account).remember(msg)
+            RELAYED.inc(direction="crew_to_outside")
 
-    except Exception as e:
-        reply(msg.chat, "Sending message failed.", quote=msg.message)
-        raise e
+        except Exception as e:
+            get_seen_set(msg.chat.account).release(msg)
+            # this runs on the outbox worker, which must not wait for room in its own queue
+            msg.chat.send_message(text="Sending message failed.", quoted_msg=msg.message)
+            raise e
+
+    send(msg.chat.account, PRIORITY_OUTSIDE, forward)
 
 
 def forward_to_relay_group(msg: AttrDict, started_by_crew: bool = False):
     """Forward a message to a relay group, create it if it doesn't yet exist."""
     account = msg.chat.account
-    crew_id = get_crew_id_from_account(account)
-    crew = account.get_chat_by_id(crew_id)
-    crew_members = crew.get_contacts()
-    crew_members.remove(account.self_contact)
 
     relay_group = get_relay_group(msg.chat)
     if not relay_group:
-        group_name = "[%s] %s" % (
-            account.get_config("addr").split("@")[0],
-            msg.chat.get_full_snapshot().name,
-        )
-        log.info(f"Creating new relay group: {group_name}")
-        relay_group = account.create_group(group_name)
-        for member in crew_members:
-            relay_group.add_contact(member)
-        relay_group.set_image(msg.chat.get_full_snapshot().profile_image)
+        crew_id = get_crew_id_from_account(account)
+        crew = account.get_chat_by_id(crew_id)
+        crew_members = crew.get_contacts()
+        crew_members.remove(account.self_contact)
+        group_name = relay_group_name(account, msg.chat)
+        relay_group = POOLS.claim(account, crew_members)
+        if relay_group:
+            log.info(f"Claimed relay group {relay_group.id} from the pool: {group_name}")
+            relay_group.set_name(group_name)
+        else:
+            log.info(f"Creating new relay group: {group_name}")
+            relay_group = account.create_group(group_name)
+            for member in crew_members:
+                relay_group.add_contact(member)
+        RELAY_GROUPS_CREATED.inc()
+        get_store(account).set_relay_members(relay_group.id, [member.id for member in crew_members])
+        sync_image(msg.chat, relay_group)
 
         outside_chat = msg.chat
         if outside_chat.get_basic_snapshot().chat_type == "Group":
@@ -80,24 +105,34 @@ def forward_to_relay_group(msg: AttrDict, started_by_crew: bool = False):
         else:
             explanation = f"This is a chat with {recipients}; Only *replies* will be visible to the outside."
         relay_group.send_text(explanation)
-        relay_mappings = get_relay_groups(account)
-        relay_mappings.append(tuple([msg.chat.id, relay_group.id]))
-        set_relay_groups(account, relay_mappings)
+        add_relay_group(account, msg.chat.id, relay_group.id)
 
-    if relay_group.get_full_snapshot().profile_image != msg.chat.get_full_snapshot().profile_image:
-        relay_group.set_image(msg.chat.get_full_snapshot().profile_image)
     if hasattr(msg.quote, "message_id"):
         quoted_msg = msg.quote.message_id
     else:
         quoted_msg = None
     if not hasattr(msg, "html"):
         msg.html = None
-    relay_group.send_message(
-        override_sender_name=msg.sender.get_snapshot().name_and_addr,
-        html=msg.html,
-        text=msg.text,
-        viewtype=msg.view_type,
-        file=msg.file,
-        filename=msg.file_name,
-        quoted_msg=quoted_msg,
-    )
+    sender = contact_snapshot(msg.sender).name_and_addr
+
+    def forward():
+        try:
+            sent_msg = relay_group.send_message(
+                override_sender_name=sender,
+                html=msg.html,
+                text=msg.text,
+                viewtype=msg.view_type,
+                # the core names blobs after their content and deduplicates them, so the path is passed on as it is
+                file=msg.file,
+                filename=msg.file_name,
+                quoted_msg=quoted_msg,
+            )
+        except Exception:
+            get_seen_set(account).release(msg)
+            raise
+        if not msg.get("merged"):  # edits of one of several merged messages can't be mirrored
+            get_store(account).add_forwarded_message(sent_msg.id, msg.chat_id, msg.id)
+        get_seen_set(account).remember(msg)
+        RELAYED.inc(direction="outside_to_crew")
+
+    send(account, PRIORITY_CREW, forward)
@@ -0,0 +1,97 @@
+import logging
+import threading
+import time
+
+from deltachat_rpc_client import Account, Chat, Contact
+from deltachat_rpc_client.rpc import JsonRpcError
+
+from .cache import contact_snapshot
+from .outbox import PRIORITY_CREW, send
+from .store import get_store
+from .util import get_crew_id_from_account
+
+log = logging.getLogger("root")
+
+BATCH_SIZE = 50
+ONBOARDING_BATCH_SIZE = 20
+ONBOARDING_PAUSE = 30.0
+
+
+class MembershipJob(threading.Thread):
+    """Add a contact to many relay groups, or remove it from them, in batches.
+
+    The RPC calls of a batch are sent at once and awaited together.
+    After each batch, the progress is reported to the crew chat.
+
+    :param account: the bot's account object
+    :param contact: the contact to add or remove
+    :param relay_groups: the relay groups to change
+    :param remove: whether to remove the contact instead of adding it
+    :param batch_size: how many relay groups to change before reporting progress
+    :param pause: how many seconds to wait between two batches
+    """
+
+    def __init__(
+        self,
+        account: Account,
+        contact: Contact,
+        relay_groups: [Chat],
+        remove: bool = False,
+        batch_size: int = BATCH_SIZE,
+        pause: float = 0.0,
+    ):
+        super().__init__(daemon=True)
+        self.account = account
+        self.contact = contact
+        self.relay_groups = relay_groups
+        self.remove = remove
+        self.batch_size = batch_size
+        self.pause = pause
+
+    def run(self):
+        store = get_store(self.account)
+        name = contact_snapshot(self.contact).display_name
+        verb = "Removing" if self.remove else "Adding"
+        done = 0
+        rpc = self.account._rpc
+        method = rpc.remove_contact_from_chat if self.remove else rpc.add_contact_to_chat
+        for start in range(0, len(self.relay_groups), self.batch_size):
+            batch = self.relay_groups[start : start + self.batch_size]
+            futures = [(chat, method.future(self.account.id, chat.id, self.contact.id)) for chat in batch]
+            for relay_group, future in futures:
+                try:
+                    future()
+                    if self.remove:
+                        store.remove_relay_member(relay_group.id, self.contact.id)
+                    else:
+                        store.add_relay_member(relay_group.id, self.contact.id)
+                except JsonRpcError as e:
+                    log.error(f"{verb} {name} failed for relay group {relay_group.id}: {e}")
+                done += 1
+            log.info(f"{verb} {name}: {done}/{len(self.relay_groups)} relay groups done")
+            if len(self.relay_groups) > self.batch_size:
+                self.report(f"{verb} {name}: {done} of {len(self.relay_groups)} relay groups done.")
+            if self.pause and done < len(self.relay_groups):
+                time.sleep(self.pause)
+
+    def report(self, text: str):
+        """Post a progress message to the crew chat, through the outbox."""
+        crew_id = get_crew_id_from_account(self.account)
+        if not crew_id:
+            return
+        crew = self.account.get_chat_by_id(crew_id)
+
+        def post():
+            try:
+                crew.send_text(text)
+            except JsonRpcError as e:
+                log.error(f"Could not report progress to the crew: {e}")
+
+        send(self.account, PRIORITY_CREW, post)
+
+    def run_or_start(self):
+        """Run small jobs right away, start a background thread for bigger ones."""
+        if len(self.relay_groups) > self.batch_size:
+            self.start()
+        else:
+            self.run()
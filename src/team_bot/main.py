@@ -3,85 +3,413 @@ import logging
 import os
 import random
 import string
+import time
+from queue import Queue
 from threading import Thread
-from typing import Callable, Iterable, Optional, Tuple, Union
+from typing import TYPE_CHECKING, Callable, Iterable, Optional, Tuple, Union
 
-from deltachat_rpc_client import Bot, DeltaChat, Rpc
+from deltachat_rpc_client import Account, Bot, DeltaChat, EventType, Rpc
 from deltachat_rpc_client._utils import AttrDict
-from deltachat_rpc_client.events import EventFilter
+from deltachat_rpc_client.events import EventFilter, RawEvent
 
-from .commands import migrate_from_cffi
+from . import IMPORTED_AT
+from .catchup import CatchUpBot
+from .chatsync import RECONCILIATION, start_reconciling
+from .outbox import start_rate_limiting
 from .relay import relayhooks
-from .setup import setuphooks
-from .util import has_crew
+from .retry import RETRIES, start_retrying
+from .setup import crew_created, setuphooks
+from .util import get_crew_id_from_account, load_relay_groups
+
+if TYPE_CHECKING:
+    from .dispatcher import ShardedDispatcher
+    from .pool import RelayPools
+    from .profiling import Profiler
+    from .trace import Tracer
 
 ALPHANUMERIC = string.ascii_lowercase + string.digits
 
 
+class StartupTimer:
+    """Measure how long each phase of the startup took, and log the breakdown once the bot idles.
+
+    :param log: the logger object
+    :param started: the time.monotonic() value the first phase started at
+    """
+
+    def __init__(self, log: logging.Logger, started: float = IMPORTED_AT):
+        self.log = log
+        self.started = self.last = started
+        self.phases = []
+        self.done = False
+
+    def mark(self, phase: str):
+        """Record that a phase of the startup just ended."""
+        now = time.monotonic()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def on_idle(self, event: AttrDict):
+        """Hook: end the startup when the first account waits for new messages, and log the breakdown."""
+        if self.done:
+            return
+        self.done = True
+        self.mark("first IMAP idle")
+        self.log.info(self.report())
+
+    def report(self) -> str:
+        phases = ", ".join(f"{phase} {duration * 1000:.0f}ms" for phase, duration in self.phases)
+        return f"Startup took {(self.last - self.started) * 1000:.0f}ms: {phases}"
+
+    def watch(self, client: Bot):
+        """Call on_idle when the account of a client waits for new messages."""
+        client.add_hook(self.on_idle, RawEvent(EventType.IMAP_INBOX_IDLE))
+
+
+def get_accounts_dir(log: logging.Logger, accounts_dir: Optional[str], **kwargs) -> str:
+    """Return the accounts directory, migrate it from the old format if necessary."""
+    if not accounts_dir:
+        accounts_dir = os.getcwd() + "/.config/team-bot/"
+        log.warning(f"No --dbdir specified, using the default directory: {accounts_dir}")
+
+    if os.path.exists(os.path.join(accounts_dir, "delta.sqlite")):
+        log.warning(f"Migrating data from {accounts_dir}/delta.sqlite to new accounts.toml format:")
+        from .commands import migrate_from_cffi  # noqa: PLC0415 - pulls in pickledb, only needed once
+
+        migrate_from_cffi(accounts_dir, **kwargs)
+    return accounts_dir
+
+
+def make_client(
+    account: Account,
+    hooks: Optional[Iterable[Tuple[Callable, Union[type, "EventFilter"]]]] = None,
+    dispatcher: Optional["ShardedDispatcher"] = None,
+) -> Bot:
+    """Load the relay mappings of an account and create a bot client for it."""
+    load_relay_groups(account)
+    if dispatcher:
+        from .dispatcher import DispatchingBot  # noqa: PLC0415 - only needed with --workers
+
+        return DispatchingBot(account, hooks, dispatcher)
+    return CatchUpBot(account, hooks)
+
+
+def configure(log: logging.Logger, client: Bot, email: Optional[str] = None, password: Optional[str] = None):
+    """Configure a new account in the background, generate email address and password if necessary."""
+    if not email:
+        email = "".join(random.choices(ALPHANUMERIC, k=9)) + "@nine.testrun.org"
+        log.warning(f"No email specified, creating new chatmail address: {email}")
+    if not password:
+        password = "".join(random.choices(ALPHANUMERIC, k=20))
+        log.warning("No password specified, trying with random password")
+    configure_thread = Thread(
+        target=client.configure,
+        daemon=True,
+        kwargs={"email": email, "password": password},
+    )
+    configure_thread.start()
+
+
+def run_client(client: Bot, until: Optional[Callable[[AttrDict], bool]] = None, run_async: bool = False):
+    """Process the events of a client until a condition returns true, or forever."""
+    if run_async:
+        import asyncio  # noqa: PLC0415 - slow to import, only needed with --async
+
+        from .engine import AsyncRelayEngine  # noqa: PLC0415
+
+        asyncio.run(AsyncRelayEngine(client).run_until(until))
+    elif until:
+        client.run_until(until)
+    else:
+        client.run_forever()
+
+
+def serve_account(
+    log: logging.Logger,
+    client: Bot,
+    run_async: bool = False,
+    tracer: Optional["Tracer"] = None,
+    profiler: Optional["Profiler"] = None,
+    pools: Optional["RelayPools"] = None,
+):
+    """Run the setup hooks of an account until it has a crew, then add the relay hooks and relay forever.
+
+    Accounts which already have a crew skip the setup phase.
+    The setup hooks run on a plain CatchUpBot with the hooks the client has so far, even if the client dispatches
+    events to worker threads: they wait for the delivery of the welcome message themselves,
+    and the crew must be saved before crew_created looks for it.
+
+    :param tracer: the tracer to record the events of the account with, if --trace is on
+    :param profiler: the profiler to wrap the hooks with, if --profile is on
+    :param pools: the relay group pools to fill for the account, if --pool-size is on
+    """
+    account = client.account
+    if not get_crew_id_from_account(account):
+        hooks = [hook for filter_hooks in client._hooks.values() for hook in filter_hooks]
+        setup_client = CatchUpBot(account, [*hooks, *(profiler.wrap_hooks(setuphooks) if profiler else setuphooks)])
+        log.info(f"Account {account.id}: start listening to messages with {setuphooks.__name__}")
+        run_client(setup_client, until=crew_created)
+    if tracer:
+        tracer.watch(client)
+    if RETRIES.enabled:
+        RETRIES.watch(account)
+    if pools:
+        pools.get(account).refill()
+    if RECONCILIATION.enabled:
+        RECONCILIATION.watch(account)
+    client.add_hooks(profiler.wrap_hooks(relayhooks) if profiler else relayhooks)
+    log.info(f"Account {account.id}: start listening to messages with {relayhooks.__name__}")
+    run_client(client, run_async=run_async)
+
+
 def run_bot(
     log: logging.Logger,
     accounts_dir: Optional[str] = None,
-    until: Optional[Callable[[AttrDict], bool]] = None,
     email: Optional[str] = None,
     password: Optional[str] = None,
-    hooks: Optional[Iterable[Tuple[Callable, Union[type, "EventFilter"]]]] = None,
+    run_async: bool = False,
+    dispatcher: Optional["ShardedDispatcher"] = None,
+    timer: Optional[StartupTimer] = None,
+    rpc_class: type = Rpc,
+    tracer: Optional["Tracer"] = None,
+    profiler: Optional["Profiler"] = None,
+    pools: Optional["RelayPools"] = None,
     **kwargs,
-) -> str:
-    """Run the bot until a condition returns true.
+):
+    """Run the bot: set it up until it has a crew, then relay messages, all in one RPC session.
+
+    If the crew already exists, the setup phase is skipped.
 
     :param log: the logger object
     :param accounts_dir: the directory where the account database is stored
-    :param until: to stop the bot, make this function return True
     :param email: the email address of the bot
     :param password: the password for the email address
-    :param hooks: a collection of hooks which the bot will use
-    :return the accounts directory
+    :param run_async: handle the events of different chats concurrently on an asyncio event loop
+    :param dispatcher: handle the events of different chats concurrently on the dispatcher's worker threads
+    :param timer: the startup timer to report the startup phases to
+    :param rpc_class: the RPC client class, e.g. MeteredRpc to count the RPC calls
+    :param tracer: the tracer to record the events with, if --trace is on
+    :param profiler: the profiler to wrap the hooks with, if --profile is on
+    :param pools: the relay group pools to fill for each account, if --pool-size is on
     """
-    if not accounts_dir:
-        accounts_dir = os.getcwd() + "/.config/team-bot/"
-        log.warning(f"No --dbdir specified, using the default directory: {accounts_dir}")
-
-    if os.path.exists(os.path.join(accounts_dir, "delta.sqlite")):
-        log.warning(f"Migrating data from {accounts_dir}/delta.sqlite to new accounts.toml format:")
-        migrate_from_cffi(accounts_dir, **kwargs)
+    timer = timer or StartupTimer(log)
+    accounts_dir = get_accounts_dir(log, accounts_dir, **kwargs)
 
-    with Rpc(accounts_dir=accounts_dir, **kwargs) as rpc:
+    with rpc_class(accounts_dir=accounts_dir, **kwargs) as rpc:
         deltachat = DeltaChat(rpc)
         core_version = (deltachat.get_system_info()).deltachat_core_version
+        timer.mark("RPC spawn")
         accounts = deltachat.get_all_accounts()
         account = accounts[0] if accounts else deltachat.add_account()
 
-        client = Bot(account, hooks)
+        client = make_client(account, dispatcher=dispatcher)
         client.logger.debug("Running deltachat core %s", core_version)
+        timer.mark("account open")
+        timer.watch(client)
 
         if not client.is_configured():
-            if not email:
-                email = "".join(random.choices(ALPHANUMERIC, k=9)) + "@nine.testrun.org"
-                log.warning(f"No email specified, creating new chatmail address: {email}")
-            if not password:
-                password = "".join(random.choices(ALPHANUMERIC, k=20))
-                log.warning("No password specified, trying with random password")
-            configure_thread = Thread(
-                target=client.configure,
-                daemon=True,
-                kwargs={"email": email, "password": password},
-            )
-            configure_thread.start()
-        log.info("Start listening to messages with " + hooks.__name__)
-        if until:
-            client.run_until(until)
-            return accounts_dir
-        else:
-            client.run_forever()
+            configure(log, client, email, password)
+        serve_account(log, client, run_async, tracer, profiler, pools)
+
+
+def run_bots(
+    log: logging.Logger,
+    accounts_dir: Optional[str] = None,
+    email: Optional[str] = None,
+    password: Optional[str] = None,
+    run_async: bool = False,
+    dispatcher: Optional["ShardedDispatcher"] = None,
+    timer: Optional[StartupTimer] = None,
+    rpc_class: type = Rpc,
+    tracer: Optional["Tracer"] = None,
+    profiler: Optional["Profiler"] = None,
+    pools: Optional["RelayPools"] = None,
+    **kwargs,
+):
+    """Serve every account in the accounts directory from one process and one RPC server.
+
+    Each account has its own crew and relay groups, and goes through the setup phase on its own.
+    If an account stops serving, e.g. because its thread crashed, all of them stop with a RuntimeError,
+    so the process exits and its supervisor can restart it, instead of running on with the account silently gone.
+
+    :param log: the logger object
+    :param accounts_dir: the directory where the account databases are stored
+    :param email: the email address of an account to add, if it doesn't exist yet
+    :param password: the password for the email address
+    :param run_async: handle the events of different chats concurrently on an asyncio event loop
+    :param dispatcher: handle the events of different chats concurrently on the dispatcher's worker threads
+    :param timer: the startup timer to report the startup phases to
+    :param rpc_class: the RPC client class, e.g. MeteredRpc to count the RPC calls
+    :param tracer: the tracer to record the events with, if --trace is on
+    :param profiler: the profiler to wrap the hooks with, if --profile is on
+    :param pools: the relay group pools to fill for each account, if --pool-size is on
+    """
+    timer = timer or StartupTimer(log)
+    accounts_dir = get_accounts_dir(log, accounts_dir, **kwargs)
+
+    with rpc_class(accounts_dir=accounts_dir, **kwargs) as rpc:
+        deltachat = DeltaChat(rpc)
+        core_version = (deltachat.get_system_info()).deltachat_core_version
+        log.debug("Running deltachat core %s", core_version)
+        timer.mark("RPC spawn")
+        clients = [make_client(account, dispatcher=dispatcher) for account in deltachat.get_all_accounts()]
+
+        addresses = [client.account.get_config("addr") for client in clients]
+        if (email and email not in addresses) or not clients:
+            log.warning(f"Adding new account to {accounts_dir}")
+            client = make_client(deltachat.add_account(), dispatcher=dispatcher)
+            configure(log, client, email, password)
+            clients.append(client)
+        timer.mark("account open")
+
+        stopped = Queue()  # (account ID, exception or None) of the accounts whose thread ended
+
+        def serve(client: Bot):
+            try:
+                serve_account(log, client, run_async, tracer, profiler, pools)
+            except Exception as e:
+                log.exception(f"Account {client.account.id} failed")
+                stopped.put((client.account.id, e))
+            else:
+                stopped.put((client.account.id, None))
+
+        for client in clients:
+            timer.watch(client)
+            Thread(target=serve, args=(client,), daemon=True).start()
+        log.info(f"Serving {len(clients)} accounts")
+        account_id, error = stopped.get()
+        raise RuntimeError(f"Account {account_id} stopped serving, stopping the other accounts too") from error
 
 
 def main():
     """This is the CLI entry point."""
+    timer = StartupTimer(logging.getLogger("root"))
+    timer.mark("imports")
     parser = argparse.ArgumentParser()
     parser.add_argument("--dbdir", help="accounts folder", default=os.getenv("TEAMS_DBDIR"))
     parser.add_argument("--email", action="store", help="email address", default=os.getenv("TEAMS_INIT_EMAIL"))
     parser.add_argument("--password", action="store", help="password", default=os.getenv("TEAMS_INIT_PASSWORD"))
     parser.add_argument("--verbose", "-v", action="count", default=0)
+    parser.add_argument(
+        "--async",
+        dest="run_async",
+        action="store_true",
+        help="relay messages of different chats concurrently",
+        default=bool(os.getenv("TEAMS_ASYNC")),
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="relay messages of different chats concurrently on this many threads",
+        default=os.getenv("TEAMS_WORKERS", "0"),
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        help="how many events each worker thread may queue",
+        default=os.getenv("TEAMS_QUEUE_SIZE", "1000"),
+    )
+    parser.add_argument(
+        "--slow-job",
+        type=float,
+        help="warn about events which took longer than this many seconds to handle",
+        default=os.getenv("TEAMS_SLOW_JOB", "5"),
+    )
+    parser.add_argument(
+        "--multi",
+        action="store_true",
+        help="serve all accounts in the accounts folder from one process",
+        default=bool(os.getenv("TEAMS_MULTI")),
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="serve metrics in the Prometheus text format on http://127.0.0.1:PORT/metrics",
+        default=os.getenv("TEAMS_METRICS_PORT"),
+    )
+    parser.add_argument(
+        "--profile",
+        type=float,
+        nargs="?",
+        const=60,
+        metavar="INTERVAL",
+        help="log the time and RPC calls of each hook every INTERVAL seconds (default: 60)",
+        default=os.getenv("TEAMS_PROFILE"),
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="PATH",
+        help="record the events the bot receives, with redacted texts, to a rotating trace file",
+        default=os.getenv("TEAMS_TRACE"),
+    )
+    parser.add_argument(
+        "--trace-size",
+        type=float,
+        metavar="MB",
+        help="rotate the trace file when it grows larger than this (default: 10)",
+        default=os.getenv("TEAMS_TRACE_SIZE", "10"),
+    )
+    parser.add_argument(
+        "--send-rate",
+        type=float,
+        help="send at most this many messages per second per account, answers to outsiders first",
+        default=os.getenv("TEAMS_SEND_RATE"),
+    )
+    parser.add_argument(
+        "--send-burst",
+        type=int,
+        help="with --send-rate, how many messages may be sent at once after a quiet period",
+        default=os.getenv("TEAMS_SEND_BURST", "10"),
+    )
+    parser.add_argument(
+        "--send-queue",
+        type=int,
+        help="with --send-rate, how many messages may wait to be sent per account",
+        default=os.getenv("TEAMS_SEND_QUEUE", "1000"),
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        help="retry failed deliveries to outsiders this many times before reporting them to the crew",
+        default=os.getenv("TEAMS_RETRIES", "0"),
+    )
+    parser.add_argument(
+        "--retry-delay",
+        type=float,
+        help="with --retries, wait about this many seconds before the first retry, twice as long before each next one",
+        default=os.getenv("TEAMS_RETRY_DELAY", "60"),
+    )
+    parser.add_argument(
+        "--pool-size",
+        type=int,
+        help="keep this many relay groups with the crew in them ready for new outsiders",
+        default=os.getenv("TEAMS_POOL_SIZE", "0"),
+    )
+    parser.add_argument(
+        "--reconcile",
+        type=float,
+        help="compare the names and images of all relay groups with their outside chats every this many seconds",
+        default=os.getenv("TEAMS_RECONCILE", "0"),
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    bench_parser = subparsers.add_parser("bench", help="measure the relay hooks on a fake RPC server, offline")
+    bench_parser.add_argument(
+        "--mappings",
+        type=lambda counts: [int(count) for count in counts.split(",")],
+        help="comma-separated numbers of relay mappings to measure with",
+        default="10,1000,50000",
+    )
+    bench_parser.add_argument("--events", type=int, help="how many events each scenario feeds in", default=1000)
+    bench_parser.add_argument("--history", type=int, help="how long the scanned chat history is", default=5000)
+    replay_parser = subparsers.add_parser("replay", help="feed a trace into the relay hooks on a fake account")
+    replay_parser.add_argument("path", help="the trace file")
+    replay_parser.add_argument(
+        "--speed",
+        type=float,
+        help="replay this many times faster than recorded; 0, the default, replays as fast as possible",
+        default=0,
+    )
+    replay_parser.add_argument("--account", type=int, help="which traced account to replay (default: the first)")
     args = parser.parse_args()
 
     log = logging.getLogger("root")
@@ -90,21 +418,77 @@ def main():
         if args.verbose > 1:
             log.setLevel(logging.DEBUG)
 
-    accounts_dir = run_bot(
-        log,
-        until=has_crew,
-        accounts_dir=args.dbdir,
-        email=args.email,
-        password=args.password,
-        hooks=setuphooks,
-    )
+    if args.command == "bench":
+        from .bench import main as bench  # noqa: PLC0415 - not needed for running the bot
+
+        return bench(args.mappings, args.events, args.history)
+    if args.command == "replay":
+        from .trace import main as replay  # noqa: PLC0415 - not needed for running the bot
+
+        return replay(args.path, args.speed, args.account)
+
+    dispatcher = None
+    if args.workers:
+        from .dispatcher import ShardedDispatcher  # noqa: PLC0415 - only needed with --workers
+
+        dispatcher = ShardedDispatcher(args.workers, args.queue_size, args.slow_job)
+    rpc_class = Rpc
+    if args.metrics_port:
+        from .metrics import MeteredRpc, serve_metrics  # noqa: PLC0415 - only needed with --metrics-port
+
+        serve_metrics(args.metrics_port)
+        rpc_class = MeteredRpc
+    profiler = None
+    if args.profile:
+        from .profiling import ProfilingRpc, start_profiling  # noqa: PLC0415 - only needed with --profile
+
+        profiler = start_profiling(args.profile)
+        rpc_class = ProfilingRpc
+    tracer = None
+    if args.trace:
+        from .trace import TRACER, start_tracing  # noqa: PLC0415 - only needed with --trace
+
+        start_tracing(args.trace, args.trace_size)
+        tracer = TRACER
+    if args.send_rate:
+        start_rate_limiting(args.send_rate, args.send_burst, args.send_queue)
+    if args.retries:
+        start_retrying(args.retries, args.retry_delay)
+    pools = None
+    if args.pool_size:
+        from .pool import start_pools  # noqa: PLC0415 - only needed with --pool-size
+
+        pools = start_pools(args.pool_size)
+    if args.reconcile:
+        start_reconciling(args.reconcile)
+
+    if args.multi:
+        return run_bots(
+            log,
+            accounts_dir=args.dbdir,
+            email=args.email,
+            password=args.password,
+            run_async=args.run_async,
+            dispatcher=dispatcher,
+            timer=timer,
+            rpc_class=rpc_class,
+            tracer=tracer,
+            profiler=profiler,
+            pools=pools,
+        )
 
     run_bot(
         log,
-        accounts_dir=accounts_dir,
+        accounts_dir=args.dbdir,
         email=args.email,
         password=args.password,
-        hooks=relayhooks,
+        run_async=args.run_async,
+        dispatcher=dispatcher,
+        timer=timer,
+        rpc_class=rpc_class,
+        tracer=tracer,
+        profiler=profiler,
+        pools=pools,
     )
 
 
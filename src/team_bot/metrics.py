@@ -0,0 +1,217 @@
+import functools
+import logging
+import threading
+import time
+from typing import Callable
+
+from deltachat_rpc_client import Rpc
+from deltachat_rpc_client._utils import AttrDict
+
+log = logging.getLogger("root")
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metric:
+    """A metric with a value per combination of label values.
+
+    :param name: the name of the metric
+    :param help_text: what the metric counts
+    :param labels: the names of its labels
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels: (str,) = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def key(self, labels: {str: str}) -> (str,):
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def format_labels(self, key: (str,), **extra) -> str:
+        pairs = list(zip(self.labels, key)) + list(extra.items())
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{label}="{value}"' for label, value in pairs) + "}"
+
+    def render(self) -> [str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    """A value which only goes up."""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(self.key(labels), 0)
+
+    def render(self) -> [str]:
+        with self.lock:
+            values = sorted(self.values.items())
+        return super().render() + [f"{self.name}{self.format_labels(key)} {value}" for key, value in values]
+
+
+class Gauge(Metric):
+    """A value which goes up and down."""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def get(self, **labels) -> float:
+        return self.values.get(self.key(labels), 0)
+
+    def render(self) -> [str]:
+        with self.lock:
+            values = sorted(self.values.items())
+        return super().render() + [f"{self.name}{self.format_labels(key)} {value}" for key, value in values]
+
+
+class Histogram(Metric):
+    """Observed values, counted in cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: (str,) = (), buckets: (float,) = BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels):
+        key = self.key(labels)
+        with self.lock:
+            buckets, total, count = self.values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    buckets[i] += 1
+            self.values[key] = (buckets, total + value, count + 1)
+
+    def count(self, **labels) -> int:
+        return self.values.get(self.key(labels), (None, 0.0, 0))[2]
+
+    def render(self) -> [str]:
+        lines = super().render()
+        with self.lock:
+            values = sorted(self.values.items())
+        for key, (buckets, total, count) in values:
+            for bound, bucket in zip(self.buckets, buckets):
+                lines.append(f"{self.name}_bucket{self.format_labels(key, le=bound)} {bucket}")
+            lines.append(f"{self.name}_bucket{self.format_labels(key, le='+Inf')} {count}")
+            lines.append(f"{self.name}_sum{self.format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{self.format_labels(key)} {count}")
+        return lines
+
+
+class Registry:
+    """All metrics of the process, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name: str, help_text: str, labels: (str,) = ()) -> Counter:
+        metric = Counter(name, help_text, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help_text: str, labels: (str,) = ()) -> Gauge:
+        metric = Gauge(name, help_text, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, labels: (str,) = ()) -> Histogram:
+        metric = Histogram(name, help_text, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+
+REGISTRY = Registry()
+RELAYED = REGISTRY.counter(
+    "teambot_messages_relayed_total",
+    "Messages relayed from outside chats to relay groups, and from relay groups to outside chats",
+    ("direction",),
+)
+MIRRORED = REGISTRY.counter(
+    "teambot_changes_mirrored_total",
+    "Edits, deletions, and reactions mirrored to the other copy of a message",
+    ("change",),
+)
+RELAY_GROUPS_CREATED = REGISTRY.counter("teambot_relay_groups_created_total", "Relay groups created")
+DELIVERIES = REGISTRY.counter("teambot_deliveries_total", "Messages delivered or failed to deliver", ("result",))
+DELIVERY_RETRIES = REGISTRY.counter(
+    "teambot_delivery_retries_total", "Failed deliveries scheduled for a retry, or given up on", ("outcome",)
+)
+DUPLICATES = REGISTRY.counter(
+    "teambot_duplicates_suppressed_total", "Messages which arrived again and were not relayed again", ("chat",)
+)
+COMMANDS = REGISTRY.counter("teambot_commands_total", "Commands invoked in the crew chat", ("command",))
+HANDLER_SECONDS = REGISTRY.histogram("teambot_handler_seconds", "How long each hook took per event", ("hook",))
+RPC_CALLS = REGISTRY.counter("teambot_rpc_calls_total", "JSON-RPC calls to deltachat-rpc-server", ("method",))
+EVENT_LAG = REGISTRY.histogram("teambot_event_lag_seconds", "How long events waited in a queue before handling")
+OUTBOX_DEPTH = REGISTRY.gauge("teambot_outbox_depth", "Sends waiting in the outbox of an account", ("account",))
+SEND_LATENCY = REGISTRY.histogram(
+    "teambot_send_latency_seconds", "How long sends took, including the time in the outbox", ("priority",)
+)
+
+
+def timed(hook: Callable[[AttrDict], None]) -> Callable[[AttrDict], None]:
+    """Decorator to observe the latency of a hook."""
+
+    @functools.wraps(hook)
+    def timed_hook(event: AttrDict):
+        start = time.perf_counter()
+        try:
+            return hook(event)
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - start, hook=hook.__name__)
+
+    return timed_hook
+
+
+class MeteredRpc(Rpc):
+    """An RPC client which counts its calls per method."""
+
+    def __getattr__(self, attr: str):
+        RPC_CALLS.inc(method=attr)
+        return super().__getattr__(attr)
+
+
+def serve_metrics(port: int, host: str = "127.0.0.1"):
+    """Serve the metrics on http://host:port/metrics in a background thread.
+
+    :return: the ThreadingHTTPServer, call its shutdown() method to stop it
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # noqa: PLC0415 - slow to import
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = REGISTRY.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args):
+            log.debug("Metrics request: " + format % args)
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    log.info(f"Serving metrics on http://{host}:{server.server_port}/metrics")
+    return server
@@ -0,0 +1,140 @@
+import logging
+import time
+
+from deltachat_rpc_client import Account, Message, SpecialContactId
+from deltachat_rpc_client._utils import AttrDict
+
+from .cache import message_snapshot
+from .metrics import MIRRORED
+from .outbox import PRIORITY_CREW, PRIORITY_OUTSIDE, PRIORITY_REACTION, send
+from .store import get_store
+from .util import get_relay_index
+
+log = logging.getLogger("root")
+
+DELIVERY_REACTIONS = ("✅", "❌")  # the bot's own reactions to answers of the crew, kept when mirroring
+DELAY_MARGIN = 3600  # how many seconds after the original a copy may have been sent, e.g. when the outbox was full
+
+
+def get_copy(account: Account, msg_id: int) -> (int, int):
+    """Return the ID of the copy the bot relayed of a message, and the priority of changes to it, or None.
+
+    Only copies between an outside chat and its relay group count; e.g. not those of /new_message commands.
+    """
+    copy = get_store(account).get_forwarded_copy(msg_id)
+    if not copy:
+        return None
+    sent_msg_id, orig_chat_id = copy
+    index = get_relay_index(account)
+    if orig_chat_id in index.outside_by_relay:
+        return sent_msg_id, PRIORITY_OUTSIDE
+    if orig_chat_id in index.relay_by_outside:
+        return sent_msg_id, PRIORITY_CREW
+    return None
+
+
+def mirror_edit(account: Account, msg_id: int):
+    """If a relayed message was edited, edit its copy the same way."""
+    copy = get_copy(account, msg_id)
+    if not copy:
+        return
+    sent_msg_id, priority = copy
+    edited = message_snapshot(account.get_message_by_id(msg_id))
+    if not edited.is_edited or edited.from_id == SpecialContactId.SELF:
+        return
+    if message_snapshot(account.get_message_by_id(sent_msg_id)).text == edited.text:
+        return
+    log.info(f"Message {msg_id} was edited, editing its copy {sent_msg_id}")
+
+    def edit():
+        account._rpc.send_edit_request(account.id, sent_msg_id, edited.text)
+        MIRRORED.inc(change="edit")
+
+    send(account, priority, edit)
+
+
+def deleted_by_author(account: Account, sent_msg_id: int, orig_chat_id: int) -> bool:
+    """Return whether a relayed message can only have been deleted because its author asked for it.
+
+    MSG_DELETED doesn't say why a message was deleted. The core accepts deletion requests only from the author,
+    but it also deletes disappearing messages, and messages older than delete_device_after;
+    deletions which may be such housekeeping aren't mirrored.
+
+    :param sent_msg_id: the ID of the copy; the original is gone, but the copy was sent right after it arrived
+    :param orig_chat_id: the ID of the chat of the original message
+    """
+    if account._rpc.get_chat_ephemeral_timer(account.id, orig_chat_id):
+        return False
+    delete_after = int(account.get_config("delete_device_after") or 0)
+    if delete_after:
+        sent = message_snapshot(account.get_message_by_id(sent_msg_id))
+        return time.time() - sent.timestamp < delete_after - DELAY_MARGIN
+    return True
+
+
+def mirror_deletion(account: Account, chat_id: int, msg_id: int):
+    """If the author of a relayed message deleted it, delete its copy for everyone."""
+    copy = get_copy(account, msg_id)
+    if not copy:
+        return
+    sent_msg_id, priority = copy
+    if not deleted_by_author(account, sent_msg_id, chat_id):
+        log.info(f"Message {msg_id} may have been deleted by housekeeping, keeping its copy {sent_msg_id}")
+        return
+    get_store(account).remove_forwarded_message(sent_msg_id)
+    log.info(f"Message {msg_id} was deleted, deleting its copy {sent_msg_id}")
+
+    def delete():
+        account._rpc.delete_messages_for_all(account.id, [sent_msg_id])
+        MIRRORED.inc(change="deletion")
+
+    send(account, priority, delete)
+
+
+def mirror_reactions(account: Account, msg_id: int):
+    """If the reactions to a copy changed, react to the original message with them."""
+    original = get_store(account).get_original_message(msg_id)
+    if not original or not get_copy(account, original[1]):
+        return
+    orig_msg = account.get_message_by_id(original[1])
+    emojis = mirrored_emojis(account.get_message_by_id(msg_id).get_reactions())
+    own_emojis = own_reactions(orig_msg)
+    if set(own_emojis) == emojis.union(emoji for emoji in own_emojis if emoji in DELIVERY_REACTIONS):
+        return
+    log.info(f"Reactions to the copy {msg_id} changed, reacting to message {orig_msg.id} with {sorted(emojis)}")
+
+    def react():
+        # read again when sending, a delivery reaction may have been sent meanwhile
+        kept = [emoji for emoji in own_reactions(orig_msg) if emoji in DELIVERY_REACTIONS]
+        orig_msg.send_reaction(*kept, *sorted(emojis))
+        MIRRORED.inc(change="reaction")
+
+    send(account, PRIORITY_REACTION, react)
+
+
+def send_delivery_reaction(message: Message, emoji: str, copy: AttrDict):
+    """React to an answer of the crew with ✅ or ❌, keeping the reactions mirrored from its copy.
+
+    A reaction replaces all earlier reactions of the bot to the message, so they are sent along.
+
+    :param message: the answer of the crew
+    :param emoji: ✅ or ❌
+    :param copy: the snapshot of the copy the bot sent to the outsider, with its reactions
+    """
+    mirrored = sorted(mirrored_emojis(copy.reactions))
+    send(message.account, PRIORITY_REACTION, lambda: message.send_reaction(emoji, *mirrored))
+
+
+def mirrored_emojis(reactions: AttrDict) -> {str}:
+    """Return the emojis others reacted to a copy with, which the bot mirrors to the original message."""
+    emojis = set()
+    for contact_id, contact_emojis in (reactions.reactions_by_contact if reactions else {}).items():
+        if int(contact_id) != SpecialContactId.SELF:
+            emojis.update(contact_emojis)
+    return emojis
+
+
+def own_reactions(message: Message) -> [str]:
+    """Return the emojis the bot reacted to a message with."""
+    reactions = message.get_reactions()
+    return reactions.reactions_by_contact.get(str(SpecialContactId.SELF), []) if reactions else []
@@ -0,0 +1,171 @@
+import itertools
+import logging
+import threading
+import time
+import weakref
+from queue import Full, PriorityQueue
+from typing import Callable
+
+from deltachat_rpc_client import Account
+
+from .metrics import OUTBOX_DEPTH, SEND_LATENCY
+
+log = logging.getLogger("root")
+
+# The priorities of sends, the most urgent first
+PRIORITY_OUTSIDE = 0  # messages to outsiders, e.g. the answers of the crew
+PRIORITY_CREW = 1  # messages to the crew, e.g. copies of outsider messages in relay groups
+PRIORITY_REACTION = 2  # delivery reactions
+PRIORITY_NAMES = {PRIORITY_OUTSIDE: "outside", PRIORITY_CREW: "crew", PRIORITY_REACTION: "reaction"}
+
+BURST = 10
+QUEUE_SIZE = 1000
+
+
+class TokenBucket:
+    """Rate limit: allow rate actions per second on average, and up to burst actions at once.
+
+    :param rate: how many tokens are added per second
+    :param burst: how many tokens the bucket holds
+    :param clock: returns the current time in seconds
+    """
+
+    def __init__(self, rate: float, burst: int = BURST, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = float(burst)
+        self.last = clock()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def take(self) -> float:
+        """Take a token, and return how many seconds to wait until it may be used."""
+        with self.lock:
+            self._refill()
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
+
+    def available(self) -> bool:
+        """Return whether there is a token right now, without taking it."""
+        with self.lock:
+            self._refill()
+            return self.tokens >= 1
+
+    def try_take(self) -> bool:
+        """Take a token if there is one right now, and return whether there was."""
+        with self.lock:
+            self._refill()
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class Outbox:
+    """The send queue of one account: a worker thread sends the most urgent messages first, rate limited.
+
+    If the queue is full, submitting blocks until there is room again,
+    so a flood of events slows down the event loop instead of filling up the memory.
+    Only sends which a queued send submits itself are dropped instead, as the worker can't wait for itself.
+
+    :param account_id: the ID of the account, to label the metrics
+    :param rate: how many messages to send per second on average
+    :param burst: how many messages to send at once after a quiet period
+    :param size: how many sends may wait in the queue
+    """
+
+    def __init__(self, account_id: int, rate: float, burst: int = BURST, size: int = QUEUE_SIZE):
+        self.account_id = account_id
+        self.bucket = TokenBucket(rate, burst)
+        self.queue = PriorityQueue(maxsize=size)
+        self.order = itertools.count()  # sends of the same priority go out in order
+        self.worker = threading.Thread(target=self._work, daemon=True)
+        self.worker.start()
+
+    def submit(self, priority: int, job: Callable[[], None]):
+        """Queue a send, it runs after all queued sends with the same or a higher priority."""
+        item = (priority, next(self.order), time.monotonic(), job)
+        if threading.current_thread() is self.worker:
+            try:
+                self.queue.put_nowait(item)
+            except Full:
+                log.error(f"The outbox of account {self.account_id} is full, dropping a send of a queued send")
+                return
+        else:
+            self.queue.put(item)
+        OUTBOX_DEPTH.set(self.queue.qsize(), account=self.account_id)
+
+    def _work(self):
+        while True:
+            priority, _, queued_at, job = self.queue.get()
+            time.sleep(self.bucket.take())
+            try:
+                job()
+            except Exception:
+                log.exception(f"Sending from the outbox of account {self.account_id} failed")
+            SEND_LATENCY.observe(time.monotonic() - queued_at, priority=PRIORITY_NAMES[priority])
+            OUTBOX_DEPTH.set(self.queue.qsize(), account=self.account_id)
+            self.queue.task_done()
+
+    def join(self):
+        """Wait until all queued sends are done."""
+        self.queue.join()
+
+
+class Outboxes:
+    """The outboxes of all accounts in this process.
+
+    Until rate limiting is started, there are no outboxes, and sends run right away in the calling thread.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.rate = 0.0
+        self.burst = BURST
+        self.size = QUEUE_SIZE
+        self.lock = threading.Lock()
+        self.outboxes = weakref.WeakKeyDictionary()  # per RPC connection and account ID
+
+    def start(self, rate: float, burst: int = BURST, size: int = QUEUE_SIZE):
+        self.rate = rate
+        self.burst = burst
+        self.size = size
+        self.enabled = True
+        log.info(f"Sending at most {rate} messages per second per account, bursts of {burst}")
+
+    def get(self, account: Account) -> Outbox:
+        """Return the outbox of an account, create it on first access."""
+        with self.lock:
+            outboxes = self.outboxes.setdefault(account._rpc, {})
+            outbox = outboxes.get(account.id)
+            if outbox is None:
+                outbox = outboxes[account.id] = Outbox(account.id, self.rate, self.burst, self.size)
+            return outbox
+
+    def send(self, account: Account, priority: int, job: Callable[[], None]):
+        if self.enabled:
+            self.get(account).submit(priority, job)
+        else:
+            job()
+
+
+OUTBOXES = Outboxes()
+
+
+def start_rate_limiting(rate: float, burst: int = BURST, size: int = QUEUE_SIZE):
+    OUTBOXES.start(rate, burst, size)
+
+
+def send(account: Account, priority: int, job: Callable[[], None]):
+    """Send through the outbox of an account, or right away if rate limiting is off.
+
+    :param account: the account which sends
+    :param priority: PRIORITY_OUTSIDE, PRIORITY_CREW, or PRIORITY_REACTION
+    :param job: the function which sends, and does whatever needs the sent message
+    """
+    OUTBOXES.send(account, priority, job)
@@ -0,0 +1,123 @@
+import logging
+import threading
+import weakref
+from typing import Optional
+
+from deltachat_rpc_client import Account, Chat, Contact, SpecialContactId
+from deltachat_rpc_client.rpc import JsonRpcError
+
+from .store import get_store
+from .util import get_crew_id_from_account
+
+log = logging.getLogger("root")
+
+POOL_SIZE = 5
+POOL_GROUP_NAME = "[pool] relay group"
+
+
+class RelayPool:
+    """Relay groups which are created in advance, with the crew already in them.
+
+    The groups are not promoted yet, so the crew doesn't see them
+    until the bot claims one for a new outside chat and sends the first message to it.
+    A background thread creates new ones after each claim.
+
+    :param account: the bot's account object
+    :param size: how many groups to keep ready
+    """
+
+    def __init__(self, account: Account, size: int = POOL_SIZE):
+        self.account = account
+        self.size = size
+        self.wanted = threading.Event()
+        threading.Thread(target=self._refill_forever, daemon=True).start()
+
+    def crew_members(self) -> [int]:
+        crew_id = get_crew_id_from_account(self.account)
+        members = self.account._rpc.get_chat_contacts(self.account.id, crew_id)
+        return [contact_id for contact_id in members if contact_id != SpecialContactId.SELF]
+
+    def fill(self):
+        """Create groups until the pool is full."""
+        store = get_store(self.account)
+        while len(store.pool_groups()) < self.size:
+            relay_group = self.account.create_group(POOL_GROUP_NAME)
+            for contact_id in self.crew_members():
+                self.account._rpc.add_contact_to_chat(self.account.id, relay_group.id, contact_id)
+            store.add_pool_group(relay_group.id)
+            log.debug(f"Account {self.account.id}: added relay group {relay_group.id} to the pool")
+
+    def refill(self):
+        """Fill the pool in the background."""
+        self.wanted.set()
+
+    def _refill_forever(self):
+        while True:
+            self.wanted.wait()
+            self.wanted.clear()
+            try:
+                self.fill()
+            except Exception:
+                log.exception(f"Account {self.account.id}: refilling the relay group pool failed")
+
+    def claim(self, crew_members: [Contact]) -> Optional[Chat]:
+        """Take a group out of the pool, and make its members the current crew.
+
+        :param crew_members: the crew, without the bot itself
+        :return: the group, or None if the pool is empty
+        """
+        store = get_store(self.account)
+        relay_group_id = store.claim_pool_group()
+        self.refill()
+        if relay_group_id is None:
+            return None
+        rpc = self.account._rpc
+        try:
+            members = set(rpc.get_chat_contacts(self.account.id, relay_group_id)) - {SpecialContactId.SELF}
+        except JsonRpcError:
+            log.warning(f"Relay group {relay_group_id} of the pool doesn't exist anymore")
+            return self.claim(crew_members)
+        crew = {member.id for member in crew_members}
+        for contact_id in members - crew:
+            rpc.remove_contact_from_chat(self.account.id, relay_group_id, contact_id)  # left the crew meanwhile
+        for contact_id in crew - members:
+            rpc.add_contact_to_chat(self.account.id, relay_group_id, contact_id)  # joined the crew meanwhile
+        return self.account.get_chat_by_id(relay_group_id)
+
+
+class RelayPools:
+    """The relay group pools of all accounts in this process; there are none until they are started."""
+
+    def __init__(self):
+        self.enabled = False
+        self.size = POOL_SIZE
+        self.lock = threading.Lock()
+        self.pools = weakref.WeakKeyDictionary()  # per RPC connection and account ID
+
+    def start(self, size: int = POOL_SIZE):
+        self.size = size
+        self.enabled = True
+        log.info(f"Keeping {size} relay groups ready per account")
+
+    def get(self, account: Account) -> RelayPool:
+        """Return the pool of an account, create it on first access."""
+        with self.lock:
+            pools = self.pools.setdefault(account._rpc, {})
+            pool = pools.get(account.id)
+            if pool is None:
+                pool = pools[account.id] = RelayPool(account, self.size)
+            return pool
+
+    def claim(self, account: Account, crew_members: [Contact]) -> Optional[Chat]:
+        """Take a relay group from the pool of an account, or return None if there is none."""
+        if not self.enabled:
+            return None
+        return self.get(account).claim(crew_members)
+
+
+POOLS = RelayPools()
+
+
+def start_pools(size: int = POOL_SIZE) -> RelayPools:
+    POOLS.start(size)
+    return POOLS
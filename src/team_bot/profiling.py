@@ -0,0 +1,181 @@
+import functools
+import heapq
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Callable, Iterable
+
+from deltachat_rpc_client._utils import AttrDict
+from deltachat_rpc_client.rpc import RpcMethod
+
+from .metrics import MeteredRpc
+
+log = logging.getLogger("root")
+
+REPORT_INTERVAL = 60
+SLOWEST_EVENTS = 10
+EVENT_LOOP = "(event loop)"  # RPC calls outside of hooks, e.g. fetching events and messages
+
+
+class HandlerProfile:
+    """The time one hook took, and the RPC calls it made."""
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.rpc_calls = Counter()
+        self.rpc_seconds = 0.0
+
+    def report(self, name: str) -> str:
+        rpc_calls = sum(self.rpc_calls.values())
+        methods = ", ".join(f"{method} {count}" for method, count in self.rpc_calls.most_common())
+        if not self.calls:
+            return f"{name}: {rpc_calls} RPC calls ({self.rpc_seconds:.2f}s): {methods}"
+        return (
+            f"{name}: {self.calls} calls, {self.seconds:.2f}s total, {self.seconds / self.calls * 1000:.1f}ms avg; "
+            f"{rpc_calls / self.calls:.1f} RPC calls per call ({self.rpc_seconds:.2f}s): {methods}"
+        )
+
+
+class Profiler:
+    """Attribute the wall time and the RPC calls of the bot to the hooks which caused them.
+
+    The hook which runs in the current thread is kept in a thread-local variable,
+    so RPC calls are attributed correctly when hooks run concurrently.
+
+    :param interval: log a report and start over every this many seconds
+    :param slowest: how many of the slowest events to keep for the report
+    """
+
+    def __init__(self, interval: float = REPORT_INTERVAL, slowest: int = SLOWEST_EVENTS):
+        self.interval = interval
+        self.slowest_count = slowest
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.wrapped = {}
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.monotonic()
+            self.handlers = defaultdict(HandlerProfile)
+            self.slowest = []  # min-heap of (seconds, hook name, event kind, chat ID)
+
+    def current(self) -> str:
+        return getattr(self.local, "hook", EVENT_LOOP)
+
+    def count_rpc(self, method: str):
+        with self.lock:
+            self.handlers[self.current()].rpc_calls[method] += 1
+
+    def time_rpc(self, seconds: float):
+        with self.lock:
+            self.handlers[self.current()].rpc_seconds += seconds
+
+    def record_event(self, name: str, event: AttrDict, seconds: float):
+        snapshot = event.get("message_snapshot")
+        if snapshot:
+            kind, chat_id = "info message" if snapshot.is_info else "message", snapshot.chat_id
+        else:
+            kind, chat_id = getattr(event.kind, "value", event.kind), event.get("chat_id")
+        with self.lock:
+            handler = self.handlers[name]
+            handler.calls += 1
+            handler.seconds += seconds
+            entry = (seconds, name, kind, chat_id)
+            if len(self.slowest) < self.slowest_count:
+                heapq.heappush(self.slowest, entry)
+            else:
+                heapq.heappushpop(self.slowest, entry)
+
+    def wrap(self, hook: Callable[[AttrDict], None]) -> Callable[[AttrDict], None]:
+        """Return a version of a hook which records its time and RPC calls."""
+
+        name = f"{hook.__module__.rsplit('.', 1)[-1]}.{hook.__name__}"  # e.g. relay.catch_events
+
+        @functools.wraps(hook)
+        def profiled_hook(event: AttrDict):
+            self.local.hook = name
+            start = time.perf_counter()
+            try:
+                return hook(event)
+            finally:
+                self.record_event(name, event, time.perf_counter() - start)
+                del self.local.hook
+
+        return profiled_hook
+
+    def wrap_hooks(self, hooks: Iterable) -> list:
+        """Return the profiled versions of a hook collection; the same list every time, so they can be removed."""
+        if id(hooks) not in self.wrapped:
+            self.wrapped[id(hooks)] = [(self.wrap(hook), event_filter) for hook, event_filter in hooks]
+        return self.wrapped[id(hooks)]
+
+    def report(self) -> str:
+        """Return the time and the RPC calls per hook, and the slowest events."""
+        with self.lock:
+            handlers = sorted(self.handlers.items(), key=lambda item: item[1].seconds, reverse=True)
+            slowest = sorted(self.slowest, reverse=True)
+            lines = [f"Profile of the last {time.monotonic() - self.started:.0f}s:"]
+            lines += [handler.report(name) for name, handler in handlers]
+        if slowest:
+            lines.append("Slowest events:")
+            for seconds, name, kind, chat_id in slowest:
+                lines.append(f"  {seconds * 1000:.0f}ms in {name}: {kind} in chat {chat_id}")
+        return "\n".join(lines)
+
+    def _report_periodically(self):
+        while True:
+            time.sleep(self.interval)
+            log.info(self.report())
+            self.reset()
+
+    def start(self):
+        """Start profiling, and log a report every interval from a background thread."""
+        self.enabled = True
+        self.reset()
+        threading.Thread(target=self._report_periodically, daemon=True).start()
+
+
+class ProfiledRpcMethod(RpcMethod):
+    """An RPC method which reports its calls and round trip times to the profiler."""
+
+    def __call__(self, *args):
+        start = time.perf_counter()
+        try:
+            return super().__call__(*args)
+        finally:
+            PROFILER.time_rpc(time.perf_counter() - start)
+
+    def future(self, *args):
+        PROFILER.count_rpc(self.name)
+        return super().future(*args)
+
+
+class ProfilingRpc(MeteredRpc):
+    """An RPC client which reports every call to the profiler; it also counts them for the metrics."""
+
+    def __getattr__(self, attr: str):
+        super().__getattr__(attr)  # counts the call for the metrics
+        return ProfiledRpcMethod(self, attr)
+
+
+# The profiler of this process, only enabled with --profile
+PROFILER = Profiler()
+
+
+def start_profiling(interval: float = REPORT_INTERVAL) -> Profiler:
+    """Profile the hooks and RPC calls of this process, and log a report every interval."""
+    PROFILER.interval = interval
+    PROFILER.start()
+    log.info(f"Profiling hooks and RPC calls, reporting every {interval}s")
+    return PROFILER
+
+
+def profiled(hooks: Iterable) -> Iterable:
+    """Return the profiled versions of a hook collection if profiling is on, otherwise the hooks themselves."""
+    if not PROFILER.enabled:
+        return hooks
+    return PROFILER.wrap_hooks(hooks)
@@ -11,6 +11,7 @@ def deploy_team_bot(
     dbdir: str = None,
     user_invite: str = None,
     branch="main",
+    metrics_port: int = None,
 ):
     """Deploy TeamsBot to a UNIX user, with specified credentials
 
@@ -20,6 +21,7 @@ def deploy_team_bot(
     :param dbdir: the directory where the bot's data will be stored. default: ~/.config/team-bot/email@example.org
     :param user_invite: the invite link of the first crew member
     :param branch: which branch of https://github.com/deltachat-bot/team-bot to use
+    :param metrics_port: serve metrics on this port of localhost. If left out, no metrics are served
     """
 
     git.config(
@@ -59,6 +61,8 @@ def deploy_team_bot(
         secrets.append(f"TEAMS_INIT_PASSWORD={bot_passwd}")
     if user_invite:
         secrets.append(f"TEAMS_USER_INVITE={user_invite}")
+    if metrics_port:
+        secrets.append(f"TEAMS_METRICS_PORT={metrics_port}")
     env = "\n".join(secrets)
     files.put(
         name="upload secrets",
@@ -3,31 +3,59 @@ import logging
 from deltachat_rpc_client import EventType, events
 from deltachat_rpc_client._utils import AttrDict
 
+from .cache import chat_snapshot, contact_snapshot, get_cache, message_snapshot
+from .chatsync import sync_chat
 from .commands import (
     add_contact,
     crew_help,
     offboard,
+    onboard,
     outside_help,
     set_avatar,
+    set_digest,
     set_display_name,
+    set_flood_limit,
     set_outside_help,
     start_chat,
 )
+from .dedup import get_seen_set
+from .flood import get_flood_guard
 from .forwarding import forward_to_outside, forward_to_relay_group, reply
+from .metrics import COMMANDS, DELIVERIES, timed
+from .mirror import mirror_deletion, mirror_edit, mirror_reactions, send_delivery_reaction
+from .outbox import PRIORITY_OUTSIDE
+from .retry import RETRIES
 from .util import (
     find_original_message,
     get_crew_id_from_account,
     get_outside_chat,
     get_relay_group,
+    get_relay_index,
     is_relay_group,
+    refresh_relay_members,
+    remove_relay_group,
 )
 
 log = logging.getLogger("root")
 relayhooks = events.HookCollection()
 relayhooks.__name__ = "Relay hooks"
 
+CREW_COMMANDS = (
+    "/help",
+    "/set_name",
+    "/set_avatar",
+    "/generate_invite",
+    "/generate-invite",
+    "/new_message",
+    "/add_contact",
+    "/set_outside_help",
+    "/set_flood_limit",
+    "/digest",  # sent in a relay group, not in the crew chat
+)
+
 
 @relayhooks.on(events.RawEvent)
+@timed
 def catch_events(event):
     """This is called on every raw event and can be used for any kind of event handling.
     Unfortunately deltachat-rpc-client doesn't offer high-level events for MSG_DELIVERED or SECUREJOIN_INVITER_PROGRESS
@@ -36,43 +64,78 @@ def catch_events(event):
     :param event: the event object
     """
     log.debug(event)
+    get_cache(event.account).on_event(event)
 
     if event.kind == EventType.MSG_DELIVERED:
         delivered_msg = event.account.get_message_by_id(event.msg_id)
-        log.info(f"Delivered message successfully: {delivered_msg.get_snapshot().text}")
-        if get_relay_group(delivered_msg.get_snapshot().chat):
+        delivered = message_snapshot(delivered_msg)
+        log.info(f"Delivered message successfully: {delivered.text}")
+        DELIVERIES.inc(result="delivered")
+        if get_relay_group(delivered.chat):
+            RETRIES.delivered(event.account, event.msg_id)
             orig_chat, orig_message = find_original_message(delivered_msg, event.account)
             if orig_chat:
-                log.debug(f"Notifying success in {orig_chat.get_full_snapshot().name}")
-                orig_message.send_reaction("✅")
+                log.debug(f"Notifying success in {chat_snapshot(orig_chat).name}")
+                send_delivery_reaction(orig_message, "✅", delivered)
 
     elif event.kind == EventType.MSG_FAILED:
         failed_msg = event.account.get_message_by_id(event.msg_id)
-        log.warning(f"Sending message failed: {failed_msg.get_snapshot().text}")
-        if get_relay_group(failed_msg.get_snapshot().chat):
+        failed = message_snapshot(failed_msg)
+        log.warning(f"Sending message failed: {failed.text}")
+        DELIVERIES.inc(result="failed")
+        if get_relay_group(failed.chat):
+            if RETRIES.failed(failed_msg, failed):
+                return
             orig_chat, orig_message = find_original_message(failed_msg, event.account)
             if orig_chat:
                 delivery_error = "Delivery failed:\n\n" + failed_msg.get_info()
-                orig_chat.send_message(text=delivery_error, quoted_msg=orig_message)
-                orig_message.send_reaction("❌")
+                reply(orig_chat, delivery_error, quote=orig_message)
+                send_delivery_reaction(orig_message, "❌", failed)
+
+    elif event.kind == EventType.MSGS_CHANGED and event.msg_id:
+        mirror_edit(event.account, event.msg_id)
+
+    elif event.kind == EventType.MSG_DELETED:
+        mirror_deletion(event.account, event.chat_id, event.msg_id)
+
+    elif event.kind == EventType.REACTIONS_CHANGED:
+        mirror_reactions(event.account, event.msg_id)
+
+    elif event.kind == EventType.CHAT_MODIFIED:
+        index = get_relay_index(event.account)
+        if event.chat_id in index.outside_by_relay:
+            refresh_relay_members(event.account.get_chat_by_id(event.chat_id))
+        elif event.chat_id in index.relay_by_outside:
+            relay_group = event.account.get_chat_by_id(index.relay_by_outside[event.chat_id])
+            sync_chat(event.account.get_chat_by_id(event.chat_id), relay_group)
+
+    elif event.kind == EventType.CHAT_DELETED:
+        index = get_relay_index(event.account)
+        relay_group_id = index.relay_by_outside.get(event.chat_id, event.chat_id)
+        if relay_group_id in index.outside_by_relay:
+            log.info(f"Chat {event.chat_id} was deleted, removing relay mapping of relay group {relay_group_id}")
+            remove_relay_group(event.account, relay_group_id)
 
 
 @relayhooks.on(events.MemberListChanged)
+@timed
 def member_added_or_removed(event):
     msg = event.message_snapshot
     account = msg.chat.account
     if msg.chat_id == get_crew_id_from_account(account):
         change = "added" if event.member_added else "removed"
         log.info("crew member %s was %s" % (event.member, change))
-        if not event.member_added:
+        if event.member_added:
+            onboard(msg, event.member)
+        else:
             offboard(msg, event.member)
 
 
 @relayhooks.on(events.NewMessage)
+@timed
 def incoming_message(event):
     msg = event.message_snapshot
     log.debug(msg)
-    msg.message.mark_seen()
     account = msg.chat.account
     crew_id = get_crew_id_from_account(account)
 
@@ -86,14 +149,16 @@ def incoming_message(event):
         handle_msg_in_relay_group(msg)
     else:
         handle_msg_in_outside_chat(msg)
+    log.debug("Snapshot cache: %(hits)d hits, %(misses)d misses, %(size)d entries" % get_cache(account).stats())
 
 
 def handle_msg_in_crew_chat(msg: AttrDict):
     account = msg.chat.account
 
     if msg.text.startswith("/"):
-        log.debug(f"handling command by {msg.sender.get_snapshot().name_and_addr}: {msg.text}")
+        log.debug(f"handling command by {contact_snapshot(msg.sender).name_and_addr}: {msg.text}")
         arguments = msg.text.split(" ")
+        COMMANDS.inc(command=arguments[0] if arguments[0] in CREW_COMMANDS else "unknown")
         if arguments[0] == "/help":
             reply(msg.chat, crew_help(), quote=msg.message)
         if arguments[0] == "/set_name":
@@ -124,20 +189,29 @@ def handle_msg_in_crew_chat(msg: AttrDict):
                 return reply(msg.chat, "Removed help message for outsiders", quote=msg.message)
             set_outside_help(account, help_message)
             reply(msg.chat, f"Set help message for outsiders to {help_message}", quote=msg.message)
+        if arguments[0] == "/set_flood_limit":
+            reply(msg.chat, set_flood_limit(account, msg.text.partition(" ")[2]), quote=msg.message)
     else:
         log.debug("Ignoring message, just the crew chatting")
 
 
 def handle_msg_in_relay_group(msg: AttrDict):
     account = msg.chat.account
-    if msg.quote:
+    if msg.text.startswith("/digest"):
+        COMMANDS.inc(command="/digest")
+        reply(msg.chat, set_digest(account, msg.chat_id, msg.text.partition(" ")[2]), quote=msg.message)
+    elif msg.quote:
         quoted_msg = account.get_message_by_id(msg.quote.message_id).get_snapshot()
         if quoted_msg.sender == account.self_contact:
-            if not msg.quote.text.startswith("This is the relay group for"):
-                log.debug("Forwarding message to outsider")
-                forward_to_outside(msg)
-            else:
+            if msg.quote.text.startswith("This is the relay group for"):
                 log.debug("Ignoring reply to the group creation message")
+            elif get_seen_set(account).first_time(msg, "relay"):
+                log.debug("Forwarding message to outsider")
+                try:
+                    forward_to_outside(msg)
+                except Exception:
+                    get_seen_set(account).release(msg)
+                    raise
         else:
             log.debug("Ignoring message, just the crew chatting")
     else:
@@ -150,7 +224,7 @@ def handle_msg_in_outside_chat(msg: AttrDict):
 
     # if the message came to an outside chat
     if msg.text.startswith("/help"):
-        log.info("Outsider %s asked for help", msg.sender.get_snapshot().name_and_addr)
+        log.info("Outsider %s asked for help", contact_snapshot(msg.sender).name_and_addr)
         help_message = outside_help(account)
         if help_message is None:
             help_message = f"I forward messages to the {account.get_config('displayname')} team."
@@ -159,18 +233,29 @@ def handle_msg_in_outside_chat(msg: AttrDict):
         else:
             log.debug(
                 "Sending help text to %s: %s",
-                msg.sender.get_snapshot().name_and_addr,
+                contact_snapshot(msg.sender).name_and_addr,
                 help_message,
             )
-            return reply(msg.chat, help_message, quote=msg.message)
-    log.debug("Forwarding message to relay group")
-    forward_to_relay_group(msg)
+            return reply(msg.chat, help_message, quote=msg.message, priority=PRIORITY_OUTSIDE)
+    seen_set = get_seen_set(account)
+    if not seen_set.first_time(msg, "outside"):
+        return
+    relay_group_id = get_relay_index(account).relay_by_outside.get(msg.chat_id)
+    guard = get_flood_guard(account)
+    with guard.ordered(msg.chat_id):
+        try:
+            if not guard.admit(msg, relay_group_id):
+                log.debug("Collecting message of a flooding outsider")
+                return
+            log.debug("Forwarding message to relay group")
+            forward_to_relay_group(msg)
+        except Exception:
+            seen_set.release(msg)
+            raise
 
 
 def handle_info_msg(msg: AttrDict, crew_id: int):
     """Handle an incoming info message, whether in the crew, a relay group, or an outside chat."""
-    account = msg.chat.account
-
     if msg.chat_id == crew_id:
         log.debug("Ignoring system message in crew.")
         return
@@ -179,11 +264,5 @@ def handle_info_msg(msg: AttrDict, crew_id: int):
     else:
         log.debug(f"This is a system message in the outside chat {msg.chat_id}")
         relay_group = get_relay_group(msg.chat)
-        if "image changed by" in msg.text:
-            relay_group.set_image(msg.chat.get_full_snapshot().profile_image)
-        if "name changed from" in msg.text:
-            group_name = "[%s] %s" % (
-                account.get_config("addr").split("@")[0],
-                msg.chat.get_full_snapshot().name,
-            )
-            relay_group.set_name(group_name)
+        if relay_group and ("image changed by" in msg.text or "name changed from" in msg.text):
+            sync_chat(msg.chat, relay_group)  # usually done already on CHAT_MODIFIED
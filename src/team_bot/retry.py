@@ -0,0 +1,190 @@
+import logging
+import random
+import re
+import threading
+import time
+import weakref
+from typing import Callable
+
+from deltachat_rpc_client import Account, Message, SpecialContactId
+from deltachat_rpc_client._utils import AttrDict
+
+from .cache import contact_snapshot
+from .metrics import DELIVERY_RETRIES
+from .store import get_store
+
+log = logging.getLogger("root")
+
+MAX_ATTEMPTS = 5
+BASE_DELAY = 60.0  # seconds until the first retry; every further retry waits twice as long
+MAX_DELAY = 3600.0
+RETRY_INTERVAL = 10.0  # how often to look for due retries
+BREAKER_THRESHOLD = 5  # failures in a row after which a domain is paused
+BREAKER_PAUSE = 600.0
+# SMTP 5xx replies and missing encryption won't go away by retrying.
+# A reply code starts a line, or follows ": " or "(", so ports like :587 or durations like 500 ms don't count.
+PERMANENT_ERROR = re.compile(r"(?:^|:\s+|\()5\d\d(?:[ )-]|$)|\b5\.\d+\.\d+\b|encryption", re.IGNORECASE | re.MULTILINE)
+
+
+def backoff(attempt: int, base_delay: float = BASE_DELAY, max_delay: float = MAX_DELAY, rng=random.random) -> float:
+    """Return how many seconds to wait before a retry: exponential, capped, with jitter.
+
+    The jitter spreads the retries of many messages which failed at once, e.g. during an outage of a provider.
+
+    :param attempt: the number of the retry, starting at 1
+    """
+    delay = min(max_delay, base_delay * 2 ** (attempt - 1))
+    return delay / 2 + rng() * delay / 2
+
+
+class CircuitBreaker:
+    """Pause the retries to a domain after repeated delivery failures.
+
+    It only gates the resends of Retries; the outbox still hands new messages to the core right away.
+    The core sends and retries each message itself, so holding back new ones wouldn't spare the domain.
+
+    :param threshold: pause a domain after this many failures in a row
+    :param pause: how many seconds to pause; after that, one retry is let through to probe the domain
+    :param clock: returns the current time in seconds
+    """
+
+    def __init__(
+        self, threshold: int = BREAKER_THRESHOLD, pause: float = BREAKER_PAUSE, clock: Callable[[], float] = time.time
+    ):
+        self.threshold = threshold
+        self.pause = pause
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.failures = {}
+        self.open_until = {}
+
+    def failure(self, domain: str):
+        with self.lock:
+            self.failures[domain] = self.failures.get(domain, 0) + 1
+            now = self.clock()
+            if self.failures[domain] >= self.threshold and self.open_until.get(domain, 0) <= now:
+                self.open_until[domain] = now + self.pause
+                log.warning(f"{self.failures[domain]} delivery failures to {domain}, pausing retries for {self.pause}s")
+
+    def success(self, domain: str):
+        with self.lock:
+            self.failures.pop(domain, None)
+            self.open_until.pop(domain, None)
+
+    def paused_until(self, domains: [str]) -> float:
+        """Return until when retries to any of the domains are paused, or 0 if they aren't."""
+        now = self.clock()
+        return max(
+            [self.open_until.get(domain, 0) for domain in domains if self.open_until.get(domain, 0) > now] or [0]
+        )
+
+
+class Retries:
+    """Retry failed deliveries to outside chats, persisted in the store of each account.
+
+    Until retrying is started, failed deliveries are reported to the crew right away.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.max_attempts = MAX_ATTEMPTS
+        self.base_delay = BASE_DELAY
+        self.max_delay = MAX_DELAY
+        self.breaker = CircuitBreaker()
+        self.clock = time.time
+        self.accounts = weakref.WeakKeyDictionary()  # per RPC connection and account ID
+
+    def start(self, max_attempts: int = MAX_ATTEMPTS, base_delay: float = BASE_DELAY, interval: float = RETRY_INTERVAL):
+        """Start retrying failed deliveries, and resend the due ones every interval seconds."""
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.enabled = True
+        threading.Thread(target=self._resend_periodically, args=(interval,), daemon=True).start()
+        log.info(f"Retrying failed deliveries up to {max_attempts} times")
+
+    def watch(self, account: Account):
+        """Resend the due messages of an account, including those which were due while the bot was down."""
+        self.accounts.setdefault(account._rpc, {})[account.id] = account
+
+    def failed(self, message: Message, snapshot: AttrDict) -> bool:
+        """Schedule the retry of a message which failed to be delivered to an outside chat.
+
+        :return: whether a retry was scheduled; if not, the failure should be reported to the crew
+        """
+        if not self.enabled:
+            return False
+        store = get_store(message.account)
+        retry = store.get_retry(message.id)
+        attempts = retry[0] + 1 if retry else 1
+        domains = retry[2].split() if retry else recipient_domains(snapshot)
+        for domain in domains:
+            self.breaker.failure(domain)
+        if PERMANENT_ERROR.search(snapshot.error or "") or attempts > self.max_attempts:
+            store.remove_retry(message.id)
+            DELIVERY_RETRIES.inc(outcome="given up")
+            return False
+        delay = max(
+            backoff(attempts, self.base_delay, self.max_delay), self.breaker.paused_until(domains) - self.clock()
+        )
+        store.set_retry(message.id, attempts, self.clock() + delay, " ".join(domains))
+        DELIVERY_RETRIES.inc(outcome="scheduled")
+        log.info(f"Delivery of message {message.id} failed, retry {attempts} of {self.max_attempts} in {delay:.0f}s")
+        return True
+
+    def delivered(self, account: Account, msg_id: int):
+        """Forget the retries of a message which was delivered in the end."""
+        if not self.enabled:
+            return
+        store = get_store(account)
+        retry = store.get_retry(msg_id)
+        if retry:
+            store.remove_retry(msg_id)
+            for domain in retry[2].split():
+                self.breaker.success(domain)
+            log.info(f"Message {msg_id} was delivered after {retry[0]} retries")
+
+    def resend_due(self, account: Account) -> int:
+        """Resend the messages of an account which are due for a retry, except to paused domains.
+
+        :return: how many messages were resent
+        """
+        store = get_store(account)
+        due = []
+        for msg_id, attempts, domains in store.due_retries(self.clock()):
+            paused_until = self.breaker.paused_until(domains.split())
+            if paused_until:
+                store.set_retry(msg_id, attempts, paused_until, domains)
+            else:
+                # MSG_DELIVERED or MSG_FAILED reschedules it; if neither comes, try again much later
+                store.set_retry(msg_id, attempts, self.clock() + self.max_delay, domains)
+                due.append(msg_id)
+        if due:
+            log.info(f"Account {account.id}: resending {len(due)} messages")
+            account._rpc.resend_messages(account.id, due)
+        return len(due)
+
+    def _resend_periodically(self, interval: float):
+        while True:
+            time.sleep(interval)
+            for accounts in list(self.accounts.values()):
+                for account in list(accounts.values()):
+                    try:
+                        self.resend_due(account)
+                    except Exception:
+                        log.exception(f"Resending the failed messages of account {account.id} failed")
+
+
+def recipient_domains(snapshot: AttrDict) -> [str]:
+    """Return the domains of the recipients of a message."""
+    domains = set()
+    for contact in snapshot.chat.get_contacts():
+        if contact.id != SpecialContactId.SELF:
+            domains.add(contact_snapshot(contact).address.rpartition("@")[2].lower())
+    return sorted(domains)
+
+
+RETRIES = Retries()
+
+
+def start_retrying(max_attempts: int = MAX_ATTEMPTS, base_delay: float = BASE_DELAY):
+    RETRIES.start(max_attempts, base_delay)
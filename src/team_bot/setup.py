@@ -1,8 +1,6 @@
-import json
 import logging
 import os
 
-import qrcode
 from deltachat_rpc_client import EventType, events
 
 from .util import get_crew_invite, has_crew
@@ -12,6 +10,13 @@ setuphooks = events.HookCollection()
 setuphooks.__name__ = "Setup hooks"
 
 
+def crew_created(event) -> bool:
+    """Return True once the crew exists; only check the config when a SecureJoin just finished."""
+    if event.kind in (EventType.SECUREJOIN_INVITER_PROGRESS, EventType.SECUREJOIN_JOINER_PROGRESS):
+        return event.progress == 1000 and has_crew(event)
+    return False
+
+
 @setuphooks.on(events.RawEvent)
 def catch_events(event):
     """This is called on every raw event and can be used for any kind of event handling.
@@ -38,6 +43,8 @@ def catch_events(event):
                 try:
                     log.debug(f"Crew invite already created: {event.account.crew_invite}")
                 except AttributeError:
+                    import qrcode  # noqa: PLC0415 - only needed until the crew exists
+
                     invite_link = get_crew_invite(event.account)
                     qr = qrcode.QRCode()
                     qr.add_data(invite_link)
@@ -45,11 +52,6 @@ def catch_events(event):
                     qr.print_ascii(invert=True)
                     print(f"\nOr click this invite link: {invite_link}")
 
-        if not event.account.get_config("ui.relay_groups"):
-            empty_list_json = json.dumps([])
-            event.account.set_config("ui.relay_groups", empty_list_json)
-            log.info("Initialized empty list of relay groups")
-
     if event.kind == EventType.SECUREJOIN_INVITER_PROGRESS or event.kind == EventType.SECUREJOIN_JOINER_PROGRESS:
         if event.progress == 1000:
             bot_addr = event.account.get_config("addr")
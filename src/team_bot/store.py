@@ -0,0 +1,288 @@
+import logging
+import os
+import sqlite3
+import threading
+import weakref
+
+from deltachat_rpc_client import Account
+
+log = logging.getLogger("root")
+
+STORE_FILENAME = "team-bot.sqlite"
+
+# Open stores of all accounts in this process, per RPC connection and account ID
+_stores = weakref.WeakKeyDictionary()
+
+
+class Store:
+    """The bot's own SQLite database, stored next to an account's dc.db.
+
+    It keeps the bookkeeping which doesn't fit into the account's config table.
+    """
+
+    schema = """
+    CREATE TABLE IF NOT EXISTS relay_groups (
+        outside_chat_id INTEGER PRIMARY KEY,
+        relay_group_id INTEGER NOT NULL UNIQUE
+    );
+    CREATE TABLE IF NOT EXISTS forwarded_messages (
+        sent_msg_id INTEGER PRIMARY KEY,
+        orig_chat_id INTEGER NOT NULL,
+        orig_msg_id INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS forwarded_messages_by_orig ON forwarded_messages (orig_msg_id);
+    CREATE TABLE IF NOT EXISTS relay_members (
+        contact_id INTEGER NOT NULL,
+        relay_group_id INTEGER NOT NULL,
+        PRIMARY KEY (contact_id, relay_group_id)
+    );
+    CREATE INDEX IF NOT EXISTS relay_members_by_group ON relay_members (relay_group_id);
+    CREATE TABLE IF NOT EXISTS digest_windows (
+        relay_group_id INTEGER PRIMARY KEY,
+        seconds REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS relay_images (
+        relay_group_id INTEGER PRIMARY KEY,
+        hash TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS relay_pool (
+        relay_group_id INTEGER PRIMARY KEY
+    );
+    CREATE TABLE IF NOT EXISTS retries (
+        msg_id INTEGER PRIMARY KEY,
+        attempts INTEGER NOT NULL,
+        next_attempt REAL NOT NULL,
+        domains TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS seen_messages (
+        rfc724_mid TEXT PRIMARY KEY,
+        seen REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS seen_messages_by_time ON seen_messages (seen);
+    CREATE TABLE IF NOT EXISTS flags (
+        name TEXT PRIMARY KEY
+    );
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(self.schema)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def relay_groups(self) -> [(int, int)]:
+        """Return all relay mappings as (outside chat ID, relay group ID) tuples."""
+        with self.lock:
+            return self.conn.execute("SELECT outside_chat_id, relay_group_id FROM relay_groups").fetchall()
+
+    def add_relay_group(self, outside_chat_id: int, relay_group_id: int):
+        """Append a relay mapping."""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO relay_groups (outside_chat_id, relay_group_id) VALUES (?, ?)",
+                (outside_chat_id, relay_group_id),
+            )
+
+    def remove_relay_group(self, relay_group_id: int):
+        """Delete the relay mapping of a relay group."""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM relay_groups WHERE relay_group_id = ?", (relay_group_id,))
+
+    def set_relay_groups(self, mappings: [(int, int)]):
+        """Replace all relay mappings in one transaction."""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM relay_groups")
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO relay_groups (outside_chat_id, relay_group_id) VALUES (?, ?)",
+                [tuple(mapping) for mapping in mappings],
+            )
+
+    def add_forwarded_message(self, sent_msg_id: int, orig_chat_id: int, orig_msg_id: int):
+        """Remember which message of the crew or of an outsider a message sent by the bot is a copy of."""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO forwarded_messages (sent_msg_id, orig_chat_id, orig_msg_id) VALUES (?, ?, ?)",
+                (sent_msg_id, orig_chat_id, orig_msg_id),
+            )
+
+    def get_original_message(self, sent_msg_id: int) -> (int, int):
+        """Return the chat ID and message ID a message sent by the bot originates from, or None."""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT orig_chat_id, orig_msg_id FROM forwarded_messages WHERE sent_msg_id = ?",
+                (sent_msg_id,),
+            ).fetchone()
+
+    def get_forwarded_copy(self, orig_msg_id: int) -> (int, int):
+        """Return the ID of the copy the bot sent of a message, and the ID of the message's chat, or None."""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT sent_msg_id, orig_chat_id FROM forwarded_messages WHERE orig_msg_id = ?", (orig_msg_id,)
+            ).fetchone()
+
+    def remove_forwarded_message(self, sent_msg_id: int):
+        """Forget a copy, e.g. because it was deleted."""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM forwarded_messages WHERE sent_msg_id = ?", (sent_msg_id,))
+
+    def set_relay_members(self, relay_group_id: int, contact_ids: [int]):
+        """Replace the members of a relay group in the membership index."""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM relay_members WHERE relay_group_id = ?", (relay_group_id,))
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO relay_members (contact_id, relay_group_id) VALUES (?, ?)",
+                [(contact_id, relay_group_id) for contact_id in contact_ids],
+            )
+
+    def add_relay_member(self, relay_group_id: int, contact_id: int):
+        """Add a member of a relay group to the membership index."""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO relay_members (contact_id, relay_group_id) VALUES (?, ?)",
+                (contact_id, relay_group_id),
+            )
+
+    def remove_relay_member(self, relay_group_id: int, contact_id: int):
+        """Remove a member of a relay group from the membership index."""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "DELETE FROM relay_members WHERE contact_id = ? AND relay_group_id = ?",
+                (contact_id, relay_group_id),
+            )
+
+    def relay_groups_of(self, contact_id: int) -> [int]:
+        """Return the IDs of all relay groups a contact is a member of."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT relay_group_id FROM relay_members WHERE contact_id = ? ORDER BY relay_group_id",
+                (contact_id,),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def digest_windows(self) -> [(int, float)]:
+        """Return the digest windows as (relay group ID, seconds) tuples."""
+        with self.lock:
+            return self.conn.execute("SELECT relay_group_id, seconds FROM digest_windows").fetchall()
+
+    def set_digest_window(self, relay_group_id: int, seconds: float):
+        """Set the digest window of a relay group, 0 removes it."""
+        with self.lock, self.conn:
+            if seconds:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO digest_windows (relay_group_id, seconds) VALUES (?, ?)",
+                    (relay_group_id, seconds),
+                )
+            else:
+                self.conn.execute("DELETE FROM digest_windows WHERE relay_group_id = ?", (relay_group_id,))
+
+    def get_image_hash(self, relay_group_id: int) -> str:
+        """Return the hash of the image which was last set for a relay group, or None if it has none."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT hash FROM relay_images WHERE relay_group_id = ?", (relay_group_id,)
+            ).fetchone()
+            return row[0] if row else None
+
+    def set_image_hash(self, relay_group_id: int, digest: str):
+        """Remember the hash of the image of a relay group; None means it has no image."""
+        with self.lock, self.conn:
+            if digest:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO relay_images (relay_group_id, hash) VALUES (?, ?)",
+                    (relay_group_id, digest),
+                )
+            else:
+                self.conn.execute("DELETE FROM relay_images WHERE relay_group_id = ?", (relay_group_id,))
+
+    def pool_groups(self) -> [int]:
+        """Return the IDs of the relay groups in the pool."""
+        with self.lock:
+            return [row[0] for row in self.conn.execute("SELECT relay_group_id FROM relay_pool").fetchall()]
+
+    def add_pool_group(self, relay_group_id: int):
+        """Put a relay group into the pool."""
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO relay_pool (relay_group_id) VALUES (?)", (relay_group_id,))
+
+    def claim_pool_group(self) -> int:
+        """Take the oldest relay group out of the pool, and return its ID, or None if the pool is empty."""
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT relay_group_id FROM relay_pool ORDER BY relay_group_id LIMIT 1").fetchone()
+            if row:
+                self.conn.execute("DELETE FROM relay_pool WHERE relay_group_id = ?", row)
+                return row[0]
+
+    def get_retry(self, msg_id: int) -> (int, float, str):
+        """Return how often a failed message was retried, when to retry next, and its recipient domains, or None."""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT attempts, next_attempt, domains FROM retries WHERE msg_id = ?", (msg_id,)
+            ).fetchone()
+
+    def set_retry(self, msg_id: int, attempts: int, next_attempt: float, domains: str):
+        """Schedule the next retry of a failed message, next_attempt is a UNIX timestamp."""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO retries (msg_id, attempts, next_attempt, domains) VALUES (?, ?, ?, ?)",
+                (msg_id, attempts, next_attempt, domains),
+            )
+
+    def remove_retry(self, msg_id: int):
+        """Stop retrying a message."""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM retries WHERE msg_id = ?", (msg_id,))
+
+    def due_retries(self, now: float) -> [(int, int, str)]:
+        """Return the messages which are due for a retry as (message ID, attempts, domains) tuples."""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT msg_id, attempts, domains FROM retries WHERE next_attempt <= ? ORDER BY next_attempt", (now,)
+            ).fetchall()
+
+    def add_seen_message(self, rfc724_mid: str, now: float) -> bool:
+        """Remember that a message was handled; return whether it was new, or handled before."""
+        with self.lock, self.conn:
+            cursor = self.conn.execute(
+                "INSERT OR IGNORE INTO seen_messages (rfc724_mid, seen) VALUES (?, ?)", (rfc724_mid, now)
+            )
+            return cursor.rowcount == 1
+
+    def has_seen_message(self, rfc724_mid: str) -> bool:
+        """Return whether a message was handled before."""
+        with self.lock:
+            return (
+                self.conn.execute("SELECT 1 FROM seen_messages WHERE rfc724_mid = ?", (rfc724_mid,)).fetchone()
+                is not None
+            )
+
+    def forget_seen_messages(self, before: float) -> int:
+        """Forget the messages which were handled before a UNIX timestamp, and return how many."""
+        with self.lock, self.conn:
+            return self.conn.execute("DELETE FROM seen_messages WHERE seen < ?", (before,)).rowcount
+
+    def has_flag(self, name: str) -> bool:
+        """Return whether a one-time job, e.g. building an index of this store, was done."""
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM flags WHERE name = ?", (name,)).fetchone() is not None
+
+    def set_flag(self, name: str):
+        """Remember that a one-time job was done."""
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO flags (name) VALUES (?)", (name,))
+
+
+def get_store(account: Account) -> Store:
+    """Return the store of an account, open it on first access."""
+    stores = _stores.setdefault(account._rpc, {})
+    store = stores.get(account.id)
+    if store is None:
+        account_dir = os.path.dirname(account.get_info().database_dir)
+        store = Store(os.path.join(account_dir, STORE_FILENAME))
+        log.debug(f"Opened {store.path} for account {account.id}")
+        stores[account.id] = store
+    return store
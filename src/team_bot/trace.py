@@ -0,0 +1,373 @@
+import hashlib
+import hmac
+import itertools
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+
+from deltachat_rpc_client import Account, Bot, DeltaChat, EventType, SpecialContactId, events
+from deltachat_rpc_client._utils import AttrDict, parse_system_add_remove
+
+from .bench import BenchResult, TimedBot
+from .cache import chat_snapshot, message_snapshot
+from .fakerpc import STATE_OUT_DELIVERED, FakeCore, FakeRpc
+from .store import get_store
+from .util import get_crew_id_from_account, get_relay_index, set_relay_groups
+
+log = logging.getLogger("root")
+
+TRACE_SIZE = 10  # megabytes per trace file
+TRACE_BACKUPS = 5  # how many rotated trace files to keep
+UNTRACED = (EventType.INFO, EventType.WARNING, EventType.ERROR)  # log lines, not workload
+RELAY_INTRO = "This is the relay group for"
+ADDRESS = re.compile(r"[^\s()<>,;:\"]+@[^\s()<>,;:\"]+")
+
+
+def redact_address(addr: str, key: bytes) -> str:
+    """Replace an email address with a pseudonym, which is stable within one trace.
+
+    :param key: the secret of the trace; without it, the pseudonyms can't be matched to addresses by hashing them
+    """
+    digest = hmac.new(key, addr.lower().encode(), hashlib.sha256).hexdigest()
+    return f"user-{digest[:8]}@example.invalid"
+
+
+def redact_text(text: str, key: bytes) -> str:
+    """Keep the command and the shape of a message text, replace its content with x's.
+
+    Email addresses are replaced with pseudonyms, so commands like /new_message keep working on replay.
+
+    :param key: the secret of the trace, to make the pseudonyms
+    """
+    command = ""
+    if text.startswith("/"):
+        command, _, text = text.partition(" ")
+        command += " " if text else ""
+    words = [
+        redact_address(word, key) if ADDRESS.fullmatch(word) else re.sub(r"\w", "x", word) for word in text.split(" ")
+    ]
+    return command + " ".join(words)
+
+
+def redact_info(text: str, key: bytes) -> str:
+    """Rewrite the text of an info message, keeping only what the relay hooks look at."""
+    added_or_removed = parse_system_add_remove(text)
+    if added_or_removed:
+        action, affected, actor = added_or_removed
+        return f"Member {redact_address(affected, key)} {action} by {redact_address(actor, key)}."
+    if "image changed by" in text:
+        return "Group image changed by x."
+    if "name changed from" in text:
+        return 'Group name changed from "x" to "x" by x.'
+    return redact_text(text, key)
+
+
+class TraceFileHandler(RotatingFileHandler):
+    """A rotating file handler which starts every new trace file with the state of the traced accounts.
+
+    That way the oldest remaining trace file can still be replayed after the first one was deleted.
+
+    :param tracer: the Tracer which knows the state of the traced accounts
+    """
+
+    def __init__(self, tracer: "Tracer", path: str, max_bytes: int, backups: int):
+        super().__init__(path, maxBytes=max_bytes, backupCount=backups)
+        self.tracer = tracer
+
+    def doRollover(self):
+        super().doRollover()
+        for account in self.tracer.accounts.values():
+            self.stream.write(self.tracer.format_state(account) + "\n")
+
+
+class Tracer:
+    """Record the events the bot receives to a rotating trace file, one JSON object per line.
+
+    Message texts are redacted; the trace keeps chat, contact, and message IDs,
+    which is enough to replay the workload on a fake account with replay().
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+        self.handler = None
+        self.key = None  # the secret for the pseudonyms, new for every trace and never written to it
+        self.traced = {}  # the relay index of each account, and how many of the mappings added to it were traced
+        self.accounts = {}  # the traced accounts, per account ID
+        self.crews = {}  # the crew chat ID and members of the traced accounts
+        self.logger = logging.getLogger("team_bot.trace")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+
+    def start(self, path: str, size: float = TRACE_SIZE, backups: int = TRACE_BACKUPS):
+        """Start writing the trace to a file, rotated when it grows larger than size megabytes."""
+        self.key = os.urandom(32)
+        self.handler = TraceFileHandler(self, path, int(size * 1024 * 1024), backups)
+        self.handler.setFormatter(logging.Formatter("%(message)s"))
+        self.logger.addHandler(self.handler)
+        self.enabled = True
+        log.info(f"Tracing events to {path}")
+
+    def stop(self):
+        """Stop writing the trace and close the file."""
+        self.enabled = False
+        self.logger.removeHandler(self.handler)
+        self.handler.close()
+
+    def write(self, account: Account, record: dict):
+        """Write a record, preceded by the relay mappings which were added since the last one."""
+        with self.lock:
+            index = get_relay_index(account)
+            traced_index, traced = self.traced.get(account.id, (None, 0))
+            # if the mappings were replaced, the index is new, and all of its mappings are
+            added = index.added[traced:] if traced_index is index else index.mappings()
+            for outside_id, relay_id in added:
+                self._write(account, {"type": "mapping", "outside": outside_id, "relay": relay_id})
+            self.traced[account.id] = (index, len(index.added))
+            self._write(account, record)
+
+    def _write(self, account: Account, record: dict):
+        self.logger.info(self.format(account, record))
+
+    def format(self, account: Account, record: dict) -> str:
+        record = {"t": round(time.monotonic() - self.started, 3), "account": account.id, **record}
+        return json.dumps(record, separators=(",", ":"))
+
+    def format_state(self, account: Account) -> str:
+        """Format the crew and the relay mappings of an account, the starting point of a replay."""
+        crew_id, crew = self.crews[account.id]
+        index = get_relay_index(account)
+        self.traced[account.id] = (index, len(index.added))
+        return self.format(
+            account, {"type": "state", "crew_id": crew_id, "crew": crew, "relay_groups": index.mappings()}
+        )
+
+    def record_state(self, account: Account):
+        """Start tracing an account with a record of its crew and relay mappings."""
+        crew_id = get_crew_id_from_account(account)
+        crew = account._rpc.get_chat_contacts(account.id, crew_id) if crew_id else []
+        with self.lock:
+            self.accounts[account.id] = account
+            self.crews[account.id] = (crew_id, crew)
+            self.logger.info(self.format_state(account))
+
+    def watch(self, client: Bot):
+        """Start tracing the account of a client: record its state, and add the trace hooks to the client."""
+        self.record_state(client.account)
+        client.add_hook(self.record_event, events.RawEvent())
+        client.add_hook(lambda event: self.record_message(event.message_snapshot), events.NewMessage())
+
+    def record_event(self, event: AttrDict):
+        """Record a raw event, with the IDs it refers to."""
+        if event.kind in UNTRACED:
+            return
+        record = {"type": "event", "kind": event.kind.value}
+        for key, value in event.items():
+            if key != "kind" and (value is None or isinstance(value, (bool, int))):
+                record[key] = value
+        if event.kind in (EventType.MSG_DELIVERED, EventType.MSG_FAILED):
+            record["orig"] = get_store(event.account).get_original_message(event.msg_id)
+        self.write(event.account, record)
+
+    def record_message(self, msg: AttrDict):
+        """Record an incoming message, with its text redacted and without its attachment."""
+        account = msg.chat.account
+        quote = None
+        if msg.quote and msg.quote.get("message_id"):
+            quoted = message_snapshot(account.get_message_by_id(msg.quote.message_id))
+            quote = {
+                "id": quoted.id,
+                "chat_id": quoted.chat_id,
+                "from_self": quoted.from_id == SpecialContactId.SELF,
+                "intro": quoted.text.startswith(RELAY_INTRO),
+            }
+        record = {
+            "type": "msg",
+            "id": msg.id,
+            "chat_id": msg.chat_id,
+            "chat_type": chat_snapshot(msg.chat).chat_type,
+            "from_id": msg.from_id,
+            "text": redact_info(msg.text, self.key) if msg.is_info else redact_text(msg.text, self.key),
+            "is_info": msg.is_info,
+            "info_contact_id": msg.info_contact_id,
+            "view_type": msg.view_type,
+            "file": bool(msg.file),
+            "quote": quote,
+        }
+        self.write(account, record)
+
+
+TRACER = Tracer()
+
+
+def start_tracing(path: str, size: float = TRACE_SIZE):
+    TRACER.start(path, size)
+
+
+def read_trace(path: str) -> [dict]:
+    """Read a trace file and its rotated predecessors, oldest record first."""
+    paths = [f"{path}.{i}" for i in range(TRACE_BACKUPS, 0, -1) if os.path.exists(f"{path}.{i}")] + [path]
+    records = []
+    for trace_path in paths:
+        with open(trace_path) as f:
+            records += [json.loads(line) for line in f if line.strip()]
+    return records
+
+
+class Replay(TimedBot):
+    """A bot account on a FakeRpc, which is fed the events of a trace.
+
+    Chats, contacts, and messages of the traced account which the trace refers to are created on demand with their
+    traced IDs. Relay groups the bot creates during the replay get new IDs; the mapping records of the trace
+    translate the traced IDs to them.
+
+    :param accounts_dir: the directory in which the fake accounts directory is created
+    :param records: the records of one traced account, read with read_trace()
+    """
+
+    def __init__(self, accounts_dir: str, records: [dict]):
+        super().__init__(DeltaChat(FakeRpc(FakeCore(tempfile.mkdtemp(dir=accounts_dir)))).add_account())
+        self.records = records
+        self.traced_relays = {}  # traced relay group ID -> outside chat ID, for relay groups created while tracing
+        self.account.set_config("configured_addr", "bot@example.invalid")
+        self.account.set_config("displayname", "Team Bot")
+        # messages the bot sends in the replay must not collide with traced IDs
+        fake_account = self.core.account(self.account.id)
+        fake_account.ids = itertools.count(max(self.traced_ids(), default=0) + 1)
+
+        state = next((record for record in records if record["type"] == "state"), None)
+        if state and state["crew_id"]:
+            crew = [self.core.ensure_contact(self.account.id, member) for member in state["crew"]]
+            self.core.ensure_chat(self.account.id, state["crew_id"], "Group", crew)
+            self.account.set_config("ui.crew_id", str(state["crew_id"]))
+            for outside_id, relay_id in state["relay_groups"]:
+                self.core.ensure_chat(self.account.id, outside_id, "Single", [self.placeholder_contact()])
+                self.core.ensure_chat(self.account.id, relay_id, "Group", crew)
+            set_relay_groups(self.account, [tuple(mapping) for mapping in state["relay_groups"]])
+
+    def traced_ids(self) -> [int]:
+        for record in self.records:
+            for key, value in record.items():
+                if key in ("id", "chat_id", "msg_id", "contact_id", "from_id", "outside", "relay", "crew_id"):
+                    if isinstance(value, int):
+                        yield value
+            for value in record.get("crew", []) + [
+                id_ for mapping in record.get("relay_groups", []) for id_ in mapping
+            ]:
+                yield value
+
+    def placeholder_contact(self) -> int:
+        return self.core.ensure_contact(self.account.id, next(self.core.account(self.account.id).ids))
+
+    def chat(self, chat_id: int, chat_type: str = "Single", contact_id: int = None) -> int:
+        """Translate a traced chat ID, and create the chat if it doesn't exist yet."""
+        if chat_id in self.traced_relays:
+            chat_id = get_relay_index(self.account).relay_by_outside.get(self.traced_relays[chat_id], chat_id)
+        if chat_id < 10:
+            return chat_id  # a special chat of the core
+        chats = self.core.account(self.account.id).chats
+        if chat_id not in chats:
+            self.core.ensure_chat(self.account.id, chat_id, chat_type, [contact_id or self.placeholder_contact()])
+        elif contact_id and contact_id not in chats[chat_id]["contactIds"] and chat_type == "Group":
+            chats[chat_id]["contactIds"].append(contact_id)
+        return chat_id
+
+    def message(self, msg_id: int, chat_id: int, from_id: int, text: str = "x") -> int:
+        """Create a placeholder for a traced message which the replay didn't receive or send itself."""
+        if msg_id not in self.core.account(self.account.id).messages:
+            self.core.add_message(self.account.id, chat_id, from_id, text, msg_id=msg_id)
+        return msg_id
+
+    def replay_mapping(self, record: dict):
+        # the relay group may be created after this record, when its hook ran after the trace hook
+        self.traced_relays[record["relay"]] = record["outside"]
+
+    def replay_event(self, record: dict):
+        kind = EventType(record["kind"])
+        fields = {key: value for key, value in record.items() if key not in ("t", "account", "type", "kind", "orig")}
+        if fields.get("chat_id"):
+            fields["chat_id"] = self.chat(fields["chat_id"])
+        if kind in (EventType.MSG_DELIVERED, EventType.MSG_FAILED):
+            self.message(fields["msg_id"], fields["chat_id"], SpecialContactId.SELF)
+            if kind == EventType.MSG_DELIVERED:
+                self.core.account(self.account.id).messages[fields["msg_id"]]["state"] = STATE_OUT_DELIVERED
+            if record.get("orig"):
+                orig_chat_id, orig_msg_id = record["orig"]
+                orig_chat_id = self.chat(orig_chat_id, "Group")
+                self.message(orig_msg_id, orig_chat_id, SpecialContactId.INFO)
+                get_store(self.account).add_forwarded_message(fields["msg_id"], orig_chat_id, orig_msg_id)
+        self.emit(kind, process_messages=False, **fields)
+
+    def replay_message(self, record: dict):
+        from_id = self.core.ensure_contact(self.account.id, record["from_id"])
+        chat_id = self.chat(record["chat_id"], record["chat_type"], from_id)
+        quoted_id = None
+        if record["quote"]:
+            quote = record["quote"]
+            quoted_id = self.message(
+                quote["id"],
+                self.chat(quote["chat_id"], "Group"),
+                SpecialContactId.SELF if quote["from_self"] else from_id,
+                f"{RELAY_INTRO} x" if quote["intro"] else "x",
+            )
+        if record["id"] in self.core.account(self.account.id).messages:
+            return  # received twice, e.g. as a member list change and as a new message
+        self.core.receive(
+            self.account.id,
+            chat_id,
+            from_id,
+            record["text"],
+            msg_id=record["id"],
+            quotedMessageId=quoted_id,
+            isInfo=record["is_info"],
+            infoContactId=record["info_contact_id"],
+            viewType=record["view_type"],
+        )
+        self.client._process_messages()
+
+    def run(self, speed: float = 0.0):
+        """Feed all records into the bot client.
+
+        :param speed: replay this many times faster than the trace was recorded, 0 for as fast as possible
+        """
+        start = time.perf_counter()
+        first = self.records[0]["t"] if self.records else 0
+        for record in self.records:
+            if speed:
+                time.sleep(max(0.0, (record["t"] - first) / speed - (time.perf_counter() - start)))
+            if record["type"] == "mapping":
+                self.replay_mapping(record)
+            elif record["type"] == "event":
+                self.replay_event(record)
+            elif record["type"] == "msg":
+                self.replay_message(record)
+
+
+def replay(path: str, speed: float = 0.0, account_id: int = None) -> BenchResult:
+    """Replay a trace through the relay hooks on a fake account, and measure it.
+
+    :param path: the trace file
+    :param speed: replay this many times faster than the trace was recorded, 0 for as fast as possible
+    :param account_id: which of the traced accounts to replay, the first one by default
+    """
+    records = read_trace(path)
+    if account_id is None:
+        account_id = records[0]["account"] if records else None
+    records = [record for record in records if record["account"] == account_id]
+    with tempfile.TemporaryDirectory(prefix="team-bot-replay-") as accounts_dir:
+        bot = Replay(accounts_dir, records)
+        events = sum(1 for record in records if record["type"] in ("event", "msg"))
+        result = bot.measure(f"replay of {path}, account {account_id}", max(events, 1), lambda: bot.run(speed))
+        bot.close()
+    return result
+
+
+def main(path: str, speed: float = 0.0, account_id: int = None):
+    """Replay a trace and print the results."""
+    print(replay(path, speed, account_id).report())
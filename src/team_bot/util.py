@@ -1,13 +1,36 @@
 import json
 import logging
 import re
+import weakref
 from typing import Optional
 
-from deltachat_rpc_client import Account, Chat, Message
+from deltachat_rpc_client import Account, Chat, Contact, Message
 from deltachat_rpc_client._utils import AttrDict
+from deltachat_rpc_client.rpc import JsonRpcError
+
+from .store import get_store
 
 log = logging.getLogger("root")
 
+# Relay indexes of all accounts in this process, per RPC connection and account ID
+_relay_indexes = weakref.WeakKeyDictionary()
+
+
+class RelayIndex:
+    """Bidirectional in-memory index of the relay mappings of one account."""
+
+    def __init__(self, mappings: [(int, int)]):
+        self.relay_by_outside = {}
+        self.outside_by_relay = {}
+        self.added = []  # the mappings added since the index was loaded, in order, e.g. for the tracer
+        for outside_id, relay_id in mappings:
+            self.relay_by_outside[outside_id] = relay_id
+            self.outside_by_relay[relay_id] = outside_id
+
+    def mappings(self) -> [(int, int)]:
+        """Return the relay mappings as a list of (outside chat ID, relay group ID) tuples."""
+        return list(self.relay_by_outside.items())
+
 
 def has_crew(event: AttrDict) -> Optional[bool]:
     account = event.account
@@ -29,16 +52,109 @@ def get_crew_invite(account: Account) -> str:
     return crew_invite
 
 
+def migrate_relay_groups(account: Account):
+    """Move the relay mappings from the old ui.relay_groups config value to the store."""
+    relay_json = account.get_config("ui.relay_groups")
+    if not relay_json:
+        return
+    mappings = [tuple(mapping) for mapping in json.loads(relay_json)]
+    store = get_store(account)
+    log.warning(f"Migrating {len(mappings)} relay mappings from ui.relay_groups to {store.path}")
+    store.set_relay_groups(store.relay_groups() + mappings)
+    account.set_config("ui.relay_groups", None)
+    log.warning("Migration of relay mappings successful.")
+
+
+def load_relay_groups(account: Account) -> RelayIndex:
+    """Load the relay mappings from the store into the in-memory index."""
+    migrate_relay_groups(account)
+    index = RelayIndex(get_store(account).relay_groups())
+    _relay_indexes.setdefault(account._rpc, {})[account.id] = index
+    log.debug(f"Loaded {len(index.relay_by_outside)} relay mappings for account {account.id}")
+    return index
+
+
+def get_relay_index(account: Account) -> RelayIndex:
+    """Return the in-memory relay index of an account, load it on first access."""
+    index = _relay_indexes.get(account._rpc, {}).get(account.id)
+    if index is None:
+        index = load_relay_groups(account)
+    return index
+
+
 def set_relay_groups(account: Account, mappings: [(int, int)]):
-    """Store the relay mappings list in the account's database"""
-    relay_json = json.dumps(mappings)
-    account.set_config("ui.relay_groups", relay_json)
+    """Replace all relay mappings in the store and update the index"""
+    get_store(account).set_relay_groups(mappings)
+    _relay_indexes.setdefault(account._rpc, {})[account.id] = RelayIndex(mappings)
+
+
+def add_relay_group(account: Account, outside_chat_id: int, relay_group_id: int):
+    """Append a relay mapping to the store and the index"""
+    get_store(account).add_relay_group(outside_chat_id, relay_group_id)
+    index = get_relay_index(account)
+    index.relay_by_outside[outside_chat_id] = relay_group_id
+    index.outside_by_relay[relay_group_id] = outside_chat_id
+    index.added.append((outside_chat_id, relay_group_id))
+
+
+def remove_relay_group(account: Account, relay_group_id: int):
+    """Delete a relay mapping from the store and the index"""
+    from .flood import get_flood_guard  # noqa: PLC0415 - flood imports util, through forwarding
+
+    get_store(account).remove_relay_group(relay_group_id)
+    get_store(account).set_relay_members(relay_group_id, [])
+    get_store(account).set_digest_window(relay_group_id, 0)
+    get_flood_guard(account).digests.pop(relay_group_id, None)
+    get_store(account).set_image_hash(relay_group_id, None)
+    index = get_relay_index(account)
+    outside_chat_id = index.outside_by_relay.pop(relay_group_id, None)
+    index.relay_by_outside.pop(outside_chat_id, None)
 
 
 def get_relay_groups(account: Account) -> [(int, int)]:
     """Get a list of all relay groups"""
-    relay_json = account.get_config("ui.relay_groups")
-    return json.loads(relay_json)
+    return get_relay_index(account).mappings()
+
+
+def refresh_relay_members(relay_group: Chat):
+    """Update the membership index with the current members of a relay group."""
+    contact_ids = [contact.id for contact in relay_group.get_contacts()]
+    get_store(relay_group.account).set_relay_members(relay_group.id, contact_ids)
+
+
+def index_relay_members(account: Account):
+    """Build the membership index from all relay groups, unless it was built already.
+
+    Whether it was built is kept in the store, next to the index itself,
+    so the index is built again if the store is lost, and not before it is complete.
+    """
+    store = get_store(account)
+    if store.has_flag("relay_members_indexed"):
+        return
+    log.info("Building the relay group membership index...")
+    for relay_group_id in get_relay_index(account).outside_by_relay:
+        try:
+            refresh_relay_members(account.get_chat_by_id(relay_group_id))
+        except JsonRpcError as e:
+            log.warning(f"Could not index the members of relay group {relay_group_id}: {e}")
+    store.set_flag("relay_members_indexed")
+
+
+def get_member_relay_groups(account: Account, contact: Contact) -> [Chat]:
+    """Return all relay groups a contact is a member of.
+
+    The first call builds the membership index from all relay groups, later calls only query it.
+    """
+    index_relay_members(account)
+    return [account.get_chat_by_id(chat_id) for chat_id in get_store(account).relay_groups_of(contact.id)]
+
+
+def get_ordering_key(account: Account, chat_id: Optional[int]) -> Optional[int]:
+    """Return the key of the chat's event ordering domain.
+
+    A relay group shares it with its outside chat, so that events concerning both are handled in order.
+    """
+    return get_relay_index(account).outside_by_relay.get(chat_id, chat_id)
 
 
 def is_relay_group(chat: Chat) -> bool:
@@ -52,16 +168,16 @@ def is_relay_group(chat: Chat) -> bool:
 
 def get_relay_group(outside_chat: Chat) -> Chat:
     """Return Relay group for an outside chat, return None if it isn't an outside group."""
-    for mapping in get_relay_groups(outside_chat.account):
-        if mapping[0] == outside_chat.id:
-            return outside_chat.account.get_chat_by_id(mapping[1])
+    relay_id = get_relay_index(outside_chat.account).relay_by_outside.get(outside_chat.id)
+    if relay_id is not None:
+        return outside_chat.account.get_chat_by_id(relay_id)
 
 
 def get_outside_chat(relay_group: Chat) -> Chat:
     """Return Outside group for a relay group, return None if it isn't a relay group."""
-    for mapping in get_relay_groups(relay_group.account):
-        if mapping[1] == relay_group.id:
-            return relay_group.account.get_chat_by_id(mapping[0])
+    outside_id = get_relay_index(relay_group.account).outside_by_relay.get(relay_group.id)
+    if outside_id is not None:
+        return relay_group.account.get_chat_by_id(outside_id)
 
 
 def parse_new_command_args(command_text: str) -> ([str], str, str):
@@ -84,6 +200,12 @@ def find_original_message(sent_message: Message, account: Account) -> (Chat, Mes
     :param account: the bot's account object
     :return: the chat the original message was sent in, and the original message.
     """
+    original = get_store(account).get_original_message(sent_message.id)
+    if original:
+        orig_chat_id, orig_msg_id = original
+        return account.get_chat_by_id(orig_chat_id), account.get_message_by_id(orig_msg_id)
+
+    log.debug(f"Message {sent_message.id} is not in the forwarding ledger, searching chat history")
     relay_group = get_relay_group(sent_message.get_snapshot().chat)
     sent_msg = sent_message.get_snapshot()
     for message in relay_group.get_messages().__reversed__():
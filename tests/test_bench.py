@@ -0,0 +1,52 @@
+import pytest
+from deltachat_rpc_client import DeltaChat
+from deltachat_rpc_client.rpc import JsonRpcError
+
+from team_bot.bench import bench_concurrency, bench_delivery_storm, bench_history, bench_relay, run_benchmarks
+from team_bot.fakerpc import FakeRpc
+
+
+def test_fake_rpc_counts_calls():
+    rpc = FakeRpc()
+    account = DeltaChat(rpc).add_account()
+    account.set_config("displayname", "Team Bot")
+    assert account.get_config("displayname") == "Team Bot"
+    assert rpc.calls == {"add_account": 1, "set_config": 1, "get_config": 1}
+    with pytest.raises(JsonRpcError):
+        account.get_chat_by_id(42).get_basic_snapshot()
+    with pytest.raises(JsonRpcError):
+        rpc.no_such_method(account.id)
+
+
+def test_relay_cost_independent_of_mappings(tmp_path):
+    few = bench_relay(str(tmp_path), 50, events=100)
+    many = bench_relay(str(tmp_path), 50000, events=100)
+    assert few.rpc_calls == many.rpc_calls
+    assert few.rpc_calls["send_msg"] == 100  # every message was relayed
+
+
+def test_delivery_storm_uses_ledger(tmp_path):
+    result = bench_delivery_storm(str(tmp_path), 1000, events=200)
+    assert result.rpc_calls["send_reaction"] == 200
+    assert "get_message_ids" not in result.rpc_calls  # no history scan
+    assert result.rpc_calls_per_event < 3
+
+
+def test_history_scan(tmp_path):
+    result = bench_history(str(tmp_path), history=100, events=2)
+    assert result.rpc_calls["send_reaction"] == 2
+    assert result.rpc_calls["get_message"] > 200
+
+
+def test_async_engine_beats_sync_loop(tmp_path):
+    sync, concurrent = bench_concurrency(str(tmp_path), events=50, latency=0.005)
+    assert sync.rpc_calls["send_msg"] == concurrent.rpc_calls["send_msg"] == 50
+    assert concurrent.seconds < sync.seconds
+
+
+def test_run_benchmarks():
+    results = run_benchmarks(mappings=[10], events=20, history=10)
+    assert len(results) == 6
+    report = "\n".join(result.report() for result in results)
+    assert "incoming_message" in report
+    assert "catch_events" in report
@@ -283,6 +283,27 @@ def test_offboarding(crew, bot, crew_member, outsider, log):
         assert crew_member.get_config("displayname") + " removed by " not in msg.get_snapshot().text
 
 
+@pytest.mark.timeout(TIMEOUT)
+def test_onboarding(crew, bot, crew_member, outsider, acfactory, log):
+    log.step("outsider sends message to team-bot")
+    bot_invite = bot.account.get_qr_code()
+    outsider_outside_chat = join_chat(outsider, bot_invite, log)
+    outsider_outside_chat.send_text("test 1:1 message to bot")
+    log.step("bot creates relay group")
+    bot._process_events(until_event=EventType.INCOMING_MSG)
+    bot_relay_group = bot.account.get_chat_by_id(get_relay_groups(bot.account)[0][1])
+
+    log.step("new crew member joins crew")
+    new_member = acfactory.get_online_account()
+    new_member.secure_join(crew.chat.get_qr_code())
+    new_member.wait_for_securejoin_joiner_success()
+    bot._process_events(until_event=EventType.INCOMING_MSG)
+
+    log.step("new crew member gets onboarded into the existing relay group")
+    relay_group_members = set(c.get_snapshot().address for c in bot_relay_group.get_contacts())
+    assert new_member.get_config("addr") in relay_group_members
+
+
 @pytest.mark.timeout(TIMEOUT)
 def test_default_outside_help(crew, bot, crew_member, outsider, log):
     log.step("create outside chat")
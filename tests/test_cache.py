@@ -0,0 +1,76 @@
+import threading
+
+from deltachat_rpc_client import EventType
+from deltachat_rpc_client._utils import AttrDict
+
+from team_bot.bench import Team
+from team_bot.cache import SnapshotCache, chat_snapshot
+from team_bot.dispatcher import DispatchingBot, ShardedDispatcher
+from team_bot.relay import relayhooks
+from team_bot.util import get_ordering_key
+
+
+def snapshot(name: str):
+    return lambda: AttrDict(name=name)
+
+
+def test_least_recently_used_is_evicted():
+    cache = SnapshotCache(maxsize=2)
+    cache.get("chat", 1, snapshot("one"))
+    cache.get("chat", 2, snapshot("two"))
+    assert cache.get("chat", 1, snapshot("changed")).name == "one"
+    cache.get("chat", 3, snapshot("three"))  # evicts chat 2, which was used longest ago
+    assert cache.get("chat", 1, snapshot("changed")).name == "one"
+    assert cache.get("chat", 2, snapshot("fetched again")).name == "fetched again"
+    assert cache.stats() == {"hits": 2, "misses": 4, "size": 2}
+
+
+def test_events_invalidate_snapshots():
+    cache = SnapshotCache()
+    for kind in ("chat", "contact", "message"):
+        for obj_id in (1, 2):
+            cache.get(kind, obj_id, snapshot("old"))
+
+    cache.on_event(AttrDict(kind=EventType.CHAT_MODIFIED, chat_id=1))
+    assert cache.get("chat", 1, snapshot("new")).name == "new"
+    assert cache.get("chat", 2, snapshot("new")).name == "old"
+
+    cache.on_event(AttrDict(kind=EventType.MSG_DELIVERED, chat_id=1, msg_id=2))
+    assert cache.get("message", 1, snapshot("new")).name == "old"
+    assert cache.get("message", 2, snapshot("new")).name == "new"
+
+    cache.on_event(AttrDict(kind=EventType.CONTACTS_CHANGED, contact_id=1))
+    assert cache.get("contact", 1, snapshot("newer")).name == "newer"
+    assert cache.get("contact", 2, snapshot("newer")).name == "old"
+    assert cache.get("chat", 2, snapshot("newer")).name == "newer"  # 1:1 chats show the contact's name
+
+
+def test_snapshot_invalidated_while_fetching_is_not_cached():
+    cache = SnapshotCache()
+
+    def fetch_during_change():
+        cache.invalidate("chat", 1)  # the core reports a change while the old snapshot is fetched
+        return AttrDict(name="old")
+
+    assert cache.get("chat", 1, fetch_during_change).name == "old"
+    assert cache.get("chat", 1, snapshot("new")).name == "new"
+    assert not cache.fetching
+
+
+def test_dispatcher_invalidates_before_queueing(tmp_path):
+    team = Team(str(tmp_path), 2)
+    dispatcher = ShardedDispatcher(1, report_interval=0)
+    bot = DispatchingBot(team.account, relayhooks, dispatcher)
+    _outside_id, relay_id = team.chats[0]
+    relay_group = team.account.get_chat_by_id(relay_id)
+    chat_snapshot(relay_group)
+    released = threading.Event()
+    dispatcher.submit((team.account.id, get_ordering_key(team.account, relay_id)), lambda: released.wait(5))
+
+    team.core.set_chat_name(team.account.id, relay_id, "Renamed")
+    bot._on_event(AttrDict(kind=EventType.CHAT_MODIFIED, account=team.account, chat_id=relay_id))
+    # the shard is still busy, but jobs of other chats already see the new name
+    assert chat_snapshot(relay_group).name == "Renamed"
+    released.set()
+    dispatcher.join()
+    team.close()
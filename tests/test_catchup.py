@@ -0,0 +1,48 @@
+import pytest
+from deltachat_rpc_client import EventType
+
+from team_bot import catchup
+from team_bot.bench import ACTIVE_CHATS, Team, bench_backlog
+from team_bot.fakerpc import STATE_IN_FRESH, STATE_IN_SEEN
+
+
+def test_backlog_is_marked_seen_per_chat(tmp_path):
+    result = bench_backlog(str(tmp_path), 100, events=200)
+    assert result.rpc_calls["markseen_msgs"] == ACTIVE_CHATS
+    assert result.rpc_calls["send_msg"] == 200  # every message was relayed
+
+
+def test_live_messages_are_handled_in_order(tmp_path):
+    team = Team(str(tmp_path), 10)
+    outside_id, relay_id = team.chats[0]
+    for i in range(3):
+        team.receive(outside_id, team.outsider_of(outside_id), f"Question {i}")
+    texts = [
+        team.core.get_message(team.account.id, msg_id)["text"]
+        for msg_id in team.core.get_message_ids(team.account.id, relay_id, False, False)
+    ]
+    assert texts[-3:] == ["Question 0", "Question 1", "Question 2"]
+    assert team.rpc.calls["markseen_msgs"] == 3
+    team.close()
+
+
+def test_crash_during_backlog_leaves_the_rest_unseen(tmp_path, monkeypatch):
+    team = Team(str(tmp_path), 30)
+    msg_ids = [
+        team.core.receive(team.account.id, outside_id, team.outsider_of(outside_id), "Hi")
+        for outside_id, _ in team.chats
+    ]
+    crashing_chat = team.chats[10][0]
+    handle_message = catchup.handle_message
+
+    def crash_in_one_chat(client, snapshot):
+        if snapshot.chat_id == crashing_chat:
+            raise RuntimeError("crash")
+        handle_message(client, snapshot)
+
+    monkeypatch.setattr(catchup, "handle_message", crash_in_one_chat)
+    with pytest.raises(RuntimeError):
+        team.emit(EventType.INCOMING_MSG, chat_id=0, msg_id=0)
+    states = [team.core.get_message(team.account.id, msg_id)["state"] for msg_id in msg_ids]
+    assert states == [STATE_IN_SEEN] * 10 + [STATE_IN_FRESH] * 20
+    team.close()
@@ -0,0 +1,40 @@
+from deltachat_rpc_client import EventType
+
+from team_bot.bench import Team
+from team_bot.chatsync import RECONCILIATION
+
+
+def test_image_synced_on_chat_modified(tmp_path):
+    team = Team(str(tmp_path), 1)
+    outside_id, relay_id = team.chats[0]
+    outsider = team.outsider_of(outside_id)
+    image = tmp_path / "avatar.png"
+    image.write_bytes(b"not really a png")
+
+    team.rpc.calls.clear()
+    for i in range(3):
+        team.receive(outside_id, outsider, f"Hello {i}")
+    assert not team.rpc.calls["set_chat_profile_image"]
+
+    team.core.set_chat_profile_image(team.account.id, outside_id, str(image))
+    team.emit(EventType.CHAT_MODIFIED, chat_id=outside_id)
+    assert team.core.get_basic_chat_info(team.account.id, relay_id)["profileImage"] == str(image)
+    assert team.rpc.calls["set_chat_profile_image"] == 1
+
+    # the same image under another name is not uploaded again
+    copy = tmp_path / "copy.png"
+    copy.write_bytes(image.read_bytes())
+    team.core.set_chat_profile_image(team.account.id, outside_id, str(copy))
+    team.emit(EventType.CHAT_MODIFIED, chat_id=outside_id)
+    assert team.rpc.calls["set_chat_profile_image"] == 1
+    team.close()
+
+
+def test_reconcile(tmp_path):
+    team = Team(str(tmp_path), 1)
+    outside_id, relay_id = team.chats[0]
+    team.core.set_chat_name(team.account.id, outside_id, "Renamed Outsider")
+    assert RECONCILIATION.reconcile(team.account) == 1
+    assert team.core.get_basic_chat_info(team.account.id, relay_id)["name"] == "[bot] Renamed Outsider"
+    assert RECONCILIATION.reconcile(team.account) == 0
+    team.close()
@@ -0,0 +1,64 @@
+from deltachat_rpc_client.rpc import JsonRpcError
+
+from team_bot.bench import Team
+from team_bot.dedup import SEEN_TTL, SeenSet
+from team_bot.metrics import DUPLICATES
+from team_bot.store import get_store
+
+
+def test_duplicate_not_relayed(tmp_path):
+    team = Team(str(tmp_path), 1)
+    outside_id, relay_id = team.chats[0]
+    outsider = team.outsider_of(outside_id)
+    duplicates = DUPLICATES.get(chat="outside")
+    relayed = len(team.core.get_message_ids(team.account.id, relay_id, False, False))
+
+    team.receive(outside_id, outsider, "Hello", rfc724Mid="hello@example.org")
+    team.receive(outside_id, outsider, "Hello", rfc724Mid="hello@example.org")
+    team.receive(outside_id, outsider, "Hello again")
+    assert len(team.core.get_message_ids(team.account.id, relay_id, False, False)) == relayed + 2
+    assert DUPLICATES.get(chat="outside") == duplicates + 1
+    team.close()
+
+
+def test_failed_relay_is_not_remembered(tmp_path, monkeypatch):
+    team = Team(str(tmp_path), 1)
+    outside_id, relay_id = team.chats[0]
+    outsider = team.outsider_of(outside_id)
+    relayed = len(team.core.get_message_ids(team.account.id, relay_id, False, False))
+    send_msg = team.core.send_msg
+
+    def fail(account_id: int, chat_id: int, draft: dict) -> int:
+        raise JsonRpcError({"code": -1, "message": "Sending failed"})
+
+    monkeypatch.setattr(team.core, "send_msg", fail)
+    team.receive(outside_id, outsider, "Hello", rfc724Mid="hello@example.org")
+    assert len(team.core.get_message_ids(team.account.id, relay_id, False, False)) == relayed
+
+    monkeypatch.setattr(team.core, "send_msg", send_msg)
+    team.receive(outside_id, outsider, "Hello", rfc724Mid="hello@example.org")  # e.g. fetched again after a restart
+    assert team.core.get_message(team.account.id, team.last_message(relay_id))["text"] == "Hello"
+    assert get_store(team.account).has_seen_message("hello@example.org")
+    team.close()
+
+
+def test_seen_messages_are_forgotten(tmp_path):
+    team = Team(str(tmp_path), 1)
+    outside_id, _ = team.chats[0]
+    now = [1000.0]
+    seen_set = SeenSet(team.account, clock=lambda: now[0])
+    msg_id = team.core.add_message(team.account.id, outside_id, team.outsider_of(outside_id), "Hello")
+    msg = team.account.get_message_by_id(msg_id).get_snapshot()
+    calls = team.rpc.calls["get_message_info_object"]
+    assert seen_set.first_time(msg, "outside")
+    assert not seen_set.first_time(msg, "outside")  # claimed, while it is relayed
+    seen_set.remember(msg)
+    assert not seen_set.first_time(msg, "outside")
+    assert team.rpc.calls["get_message_info_object"] == calls + 1
+
+    now[0] += SEEN_TTL * 2
+    assert seen_set.first_time(msg, "outside")
+    seen_set.release(msg)
+    assert seen_set.first_time(msg, "outside")
+    assert get_store(team.account).forget_seen_messages(now[0] + 1) == 0
+    team.close()
@@ -0,0 +1,91 @@
+import threading
+from typing import Callable
+
+from deltachat_rpc_client import EventType
+from deltachat_rpc_client._utils import AttrDict
+
+from team_bot.bench import Team
+from team_bot.dispatcher import DispatchingBot, InFlight, ShardedDispatcher
+from team_bot.fakerpc import STATE_IN_FRESH, STATE_IN_SEEN
+from team_bot.relay import relayhooks
+from team_bot.util import get_ordering_key
+
+
+def blocker() -> (threading.Event, threading.Event, Callable[[], None]):
+    """Return a job which blocks its shard until released, and the events to wait for it and to release it."""
+    started = threading.Event()
+    released = threading.Event()
+
+    def job():
+        started.set()
+        released.wait(5)
+
+    return started, released, job
+
+
+def test_messages_of_a_chat_are_relayed_in_order(tmp_path):
+    team = Team(str(tmp_path), 8)
+    dispatcher = ShardedDispatcher(4, report_interval=0)
+    bot = DispatchingBot(team.account, relayhooks, dispatcher)
+    for i in range(5):
+        for outside_id, _relay_id in team.chats:
+            team.core.receive(team.account.id, outside_id, team.outsider_of(outside_id), f"Question {i}")
+        bot._on_event(AttrDict(kind=EventType.INCOMING_MSG, account=team.account, chat_id=0, msg_id=0))
+        bot._process_messages()
+    dispatcher.join()
+    for _outside_id, relay_id in team.chats:
+        msg_ids = team.core.get_message_ids(team.account.id, relay_id, False, False)
+        texts = [team.core.get_message(team.account.id, msg_id)["text"] for msg_id in msg_ids]
+        assert texts[-5:] == [f"Question {i}" for i in range(5)]
+    assert team.rpc.calls["markseen_msgs"] == 5 * len(team.chats)
+    team.close()
+
+
+def test_relay_group_shares_the_shard_of_its_outside_chat(tmp_path):
+    team = Team(str(tmp_path), 8)
+    dispatcher = ShardedDispatcher(8, report_interval=0)
+    outside_key, relay_key = [(team.account.id, get_ordering_key(team.account, chat_id)) for chat_id in team.chats[3]]
+    assert outside_key == relay_key
+    started, released, job = blocker()
+    handled = threading.Event()
+    dispatcher.submit(outside_key, job)
+    started.wait(5)
+    dispatcher.submit(relay_key, handled.set)
+    assert not handled.wait(0.2)  # waits behind the job of its outside chat
+    released.set()
+    dispatcher.join()
+    assert handled.is_set()
+    team.close()
+
+
+def test_full_shard_blocks_submitting():
+    dispatcher = ShardedDispatcher(1, queue_size=1, report_interval=0)
+    started, released, job = blocker()
+    dispatcher.submit("chat", job)
+    started.wait(5)
+    dispatcher.submit("chat", lambda: None)  # fills the queue
+    submitter = threading.Thread(target=dispatcher.submit, args=("other chat", lambda: None), daemon=True)
+    submitter.start()
+    submitter.join(0.2)
+    assert submitter.is_alive()
+    released.set()
+    submitter.join(5)
+    assert not submitter.is_alive()
+    dispatcher.join()
+
+
+def test_in_flight_messages_are_queued_once(tmp_path):
+    team = Team(str(tmp_path), 1)
+    outside_id, relay_id = team.chats[0]
+    msg_id = team.core.receive(team.account.id, outside_id, team.outsider_of(outside_id), "Hello")
+    in_flight = InFlight()
+    message = team.account.get_message_by_id(msg_id)
+    assert in_flight.add_new([message]) == [message]
+    assert in_flight.add_new([message]) == []  # fetched again before it was marked as seen
+    assert team.core.get_message(team.account.id, msg_id)["state"] == STATE_IN_FRESH
+
+    in_flight.handle(team.client, [message.get_snapshot()])
+    assert team.core.get_message(team.account.id, msg_id)["state"] == STATE_IN_SEEN
+    assert team.core.get_message(team.account.id, team.last_message(relay_id))["text"] == "Hello"
+    assert in_flight.add_new([message]) == [message]
+    team.close()
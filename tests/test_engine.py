@@ -0,0 +1,55 @@
+import asyncio
+import time
+
+from deltachat_rpc_client import EventType
+from deltachat_rpc_client._utils import AttrDict
+
+from team_bot.bench import Team
+from team_bot.engine import AsyncRelayEngine
+
+
+def test_jobs_of_a_chat_run_in_order(tmp_path):
+    team = Team(str(tmp_path), 4)
+    (outside_id, relay_id), (other_id, _) = team.chats[:2]
+    handled = []
+
+    def job(chat_id: int, number: int):
+        time.sleep(0.05 - number * 0.01)  # later jobs are quicker, they would overtake earlier ones
+        handled.append((chat_id, number))
+
+    async def run(engine: AsyncRelayEngine):
+        for number in range(4):
+            engine.dispatch(outside_id if number % 2 else relay_id, lambda number=number: job(outside_id, number))
+            engine.dispatch(other_id, lambda number=number: job(other_id, number))
+        await engine.drain()
+
+    engine = AsyncRelayEngine(team.client)
+    asyncio.run(run(engine))
+    assert [number for chat_id, number in handled if chat_id == outside_id] == [0, 1, 2, 3]
+    assert [number for chat_id, number in handled if chat_id == other_id] == [0, 1, 2, 3]
+    assert handled[:2] != [(outside_id, 0), (outside_id, 1)]  # the other chat didn't wait
+    assert not engine.locks and not engine.waiting
+    team.close()
+
+
+def test_messages_of_a_chat_are_relayed_in_order(tmp_path):
+    team = Team(str(tmp_path), 8)
+    team.rpc.latency = 0.001
+
+    async def run(engine: AsyncRelayEngine):
+        for i in range(5):
+            for outside_id, _relay_id in team.chats:
+                msg_id = team.core.receive(team.account.id, outside_id, team.outsider_of(outside_id), f"Question {i}")
+                engine.dispatch_event(
+                    AttrDict(kind=EventType.INCOMING_MSG, account=team.account, chat_id=outside_id, msg_id=msg_id)
+                )
+            await engine.dispatch_messages()
+        await engine.drain()
+
+    asyncio.run(run(AsyncRelayEngine(team.client)))
+    for _outside_id, relay_id in team.chats:
+        msg_ids = team.core.get_message_ids(team.account.id, relay_id, False, False)
+        texts = [team.core.get_message(team.account.id, msg_id)["text"] for msg_id in msg_ids]
+        assert texts[-5:] == [f"Question {i}" for i in range(5)]
+    assert team.rpc.calls["markseen_msgs"] == 5 * len(team.chats)
+    team.close()
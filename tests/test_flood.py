@@ -0,0 +1,136 @@
+import threading
+
+from deltachat_rpc_client._utils import AttrDict
+
+from team_bot.bench import Team
+from team_bot.commands import crew_help
+from team_bot.flood import FloodGuard, get_flood_guard
+from team_bot.relay import CREW_COMMANDS
+from team_bot.store import get_store
+from team_bot.util import remove_relay_group
+
+
+def test_flood_is_merged(tmp_path):
+    team = Team(str(tmp_path), 10)
+    outside_id, relay_id = team.chats[0]
+    crew_chat_id = team.crew.id
+    team.receive(crew_chat_id, team.crew_members[0], "/set_flood_limit 2")
+    assert "over 2 per minute" in team.core.get_message(team.account.id, team.last_message(crew_chat_id))["text"]
+
+    relayed = len(team.core.get_message_ids(team.account.id, relay_id, False, False))
+    for i in range(5):
+        team.receive(outside_id, team.outsider_of(outside_id), f"Spam {i}")
+    messages = team.core.get_message_ids(team.account.id, relay_id, False, False)
+    assert len(messages) == relayed + 2
+
+    get_flood_guard(team.account).flush_all()
+    merged = team.core.get_message(team.account.id, team.last_message(relay_id))["text"]
+    assert merged.startswith("⚠️ 3 messages over the limit of 2 per minute")
+    assert merged.endswith("Spam 2\n\nSpam 3\n\nSpam 4")
+
+    other_outside_id, other_relay_id = team.chats[1]
+    team.receive(other_outside_id, team.outsider_of(other_outside_id), "Hello")
+    assert team.core.get_message(team.account.id, team.last_message(other_relay_id))["text"] == "Hello"
+    team.close()
+
+
+def test_digest(tmp_path):
+    team = Team(str(tmp_path), 10)
+    outside_id, relay_id = team.chats[0]
+    outsider = team.outsider_of(outside_id)
+    team.receive(relay_id, team.crew_members[0], "/digest 30")
+    relayed = len(team.core.get_message_ids(team.account.id, relay_id, False, False))
+    team.receive(outside_id, outsider, "Hi")
+    team.receive(outside_id, outsider, "I have a question")
+    assert len(team.core.get_message_ids(team.account.id, relay_id, False, False)) == relayed
+
+    team.receive(outside_id, outsider, "", viewType="Image", file="/tmp/image.png", fileName="image.png")
+    messages = team.core.get_message_ids(team.account.id, relay_id, False, False)
+    digest, image = [team.core.get_message(team.account.id, msg_id) for msg_id in messages[-2:]]
+    assert digest["text"] == "Hi\n\nI have a question"
+    assert image["viewType"] == "Image"
+
+    team.receive(relay_id, team.crew_members[0], "/digest 0")
+    team.receive(outside_id, outsider, "Thanks")
+    assert team.core.get_message(team.account.id, team.last_message(relay_id))["text"] == "Thanks"
+    team.close()
+
+
+def test_flood_keeps_attachments(tmp_path):
+    team = Team(str(tmp_path), 10)
+    outside_id, relay_id = team.chats[0]
+    outsider = team.outsider_of(outside_id)
+    guard = get_flood_guard(team.account)
+    assert not guard.limit  # off by default
+    guard.set_limit(1)
+    team.receive(outside_id, outsider, "Hi")
+    relayed = len(team.core.get_message_ids(team.account.id, relay_id, False, False))
+    team.receive(outside_id, outsider, "", viewType="Image", file="/tmp/one.png", fileName="one.png")
+    team.receive(outside_id, outsider, "Did you see it?")
+    team.receive(outside_id, outsider, "And this one", viewType="Image", file="/tmp/two.png", fileName="two.png")
+    team.receive(outside_id, outsider, "Hello?")
+    assert len(team.core.get_message_ids(team.account.id, relay_id, False, False)) == relayed
+
+    guard.flush_all()
+    messages = team.core.get_message_ids(team.account.id, relay_id, False, False)[relayed:]
+    one, text, two, last = [team.core.get_message(team.account.id, msg_id) for msg_id in messages]
+    assert one["fileName"] == "one.png" and one["text"].startswith("⚠️ 4 messages over the limit")
+    assert text["text"] == "Did you see it?"
+    assert (two["fileName"], two["text"]) == ("two.png", "And this one")
+    assert last["text"] == "Hello?"
+    team.close()
+
+
+def test_idle_buckets_are_dropped():
+    now = [0.0]
+    guard = FloodGuard(limit=2, clock=lambda: now[0])
+    for sender in range(3):
+        guard.over_limit(AttrDict(from_id=sender, chat_id=10 + sender))
+    assert len(guard.buckets) == 6
+    now[0] = 30.0
+    guard.over_limit(AttrDict(from_id=0, chat_id=10))
+    assert len(guard.buckets) == 6  # the window isn't over yet
+    now[0] = 61.0
+    guard.over_limit(AttrDict(from_id=1, chat_id=11))
+    assert set(guard.buckets) == {("contact", 0), ("chat", 10), ("contact", 1), ("chat", 11)}
+
+
+def test_digest_window_removed_with_the_relay_group(tmp_path):
+    team = Team(str(tmp_path), 2)
+    _outside_id, relay_id = team.chats[0]
+    team.receive(relay_id, team.crew_members[0], "/digest 30")
+    assert get_flood_guard(team.account).digests == {relay_id: 30.0}
+    assert "/digest" in CREW_COMMANDS and "/digest" in crew_help()
+
+    remove_relay_group(team.account, relay_id)
+    assert get_flood_guard(team.account).digests == {}
+    assert dict(get_store(team.account).digest_windows()) == {}
+    team.close()
+
+
+def test_collected_message_keeps_the_senders_quota():
+    guard = FloodGuard(limit=2, clock=lambda: 0.0)
+    assert not guard.over_limit(AttrDict(from_id=1, chat_id=10))
+    assert not guard.over_limit(AttrDict(from_id=2, chat_id=10))
+    assert guard.over_limit(AttrDict(from_id=1, chat_id=10))  # the chat is over the limit, not the sender
+    assert not guard.over_limit(AttrDict(from_id=1, chat_id=11))
+    assert guard.over_limit(AttrDict(from_id=1, chat_id=11))
+
+
+def test_flush_waits_for_the_chat(tmp_path):
+    team = Team(str(tmp_path), 10)
+    outside_id, relay_id = team.chats[0]
+    guard = get_flood_guard(team.account)
+    guard.set_limit(1)
+    for i in range(2):
+        team.receive(outside_id, team.outsider_of(outside_id), f"Spam {i}")
+    with guard.ordered(outside_id):  # e.g. a relay hook is relaying a message of the chat
+        flush = threading.Thread(target=guard.flush, args=(outside_id,), daemon=True)
+        flush.start()
+        flush.join(0.2)
+        assert flush.is_alive()
+        assert team.core.get_message(team.account.id, team.last_message(relay_id))["text"] == "Spam 0"
+    flush.join(5)
+    merged = team.core.get_message(team.account.id, team.last_message(relay_id))["text"]
+    assert merged.endswith("merged into one:\n\nSpam 1")
+    team.close()
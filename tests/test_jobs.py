@@ -0,0 +1,99 @@
+import threading
+
+from deltachat_rpc_client._utils import AttrDict
+
+from team_bot import jobs
+from team_bot.bench import Team
+from team_bot.commands import onboard
+from team_bot.jobs import ONBOARDING_PAUSE, MembershipJob
+from team_bot.outbox import OUTBOXES, PRIORITY_CREW
+from team_bot.store import Store, _stores, get_store
+from team_bot.util import get_member_relay_groups
+
+
+def test_membership_job_in_batches(tmp_path):
+    team = Team(str(tmp_path), 5)
+    contact = team.account.get_contact_by_id(team.contact("new@example.org", "New Member"))
+    relay_groups = [team.account.get_chat_by_id(relay_id) for _outside_id, relay_id in team.chats]
+    store = get_store(team.account)
+
+    MembershipJob(team.account, contact, relay_groups, batch_size=2).run()
+    for relay_group in relay_groups:
+        assert contact.id in team.core.get_chat_contacts(team.account.id, relay_group.id)
+    assert store.relay_groups_of(contact.id) == sorted(relay_group.id for relay_group in relay_groups)
+    reports = [
+        team.core.get_message(team.account.id, msg_id)["text"]
+        for msg_id in team.core.get_message_ids(team.account.id, team.crew.id, False, False)
+    ]
+    assert reports == [f"Adding New Member: {done} of 5 relay groups done." for done in (2, 4, 5)]
+
+    team.core.delete_chat(team.account.id, relay_groups[0].id)  # failures don't stop the job
+    MembershipJob(team.account, contact, relay_groups, remove=True).run()
+    for relay_group in relay_groups[1:]:
+        assert contact.id not in team.core.get_chat_contacts(team.account.id, relay_group.id)
+    assert store.relay_groups_of(contact.id) == [relay_groups[0].id]
+    team.close()
+
+
+def test_progress_is_reported_through_the_outbox(tmp_path, monkeypatch):
+    monkeypatch.setattr(OUTBOXES, "enabled", True)
+    monkeypatch.setattr(OUTBOXES, "rate", 1000)
+    monkeypatch.setattr(OUTBOXES, "outboxes", type(OUTBOXES.outboxes)())
+    team = Team(str(tmp_path), 3)
+    contact = team.account.get_contact_by_id(team.contact("new@example.org", "New Member"))
+    relay_groups = [team.account.get_chat_by_id(relay_id) for _outside_id, relay_id in team.chats]
+    outbox = OUTBOXES.get(team.account)
+    submitted = []
+    submit = outbox.submit
+    monkeypatch.setattr(outbox, "submit", lambda priority, job: submitted.append(priority) or submit(priority, job))
+
+    MembershipJob(team.account, contact, relay_groups, batch_size=2).run()
+    outbox.join()
+    assert submitted == [PRIORITY_CREW, PRIORITY_CREW]
+    last = team.core.get_message(team.account.id, team.last_message(team.crew.id))["text"]
+    assert last == "Adding New Member: 3 of 3 relay groups done."
+    team.close()
+
+
+def test_membership_index_is_built_with_the_store(tmp_path):
+    team = Team(str(tmp_path), 3)
+    member = team.crew_members[0]
+    relay_ids = sorted(relay_id for _outside_id, relay_id in team.chats)
+    contact = team.account.get_contact_by_id(member)
+    assert [chat.id for chat in get_member_relay_groups(team.account, contact)] == relay_ids
+
+    team.rpc.calls.clear()
+    assert [chat.id for chat in get_member_relay_groups(team.account, contact)] == relay_ids
+    assert "get_chat_contacts" not in team.rpc.calls  # the index was not built again
+
+    # a new store, e.g. after team-bot.sqlite was deleted, gets a new index
+    get_store(team.account).close()
+    _stores[team.account._rpc][team.account.id] = Store(str(tmp_path / "new.sqlite"))
+    assert get_store(team.account).relay_groups_of(member) == []
+    assert [chat.id for chat in get_member_relay_groups(team.account, contact)] == relay_ids
+    team.close()
+
+
+def test_onboarding_in_batches(tmp_path, monkeypatch):
+    team = Team(str(tmp_path), 25)
+    pauses = []
+    monkeypatch.setattr(jobs.time, "sleep", pauses.append)
+    own_outside_id, own_relay_id = team.chats[0]
+    new_member = team.outsider_of(own_outside_id)  # an outsider who joins the crew
+    team.core.add_contact_to_chat(team.account.id, team.crew.id, new_member)
+
+    msg = AttrDict(chat=team.crew, info_contact_id=new_member)
+    onboard(msg, "outsider 0")
+    for thread in threading.enumerate():
+        if isinstance(thread, MembershipJob):
+            thread.join(5)
+    assert pauses == [ONBOARDING_PAUSE]
+    for _outside_id, relay_id in team.chats[1:]:
+        assert new_member in team.core.get_chat_contacts(team.account.id, relay_id)
+    assert new_member not in team.core.get_chat_contacts(team.account.id, own_relay_id)
+    reports = [
+        team.core.get_message(team.account.id, msg_id)["text"]
+        for msg_id in team.core.get_message_ids(team.account.id, team.crew.id, False, False)
+    ]
+    assert reports == [f"Adding Outsider 0: {done} of 24 relay groups done." for done in (20, 24)]
+    team.close()
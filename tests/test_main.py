@@ -0,0 +1,91 @@
+import logging
+import threading
+import time
+
+from deltachat_rpc_client import DeltaChat, SpecialContactId
+
+from team_bot.dispatcher import ShardedDispatcher
+from team_bot.fakerpc import FakeCore, FakeRpc
+from team_bot.main import make_client, run_bots, serve_account
+from team_bot.util import get_relay_index
+
+log = logging.getLogger("root")
+
+
+class Stop(Exception):
+    """Raised by the fake core to end the event loop of a test."""
+
+
+def wait_for(condition, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def serve_until_stopped(client):
+    try:
+        serve_account(log, client)
+    except Stop:
+        pass
+
+
+def test_setup_with_workers(tmp_path):
+    rpc = FakeRpc(FakeCore(str(tmp_path)))
+    account = DeltaChat(rpc).add_account()
+    rpc.core.set_config(account.id, "configured_addr", "bot@example.org")
+    user = rpc.core.create_contact(account.id, "user@example.org")
+    client = make_client(account, dispatcher=ShardedDispatcher(2, report_interval=0))
+    thread = threading.Thread(target=serve_until_stopped, args=(client,), daemon=True)
+    thread.start()
+
+    rpc.core.push_event(account.id, "SecurejoinInviterProgress", contactId=user, progress=1000)
+    assert wait_for(lambda: any(client._hooks.values())), "the setup phase didn't end"
+    crew_id = int(rpc.core.get_config(account.id, "ui.crew_id"))
+    assert set(rpc.core.get_chat_contacts(account.id, crew_id)) == {SpecialContactId.SELF, user}
+    assert len(rpc.core.get_message_ids(account.id, crew_id, False, False)) == 1
+
+    rpc.core.fail_events(account.id, Stop())
+    thread.join(5)
+    assert not thread.is_alive()
+
+
+def make_team_account(rpc: FakeRpc, name: str):
+    """Add an account with a crew and an outsider who wrote to it, the message not handled yet."""
+    core = rpc.core
+    account = DeltaChat(rpc).add_account()
+    core.set_config(account.id, "configured_addr", f"{name}@example.org")
+    crew_id = core.create_group_chat(account.id, "Team", True)
+    core.add_contact_to_chat(account.id, crew_id, core.create_contact(account.id, f"crew@{name}.example.org"))
+    core.set_config(account.id, "ui.crew_id", str(crew_id))
+    outside_id = core.create_chat_by_contact_id(account.id, core.create_contact(account.id, f"outsider@{name}.org"))
+    msg_id = core.receive(account.id, outside_id, core.get_chat_contacts(account.id, outside_id)[0], f"Hi {name}")
+    core.push_event(account.id, "IncomingMsg", chatId=outside_id, msgId=msg_id)
+    return account, outside_id
+
+
+def test_run_bots_stops_when_an_account_fails(tmp_path):
+    rpc = FakeRpc(FakeCore(str(tmp_path / "core")))
+    accounts = [make_team_account(rpc, name) for name in ("one", "two")]
+    errors = []
+
+    def run():
+        try:
+            run_bots(log, accounts_dir=str(tmp_path), rpc_class=lambda accounts_dir, **kwargs: rpc)
+        except RuntimeError as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    for account, outside_id in accounts:  # both accounts are served
+        assert wait_for(lambda: outside_id in get_relay_index(account).relay_by_outside)
+        relay_id = get_relay_index(account).relay_by_outside[outside_id]
+        assert wait_for(lambda: len(rpc.core.get_message_ids(account.id, relay_id, False, False)) > 1)
+
+    rpc.core.fail_events(accounts[0][0].id, OSError("connection lost"))
+    thread.join(5)
+    assert not thread.is_alive()
+    assert f"Account {accounts[0][0].id} stopped serving" in str(errors[0])
+    assert isinstance(errors[0].__cause__, OSError)
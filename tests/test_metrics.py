@@ -0,0 +1,53 @@
+import urllib.request
+
+from team_bot.bench import bench_delivery_storm, bench_relay
+from team_bot.metrics import (
+    DELIVERIES,
+    HANDLER_SECONDS,
+    RELAY_GROUPS_CREATED,
+    RELAYED,
+    MeteredRpc,
+    Registry,
+    serve_metrics,
+)
+
+
+def test_render():
+    registry = Registry()
+    counter = registry.counter("test_total", "Things counted", ("kind",))
+    histogram = registry.histogram("test_seconds", "Things timed")
+    counter.inc(kind="a")
+    counter.inc(2, kind="a")
+    histogram.observe(0.2)
+    histogram.observe(20)
+    text = registry.render()
+    assert '# TYPE test_total counter\ntest_total{kind="a"} 3\n' in text
+    assert 'test_seconds_bucket{le="0.25"} 1\n' in text
+    assert 'test_seconds_bucket{le="+Inf"} 2\n' in text
+    assert "test_seconds_count 2\n" in text
+
+
+def test_relay_metrics(tmp_path):
+    outside_to_crew = RELAYED.get(direction="outside_to_crew")
+    crew_to_outside = RELAYED.get(direction="crew_to_outside")
+    handled = HANDLER_SECONDS.count(hook="incoming_message")
+    bench_relay(str(tmp_path), 10, events=20)
+    assert RELAYED.get(direction="outside_to_crew") == outside_to_crew + 10
+    assert RELAYED.get(direction="crew_to_outside") == crew_to_outside + 10
+    assert HANDLER_SECONDS.count(hook="incoming_message") == handled + 20
+
+    delivered = DELIVERIES.get(result="delivered")
+    created = RELAY_GROUPS_CREATED.get()
+    bench_delivery_storm(str(tmp_path), 10, events=20)
+    assert DELIVERIES.get(result="delivered") >= delivered + 20
+    assert RELAY_GROUPS_CREATED.get() == created  # the bench creates its relay groups upfront
+
+
+def test_metered_rpc():
+    rpc = MeteredRpc()
+    rpc.get_config
+    rpc.get_config
+    server = serve_metrics(0)
+    text = urllib.request.urlopen(f"http://127.0.0.1:{server.server_port}/metrics").read().decode()
+    server.shutdown()
+    assert 'teambot_rpc_calls_total{method="get_config"} 2' in text
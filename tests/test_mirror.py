@@ -0,0 +1,79 @@
+from deltachat_rpc_client import EventType, SpecialContactId
+
+from team_bot.bench import Team
+
+
+def test_mirror_outsider_changes(tmp_path):
+    team = Team(str(tmp_path), 1)
+    outside_id, relay_id = team.chats[0]
+    account_id = team.account.id
+    orig_id = team.receive(outside_id, team.outsider_of(outside_id), "Helo")
+    copy_id = team.last_message(relay_id)
+
+    team.core.account(account_id).message(orig_id).update(text="Hello", isEdited=True)
+    team.emit(EventType.MSGS_CHANGED, chat_id=outside_id, msg_id=orig_id)
+    assert team.core.get_message(account_id, copy_id)["text"] == "Hello"
+    assert team.core.get_message(account_id, copy_id)["isEdited"]
+
+    team.core.react(account_id, copy_id, team.crew_members[0], ["👍"])
+    team.emit(EventType.REACTIONS_CHANGED, chat_id=relay_id, msg_id=copy_id, contact_id=team.crew_members[0])
+    reactions = team.core.get_message_reactions(account_id, orig_id)
+    assert reactions["reactionsByContact"][str(SpecialContactId.SELF)] == ["👍"]
+
+    team.core.delete_messages_for_all(account_id, [orig_id])
+    team.emit(EventType.MSG_DELETED, chat_id=outside_id, msg_id=orig_id)
+    assert copy_id not in team.core.get_message_ids(account_id, relay_id, False, False)
+    team.close()
+
+
+def test_mirror_crew_edit(tmp_path):
+    team = Team(str(tmp_path), 1)
+    outside_id, relay_id = team.chats[0]
+    account_id = team.account.id
+    question = team.receive(outside_id, team.outsider_of(outside_id), "Question?")
+    answer_id = team.receive(relay_id, team.crew_members[0], "Anwser", quotedMessageId=team.last_message(relay_id))
+    copy_id = team.last_message(outside_id)
+    assert copy_id != question
+
+    team.core.account(account_id).message(answer_id).update(text="Answer", isEdited=True)
+    team.emit(EventType.MSGS_CHANGED, chat_id=relay_id, msg_id=answer_id)
+    assert team.core.get_message(account_id, copy_id)["text"] == "Answer"
+    team.close()
+
+
+def test_housekeeping_deletions_are_not_mirrored(tmp_path):
+    team = Team(str(tmp_path), 2)
+    account_id = team.account.id
+    for (outside_id, relay_id), delete_device_after in zip(team.chats, (None, "3600")):
+        if delete_device_after:
+            team.core.set_config(account_id, "delete_device_after", delete_device_after)
+        else:
+            team.core.set_chat_ephemeral_timer(account_id, outside_id, 60)
+        orig_id = team.receive(outside_id, team.outsider_of(outside_id), "Hello")
+        copy_id = team.last_message(relay_id)
+        team.core.account(account_id).message(copy_id)["timestamp"] -= 3600
+        team.core.delete_messages_for_all(account_id, [orig_id])
+        team.emit(EventType.MSG_DELETED, chat_id=outside_id, msg_id=orig_id)
+        assert copy_id in team.core.get_message_ids(account_id, relay_id, False, False)
+    team.close()
+
+
+def test_delivery_reaction_keeps_mirrored_reactions(tmp_path):
+    team = Team(str(tmp_path), 1)
+    outside_id, relay_id = team.chats[0]
+    account_id = team.account.id
+    team.receive(outside_id, team.outsider_of(outside_id), "Question?")
+    answer_id = team.receive(relay_id, team.crew_members[0], "Answer", quotedMessageId=team.last_message(relay_id))
+    copy_id = team.last_message(outside_id)
+
+    team.core.react(account_id, copy_id, team.outsider_of(outside_id), ["👍"])
+    team.emit(EventType.REACTIONS_CHANGED, chat_id=outside_id, msg_id=copy_id, contact_id=team.outsider_of(outside_id))
+    team.emit(EventType.MSG_DELIVERED, chat_id=outside_id, msg_id=copy_id)
+    reactions = team.core.get_message_reactions(account_id, answer_id)["reactionsByContact"]
+    assert sorted(reactions[str(SpecialContactId.SELF)]) == sorted(["✅", "👍"])
+
+    team.core.react(account_id, copy_id, team.outsider_of(outside_id), ["🎉"])
+    team.emit(EventType.REACTIONS_CHANGED, chat_id=outside_id, msg_id=copy_id, contact_id=team.outsider_of(outside_id))
+    reactions = team.core.get_message_reactions(account_id, answer_id)["reactionsByContact"]
+    assert sorted(reactions[str(SpecialContactId.SELF)]) == sorted(["✅", "🎉"])
+    team.close()
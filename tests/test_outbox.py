@@ -0,0 +1,92 @@
+import threading
+import time
+
+from deltachat_rpc_client.rpc import JsonRpcError
+
+from team_bot.bench import Team
+from team_bot.outbox import (
+    OUTBOXES,
+    PRIORITY_CREW,
+    PRIORITY_OUTSIDE,
+    PRIORITY_REACTION,
+    Outbox,
+    TokenBucket,
+)
+
+
+def test_token_bucket():
+    now = [0.0]
+    bucket = TokenBucket(rate=2, burst=3, clock=lambda: now[0])
+    assert [bucket.take() for _ in range(4)] == [0.0, 0.0, 0.0, 0.5]
+    now[0] = 1.5  # 3 new tokens, but 1 was borrowed
+    assert [bucket.take() for _ in range(3)] == [0.0, 0.0, 0.5]
+
+
+def test_priorities():
+    outbox = Outbox(1, rate=1000, size=10)
+    sent = []
+    blocked = threading.Event()
+    outbox.submit(PRIORITY_CREW, blocked.wait)
+    outbox.submit(PRIORITY_REACTION, lambda: sent.append("✅"))
+    outbox.submit(PRIORITY_CREW, lambda: sent.append("copy 1"))
+    outbox.submit(PRIORITY_OUTSIDE, lambda: sent.append("answer"))
+    outbox.submit(PRIORITY_CREW, lambda: sent.append("copy 2"))
+    blocked.set()
+    outbox.join()
+    assert sent == ["answer", "copy 1", "copy 2", "✅"]
+
+
+def test_submit_from_worker_does_not_block():
+    outbox = Outbox(1, rate=1000, size=1)
+    sent = []
+
+    def send_twice():
+        outbox.submit(PRIORITY_CREW, lambda: sent.append("first"))
+        outbox.submit(PRIORITY_CREW, lambda: sent.append("second"))  # the queue is full
+
+    outbox.submit(PRIORITY_OUTSIDE, send_twice)
+    outbox.join()
+    assert sent == ["first"]
+
+
+def test_relay_through_outbox(tmp_path, monkeypatch):
+    monkeypatch.setattr(OUTBOXES, "enabled", True)
+    monkeypatch.setattr(OUTBOXES, "rate", 1000)
+    team = Team(str(tmp_path), 10)
+    outside_id, relay_id = team.chats[0]
+    team.receive(outside_id, team.outsider_of(outside_id), "Question")
+    OUTBOXES.get(team.account).join()
+    forwarded = team.last_message(relay_id)
+    team.receive(relay_id, team.crew_members[0], "Answer", quotedMessageId=forwarded)
+    OUTBOXES.get(team.account).join()
+    answer = team.core.get_message(team.account.id, team.last_message(outside_id))
+    assert answer["text"] == "Answer"
+    team.close()
+
+
+def test_failure_reported_from_full_outbox(tmp_path, monkeypatch):
+    monkeypatch.setattr(OUTBOXES, "enabled", True)
+    monkeypatch.setattr(OUTBOXES, "rate", 1000)
+    monkeypatch.setattr(OUTBOXES, "size", 1)
+    monkeypatch.setattr(OUTBOXES, "outboxes", type(OUTBOXES.outboxes)())
+    team = Team(str(tmp_path), 10)
+    outside_id, relay_id = team.chats[0]
+    outbox = OUTBOXES.get(team.account)
+    send_msg = team.core.send_msg
+
+    def fail_with_full_outbox(account_id: int, chat_id: int, draft: dict) -> int:
+        if chat_id != outside_id:
+            return send_msg(account_id, chat_id, draft)
+        threading.Thread(target=outbox.submit, args=(PRIORITY_REACTION, lambda: None)).start()
+        while not outbox.queue.full():
+            time.sleep(0.001)
+        raise JsonRpcError({"code": -1, "message": "Sending failed"})
+
+    monkeypatch.setattr(team.core, "send_msg", fail_with_full_outbox)
+    team.receive(relay_id, team.crew_members[0], "Answer", quotedMessageId=team.last_message(relay_id))
+    joined = threading.Thread(target=outbox.join, daemon=True)
+    joined.start()
+    joined.join(5)
+    assert not joined.is_alive(), "the outbox is stuck"
+    assert team.core.get_message(team.account.id, team.last_message(relay_id))["text"] == "Sending message failed."
+    team.close()
@@ -0,0 +1,35 @@
+from team_bot import forwarding
+from team_bot.bench import Team
+from team_bot.pool import POOL_GROUP_NAME, RelayPools
+from team_bot.store import get_store
+from team_bot.util import get_relay_index
+
+
+def test_claim_from_pool(tmp_path, monkeypatch):
+    team = Team(str(tmp_path), 1)
+    pools = RelayPools()
+    pools.start(2)
+    monkeypatch.setattr(forwarding, "POOLS", pools)
+    pool = pools.get(team.account)
+    pool.fill()
+    pooled = get_store(team.account).pool_groups()
+    assert len(pooled) == 2
+    for relay_id in pooled:
+        assert team.core.get_basic_chat_info(team.account.id, relay_id)["name"] == POOL_GROUP_NAME
+        assert team.core.get_basic_chat_info(team.account.id, relay_id)["isUnpromoted"]
+
+    # a crew member who leaves the crew doesn't get the messages of new outsiders
+    left = team.crew_members[0]
+    team.core.remove_contact_from_chat(team.account.id, team.crew.id, left)
+
+    outsider = team.contact("new@example.org", "New Outsider")
+    outside_id = team.core.create_chat_by_contact_id(team.account.id, outsider)
+    team.receive(outside_id, outsider, "Hello")
+    relay_id = get_relay_index(team.account).relay_by_outside[outside_id]
+    assert relay_id == pooled[0]
+    assert team.core.get_basic_chat_info(team.account.id, relay_id)["name"] == "[bot] New Outsider"
+    members = team.core.get_chat_contacts(team.account.id, relay_id)
+    assert left not in members
+    assert set(team.crew_members[1:]) <= set(members)
+    assert team.core.get_message(team.account.id, team.last_message(relay_id))["text"] == "Hello"
+    team.close()
@@ -0,0 +1,45 @@
+import threading
+
+from deltachat_rpc_client import Bot, DeltaChat, EventType
+from deltachat_rpc_client._utils import AttrDict
+
+from team_bot.fakerpc import FakeRpc
+from team_bot.profiling import EVENT_LOOP, Profiler, profiled
+from team_bot.relay import relayhooks
+
+
+def test_attribution():
+    profiler = Profiler(slowest=1)
+
+    def slow_hook(event):
+        profiler.count_rpc("get_config")
+        profiler.count_rpc("get_message")
+        profiler.time_rpc(0.01)
+
+    def fast_hook(event):
+        profiler.count_rpc("get_config")
+
+    profiler.wrap(slow_hook)(AttrDict(kind=EventType.MSG_DELIVERED, chat_id=42, msg_id=1))
+    profiler.wrap(fast_hook)(AttrDict(message_snapshot=AttrDict(chat_id=43, is_info=False)))
+    thread = threading.Thread(target=profiler.count_rpc, args=("wait_for_event",))
+    thread.start()
+    thread.join()
+
+    assert profiler.handlers["test_profiling.slow_hook"].rpc_calls == {"get_config": 1, "get_message": 1}
+    assert profiler.handlers["test_profiling.fast_hook"].rpc_calls == {"get_config": 1}
+    assert profiler.handlers[EVENT_LOOP].rpc_calls == {"wait_for_event": 1}
+    report = profiler.report()
+    assert "test_profiling.slow_hook: 1 calls" in report
+    assert "in chat 4" in report
+    assert len(profiler.slowest) == 1
+
+
+def test_hooks_can_be_removed():
+    assert profiled(relayhooks) is relayhooks  # profiling is off
+    profiler = Profiler()
+    client = Bot(DeltaChat(FakeRpc()).add_account())
+    client.add_hooks(profiler.wrap_hooks(relayhooks))
+    assert sum(len(hooks) for hooks in client._hooks.values()) == 3
+    for hook, event in profiler.wrap_hooks(relayhooks):
+        client.remove_hook(hook, event)
+    assert sum(len(hooks) for hooks in client._hooks.values()) == 0
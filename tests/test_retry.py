@@ -0,0 +1,85 @@
+from deltachat_rpc_client import EventType
+
+from team_bot.bench import Team
+from team_bot.retry import PERMANENT_ERROR, RETRIES, CircuitBreaker, backoff
+from team_bot.store import get_store
+
+
+def test_backoff():
+    assert backoff(1, 60, rng=lambda: 0.0) == 30
+    assert backoff(3, 60, rng=lambda: 1.0) == 240
+    assert backoff(10, 60, max_delay=3600, rng=lambda: 1.0) == 3600
+
+
+def test_permanent_errors():
+    for error in (
+        "550 5.1.1 User unknown",
+        "SMTP error: 554 Transaction failed",
+        "Permanent SMTP error (552)",
+        "State: 24\n\n550-Mailbox full",
+        "Message could not be sent: encryption is required",
+    ):
+        assert PERMANENT_ERROR.search(error), error
+    for error in (
+        "Connection to smtp.example.org:587 failed: timed out",
+        "failed to send after 500 ms",
+        "SMTP error: 451 4.3.0 Try again later",
+    ):
+        assert not PERMANENT_ERROR.search(error), error
+
+
+def test_circuit_breaker():
+    now = [0.0]
+    breaker = CircuitBreaker(threshold=2, pause=100, clock=lambda: now[0])
+    breaker.failure("example.org")
+    assert not breaker.paused_until(["example.org"])
+    breaker.failure("example.org")
+    assert breaker.paused_until(["example.net", "example.org"]) == 100
+    now[0] = 101
+    assert not breaker.paused_until(["example.org"])  # let a probe through
+    breaker.success("example.org")
+    breaker.failure("example.org")
+    assert not breaker.paused_until(["example.org"])
+
+
+def test_retry_until_exhausted(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(RETRIES, "enabled", True)
+    monkeypatch.setattr(RETRIES, "max_attempts", 2)
+    monkeypatch.setattr(RETRIES, "clock", lambda: now[0])
+    monkeypatch.setattr(RETRIES, "breaker", CircuitBreaker(clock=lambda: now[0]))
+    team = Team(str(tmp_path), 10)
+    outside_id, relay_id = team.chats[0]
+    messages = team.core.account(team.account.id).messages
+
+    def answer(text: str) -> (int, int):
+        team.receive(outside_id, team.outsider_of(outside_id), "Question")
+        forwarded = team.last_message(relay_id)
+        answer_id = team.receive(relay_id, team.crew_members[0], text, quotedMessageId=forwarded)
+        return answer_id, team.last_message(outside_id)
+
+    def fail(sent_id: int):
+        messages[sent_id]["error"] = "421 Service not available, try again later"
+        team.emit(EventType.MSG_FAILED, chat_id=outside_id, msg_id=sent_id)
+
+    answer_id, sent_id = answer("Answer")
+    fail(sent_id)
+    assert messages[answer_id]["reactions"] is None  # not reported yet
+    assert team.rpc.calls["resend_messages"] == 0
+    now[0] += 3600
+    assert RETRIES.resend_due(team.account) == 1
+    assert RETRIES.resend_due(team.account) == 0  # waits for the outcome
+    fail(sent_id)
+    now[0] += 3600
+    RETRIES.resend_due(team.account)
+    fail(sent_id)
+    assert messages[answer_id]["reactions"]["reactions"][0]["emoji"] == "❌"
+    assert "Delivery failed" in messages[team.last_message(relay_id)]["text"]
+    assert team.rpc.calls["resend_messages"] == 2
+
+    answer_id, sent_id = answer("Second answer")
+    fail(sent_id)
+    team.emit(EventType.MSG_DELIVERED, chat_id=outside_id, msg_id=sent_id)
+    assert messages[answer_id]["reactions"]["reactions"][0]["emoji"] == "✅"
+    assert get_store(team.account).get_retry(sent_id) is None
+    team.close()
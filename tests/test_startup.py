@@ -0,0 +1,43 @@
+import subprocess
+import sys
+
+# How many milliseconds importing team_bot.main may take, generous enough for slow CI machines
+IMPORT_BUDGET_MS = 500
+
+
+def import_times(*args: str) -> {str: int}:
+    """Run the team-bot CLI with -X importtime, return the cumulative import time of each module in µs."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "from team_bot.main import main; main()", *args],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line.split("|")
+        times[module.strip()] = int(cumulative)
+    return times
+
+
+def test_help_skips_heavy_imports():
+    times = import_times("--help")
+    assert "team_bot.main" in times
+    for module in (
+        "pickledb",
+        "qrcode",
+        "asyncio",
+        "team_bot.trace",
+        "team_bot.bench",
+        "team_bot.fakerpc",
+        "team_bot.profiling",
+        "team_bot.dispatcher",
+    ):
+        assert module not in times, f"{module} is imported on startup"
+
+
+def test_import_time_budget():
+    times = import_times("--help")
+    assert times["team_bot.main"] / 1000 < IMPORT_BUDGET_MS
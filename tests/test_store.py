@@ -0,0 +1,39 @@
+import json
+
+from deltachat_rpc_client import DeltaChat
+
+from team_bot.fakerpc import FakeCore, FakeRpc
+from team_bot.store import get_store
+from team_bot.util import load_relay_groups, migrate_relay_groups
+
+MAPPINGS = [(10, 20), (11, 21), (12, 22)]
+
+
+def make_account(tmp_path, mappings: [(int, int)]):
+    account = DeltaChat(FakeRpc(FakeCore(str(tmp_path)))).add_account()
+    account.set_config("ui.relay_groups", json.dumps(mappings))
+    return account
+
+
+def test_migrate_relay_groups(tmp_path):
+    account = make_account(tmp_path, MAPPINGS)
+    migrate_relay_groups(account)
+    store = get_store(account)
+    assert sorted(store.relay_groups()) == MAPPINGS
+    assert account.get_config("ui.relay_groups") is None
+
+    migrate_relay_groups(account)  # nothing left to migrate
+    assert sorted(store.relay_groups()) == MAPPINGS
+    assert load_relay_groups(account).relay_by_outside == {10: 20, 11: 21, 12: 22}
+    store.close()
+
+
+def test_resume_half_finished_migration(tmp_path):
+    account = make_account(tmp_path, MAPPINGS)
+    store = get_store(account)
+    store.set_relay_groups(MAPPINGS[:2])  # the mappings were copied, but the config value wasn't cleared
+    store.add_relay_group(13, 23)  # a relay group created after the store existed
+    migrate_relay_groups(account)
+    assert sorted(store.relay_groups()) == MAPPINGS + [(13, 23)]
+    assert account.get_config("ui.relay_groups") is None
+    store.close()
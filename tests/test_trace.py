@@ -0,0 +1,63 @@
+from deltachat_rpc_client import EventType
+from deltachat_rpc_client._utils import AttrDict
+
+from team_bot.bench import Team
+from team_bot.trace import Tracer, read_trace, redact_address, redact_info, redact_text, replay
+from team_bot.util import add_relay_group, get_relay_index, remove_relay_group
+
+
+def test_redact():
+    key = b"k" * 32
+    alice = redact_address("alice@example.org", key)
+    assert alice.endswith("@example.invalid") and alice == redact_address("Alice@Example.org", key)
+    assert alice != redact_address("alice@example.org", b"another trace")
+    assert redact_text("/new_message alice@example.org Hi, there", key) == f"/new_message {alice} xx, xxxxx"
+    assert redact_text("Call me maybe", key) == "xxxx xx xxxxx"
+    info = redact_info("Member Alice (alice@example.org) added by bob@example.org.", key)
+    assert info == f"Member {alice} added by {redact_address('bob@example.org', key)}."
+
+
+def test_record_and_replay(tmp_path):
+    path = str(tmp_path / "trace.jsonl")
+    team = Team(str(tmp_path), 10)
+    tracer = Tracer()
+    tracer.start(path)
+    tracer.watch(team.client)
+    outsider = team.contact("new@example.org", "Newcomer")
+    outside_id = team.core.create_chat_by_contact_id(team.account.id, outsider)
+
+    def run():
+        team.receive(outside_id, outsider, "My secret question")
+        relay_id = get_relay_index(team.account).relay_by_outside[outside_id]
+        team.receive(relay_id, team.crew_members[0], "Answer", quotedMessageId=team.last_message(relay_id))
+        team.emit(EventType.MSG_DELIVERED, chat_id=outside_id, msg_id=team.last_message(outside_id))
+
+    original = team.measure("original", 5, run)
+    tracer.stop()
+    team.close()
+    assert "secret" not in open(path).read()
+    assert [record["type"] for record in read_trace(path)].count("mapping") == 1
+
+    replayed = replay(path)
+    for method in ("create_group_chat", "send_msg", "send_reaction"):
+        assert replayed.rpc_calls[method] == original.rpc_calls[method] > 0
+
+
+def test_mappings_traced_after_removal(tmp_path):
+    path = str(tmp_path / "trace.jsonl")
+    team = Team(str(tmp_path), 3)
+    tracer = Tracer()
+    tracer.start(path)
+    tracer.record_state(team.account)
+    (outside_id, relay_id), (other_outside_id, other_relay_id) = team.chats[:2]
+    remove_relay_group(team.account, relay_id)
+    add_relay_group(team.account, outside_id, 1000)
+    tracer.record_event(AttrDict(kind=EventType.INCOMING_MSG, account=team.account, chat_id=outside_id, msg_id=1))
+    remove_relay_group(team.account, other_relay_id)
+    tracer.record_event(AttrDict(kind=EventType.INCOMING_MSG, account=team.account, chat_id=outside_id, msg_id=2))
+    add_relay_group(team.account, other_outside_id, 1001)
+    tracer.record_event(AttrDict(kind=EventType.INCOMING_MSG, account=team.account, chat_id=outside_id, msg_id=3))
+    tracer.stop()
+    team.close()
+    mappings = [(record["outside"], record["relay"]) for record in read_trace(path) if record["type"] == "mapping"]
+    assert mappings == [(outside_id, 1000), (other_outside_id, 1001)]